@@ -1,35 +1,168 @@
 import re
-from typing import List
+from functools import lru_cache
+from typing import Iterator, List, Optional
 
 from instruction import Instruction
 
 
+NUM_F_REGISTERS = 32
+# Lines are tokenized and validated once per distinct text, so re-assembling an edited program only does the work for
+# the lines that changed
+LINE_CACHE_SIZE = 1 << 16
+
+_TOKEN_PATTERN = re.compile(r"(\w+)")
+_F_REGISTER_REFERENCE_PATTERN = re.compile(r"\bf(\d+)\b")
+_MACRO_NAME_PATTERN = re.compile(r"^[a-z_]\w*$")
+_F_REGISTER_PATTERN = re.compile(r"(^(f[0-9]||f1[0-9]||f2[0-9]|f3[0-1])$)")
+_X_REGISTER_PATTERN = re.compile(r"(^(x[0-9]||x1[0-9]||x2[0-9]|x3[0-1])$)")
+_NUMBER_PATTERN = re.compile(R"(^-?\d+$)")
+
+
 def assemble(raw_code=""):
-    success = True
-    offending_line = 0
-    instructions: List[Instruction] = []
+    success, offending_line, instructions = assemble_lazily(raw_code)
+    return success, offending_line, list(instructions)
+
+
+def assemble_all_errors(raw_code="", max_instructions=None):
+    # Like assemble(), but goes on after an error and returns the numbers of all offending lines. A valid program of
+    # more than max_instructions dynamic instructions is validated without expanding it, and None is returned for its
+    # instructions.
+    offending_lines: List[int] = []
+    _, _, program = __parse(raw_code.split("\n"), offending_lines)
+    instructions: Optional[List[Instruction]] = []
+    if not offending_lines:
+        if max_instructions is None or __count(program, {}) <= max_instructions:
+            instructions = list(__expand(program, 0))
+        else:
+            instructions = None
+    return not offending_lines, offending_lines, instructions
+
 
-    lines = raw_code.split("\n")
+def assemble_lazily(raw_code=""):
+    # The program is validated up front, but repeat blocks and macros are only expanded while the returned
+    # generator is consumed, so that each dynamic instruction is created when it is fetched
+    success, offending_line, program = __parse(raw_code.split("\n"))
+    instructions: Iterator[Instruction] = __expand(program, 0) if success else iter([])
+    return success, offending_line, instructions
+
+
+def __parse(lines, offending_lines=None):
+    # A program is a list of items: instructions as (line, tokens), repeat blocks as (count, rotation, items)
+    # and macro invocations as the list of items of the macro body. Parsing stops at the first error unless
+    # offending_lines is given to collect them all, in which case the offending lines are skipped.
+    program = []
+    open_blocks = []
+    macros = {}
+    current_macro = None
+    items = program
     for line_num, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith('.'):
+            fields = stripped[1:].replace(',', ' ').split()
+            directive = fields[0] if fields else ''
+            if directive == 'rep' and __is_valid_rep(fields):
+                count = int(fields[1])
+                rotation = int(fields[2]) if len(fields) == 3 else 0
+                open_blocks.append((line_num, items))
+                block_items = []
+                items.append((count, rotation, block_items))
+                items = block_items
+            elif directive == 'endr' and len(fields) == 1 and open_blocks:
+                _, items = open_blocks.pop()
+            elif directive == 'macro' and len(fields) == 2 and current_macro is None and not open_blocks and \
+                    __is_valid_macro_name(fields[1]):
+                current_macro = (line_num, fields[1])
+                items = []
+                macros[fields[1]] = items
+            elif directive == 'endm' and len(fields) == 1 and current_macro is not None and not open_blocks:
+                current_macro = None
+                items = program
+            elif offending_lines is None:
+                return False, line_num + 1, []
+            else:
+                offending_lines.append(line_num + 1)
+            continue
         tokens = __tokenize(line)
         is_empty_line = not tokens
         if is_empty_line:
             continue
         if __is_valid(tokens):
-            inst = __make_instruction_from(line, tokens)
-            instructions.append(inst)
+            items.append((line, tokens))
+        elif len(tokens) == 1 and tokens[0] in macros and (current_macro is None or tokens[0] != current_macro[1]):
+            items.append(macros[tokens[0]])
+        elif offending_lines is None:
+            return False, line_num + 1, []
         else:
-            success = False
-            offending_line = line_num + 1
-            break
-    return success, offending_line, instructions
+            offending_lines.append(line_num + 1)
+    unclosed_lines = [line_num + 1 for line_num, _ in open_blocks]
+    if current_macro is not None:
+        unclosed_lines.append(current_macro[0] + 1)
+    if offending_lines is not None:
+        offending_lines.extend(unclosed_lines)
+        offending_lines.sort()
+    elif open_blocks:
+        return False, open_blocks[-1][0] + 1, []
+    elif current_macro is not None:
+        return False, current_macro[0] + 1, []
+    return True, 0, program
+
+
+def __expand(items, rotation) -> Iterator[Instruction]:
+    for item in items:
+        if isinstance(item, list):
+            yield from __expand(item, rotation)
+        elif len(item) == 2:
+            line, tokens = item
+            if rotation:
+                line, tokens = __rotate_registers(line, rotation)
+            yield __make_instruction_from(line, tokens)
+        else:
+            count, block_rotation, block_items = item
+            for iteration in range(count):
+                yield from __expand(block_items, rotation + iteration * block_rotation)
+
+
+def __count(items, counts) -> int:
+    # The number of dynamic instructions. A macro body is one list shared by all its invocations, so each list is
+    # only counted once.
+    if id(items) not in counts:
+        num_instructions = 0
+        for item in items:
+            if isinstance(item, list):
+                num_instructions += __count(item, counts)
+            elif len(item) == 2:
+                num_instructions += 1
+            else:
+                count, _, block_items = item
+                num_instructions += count * __count(block_items, counts)
+        counts[id(items)] = num_instructions
+    return counts[id(items)]
+
+
+def __rotate_registers(line, rotation):
+    def rotate(match) -> str:
+        return f'f{(int(match.group(1)) + rotation) % NUM_F_REGISTERS}'
+    rotated_line = _F_REGISTER_REFERENCE_PATTERN.sub(rotate, line)
+    return rotated_line, __tokenize(rotated_line)
+
+
+def __is_valid_rep(fields):
+    if len(fields) not in (2, 3) or not fields[1].isdigit() or int(fields[1]) <= 0:
+        return False
+    return len(fields) == 2 or __is_valid_num(fields[2])
+
+
+def __is_valid_macro_name(name):
+    return _MACRO_NAME_PATTERN.search(name) is not None and not __operation_is_valid(name)
 
 
+@lru_cache(maxsize=LINE_CACHE_SIZE)
 def __tokenize(line):
-    tokens = re.findall(r"(\w+)", line)
+    tokens = tuple(_TOKEN_PATTERN.findall(line))
     return tokens
 
 
+@lru_cache(maxsize=LINE_CACHE_SIZE)
 def __is_valid(instruction_tokens):
     is_valid_instruction = False
     if len(instruction_tokens) == 4:
@@ -70,18 +203,15 @@ def __operation_is_valid(operation):
 
 
 def __is_valid_f_reg(field):
-    f_reg_pattern = r"(^(f[0-9]||f1[0-9]||f2[0-9]|f3[0-1])$)"
-    return re.search(f_reg_pattern, field) is not None
+    return _F_REGISTER_PATTERN.search(field) is not None
 
 
 def __is_valid_x_reg(field):
-    x_reg_pattern = r"(^(x[0-9]||x1[0-9]||x2[0-9]|x3[0-1])$)"
-    return re.search(x_reg_pattern, field) is not None
+    return _X_REGISTER_PATTERN.search(field) is not None
 
 
 def __is_valid_num(field):
-    x_num_pattern = R"(^-?\d+$)"
-    return re.search(x_num_pattern, field) is not None
+    return _NUMBER_PATTERN.search(field) is not None
 
 
 def __make_instruction_from(line, instruction_tokens):
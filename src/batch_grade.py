@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional, Tuple
+
+from assembler import assemble
+from codegen_engine import CompiledEngine
+from machine_config import MachineConfig, config_from_dict
+from processor import SCHEDULING_ALGORITHMS, SimulationStalledError
+from simulation import SimulationResult, simulate
+
+PROGRAM_EXTENSION = '.asm'
+# Submissions are handed to the workers in chunks, a few per worker so that uneven chunks still balance out
+CHUNKS_PER_WORKER = 4
+
+
+class Submission(NamedTuple):
+    name: str
+    text: str
+
+
+class GradeResult(NamedTuple):
+    name: str
+    num_instructions: Optional[int]  # None when the program does not assemble
+    cycles: List[Optional[int]]  # One per config, None when that simulation did not finish
+    diagnostics: List[str]
+
+
+def collect_submissions(paths) -> List[Submission]:
+    # Every path is an assembly file, a directory searched recursively or a zip or tar archive
+    submissions = []
+    for path in paths:
+        if os.path.isdir(path):
+            submissions.extend(_submissions_in_directory(path))
+        elif zipfile.is_zipfile(path):
+            submissions.extend(_submissions_in_zip(path))
+        elif tarfile.is_tarfile(path):
+            submissions.extend(_submissions_in_tar(path))
+        else:
+            with open(path, errors='replace') as f:
+                submissions.append(Submission(path, f.read()))
+    return submissions
+
+
+def grade_submission(
+        submission: Submission, configs: List[MachineConfig], max_cycles=None, compiled=True,
+        config_names=None) -> GradeResult:
+    # Diagnostics name the config they came from, by default its algorithm
+    config_names = config_names or [config.algorithm for config in configs]
+    lines = submission.text.split('\n')
+    success, offending_line, instructions = assemble(submission.text.lower())
+    if not success:
+        return GradeResult(
+            submission.name, None, [None] * len(configs),
+            [f'assembly error at line {offending_line}: {lines[offending_line - 1].strip()}'],
+        )
+    if not instructions:
+        return GradeResult(submission.name, 0, [None] * len(configs), ['no instructions'])
+    cycles = []
+    diagnostics = []
+    for config, config_name in zip(configs, config_names):
+        try:
+            result = _simulate(instructions, config, max_cycles, compiled)
+        except SimulationStalledError as error:
+            cycles.append(None)
+            diagnostics.append(f'{config_name}: {error}')
+            continue
+        if max_cycles is not None and result.cycles >= max_cycles:
+            cycles.append(None)
+            diagnostics.append(f'{config_name}: not finished after {max_cycles} cycles')
+        else:
+            cycles.append(result.cycles)
+    return GradeResult(submission.name, len(instructions), cycles, diagnostics)
+
+
+def grade_all(
+        submissions: List[Submission], configs: List[MachineConfig], processes=None, max_cycles=None,
+        compiled=True, config_names=None) -> List[GradeResult]:
+    # One pool for the whole class set: each worker imports the simulator once and compiles the engine of every
+    # config once, then assembles and simulates chunk after chunk of submissions
+    if not submissions:
+        return []
+    num_workers = processes or os.cpu_count() or 1
+    num_chunks = max(1, min(len(submissions), num_workers * CHUNKS_PER_WORKER))
+    bounds = [len(submissions) * chunk // num_chunks for chunk in range(num_chunks + 1)]
+    tasks = [
+        (submissions[first:last], configs, max_cycles, compiled, config_names) for first, last in zip(bounds, bounds[1:])
+    ]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        return [result for chunk in executor.map(_grade_chunk, tasks) for result in chunk]
+
+
+def format_table(results: List[GradeResult], config_names: List[str]) -> str:
+    name_width = max([len('Program')] + [len(result.name) for result in results])
+    cycle_widths = [max(len(name), 6) for name in config_names]
+    header = f'{"Program":<{name_width}} {"Insts":>6} ' + ' '.join(
+        f'{name:>{width}}' for name, width in zip(config_names, cycle_widths)
+    ) + ' Diagnostics'
+    lines = [header, '-' * len(header)]
+    for result in results:
+        num_instructions = '-' if result.num_instructions is None else result.num_instructions
+        cycles = ' '.join(
+            f'{"-" if cycle is None else cycle:>{width}}' for cycle, width in zip(result.cycles, cycle_widths)
+        )
+        lines.append(f'{result.name:<{name_width}} {num_instructions:>6} {cycles} {"; ".join(result.diagnostics)}')
+    num_failed = sum(1 for result in results if result.diagnostics)
+    lines.append(f'{len(results)} programs, {len(results) - num_failed} without diagnostics')
+    return '\n'.join(lines)
+
+
+def _simulate(instructions, config, max_cycles, compiled) -> SimulationResult:
+    if compiled:
+        try:
+            engine = CompiledEngine(config)
+        except ValueError:  # A config the compiled engine does not model
+            pass
+        else:
+            return engine.run(instructions, max_cycles)
+    return simulate(instructions, config, max_cycles, record_trace=False)
+
+
+def _grade_chunk(task) -> List[GradeResult]:
+    submissions, configs, max_cycles, compiled, config_names = task
+    return [grade_submission(submission, configs, max_cycles, compiled, config_names) for submission in submissions]
+
+
+def _submissions_in_directory(directory) -> List[Submission]:
+    submissions = []
+    for root, directories, files in os.walk(directory):
+        directories.sort()
+        for file_name in sorted(files):
+            if file_name.endswith(PROGRAM_EXTENSION):
+                path = os.path.join(root, file_name)
+                with open(path, errors='replace') as f:
+                    submissions.append(Submission(os.path.relpath(path, directory), f.read()))
+    return submissions
+
+
+def _submissions_in_zip(path) -> List[Submission]:
+    with zipfile.ZipFile(path) as archive:
+        return [
+            Submission(name, archive.read(name).decode(errors='replace'))
+            for name in sorted(archive.namelist()) if name.endswith(PROGRAM_EXTENSION)
+        ]
+
+
+def _submissions_in_tar(path) -> List[Submission]:
+    with tarfile.open(path) as archive:
+        members = sorted(
+            (member for member in archive.getmembers() if member.isfile() and member.name.endswith(PROGRAM_EXTENSION)),
+            key=lambda member: member.name,
+        )
+        return [
+            Submission(member.name, archive.extractfile(member).read().decode(errors='replace')) for member in members
+        ]
+
+
+def _load_configs(config_paths, algorithms) -> Tuple[List[str], List[MachineConfig]]:
+    named_configs = []
+    for path in config_paths or [None]:
+        if path is None:
+            named_configs.append(('', MachineConfig()))
+        else:
+            with open(path) as f:
+                named_configs.append((os.path.splitext(os.path.basename(path))[0], config_from_dict(json.load(f))))
+    names = []
+    configs = []
+    for name, config in named_configs:
+        for algorithm in algorithms or [config.algorithm]:
+            names.append(f'{name}:{algorithm}' if name else algorithm)
+            configs.append(config._replace(algorithm=algorithm))
+    return names, configs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Assemble and simulate many programs against the same machine configs')
+    parser.add_argument('paths', nargs='+', help='Assembly files, directories or zip/tar archives of .asm files')
+    parser.add_argument(
+        '--config', action='append', help='JSON file of MachineConfig fields, one table column each; may be repeated'
+    )
+    parser.add_argument(
+        '--algorithm', action='append', choices=SCHEDULING_ALGORITHMS,
+        help='Run every config under this algorithm; may be repeated'
+    )
+    parser.add_argument('--max-cycles', type=int, default=None, help='Give up on a program after this many cycles')
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    parser.add_argument(
+        '--no-compiled', action='store_true', help='Always use the reference engine instead of the compiled one'
+    )
+    args = parser.parse_args()
+
+    names, configs = _load_configs(args.config, args.algorithm)
+    submissions = collect_submissions(args.paths)
+    results = grade_all(submissions, configs, args.jobs, args.max_cycles, not args.no_compiled, names)
+    print(format_table(results, names))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'configs': names, 'results': [result._asdict() for result in results]}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+
+from codegen_engine import CompiledEngine
+from controller import Controller
+from workload_generator import WorkloadGenerator
+
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+ENGINE_STARTUP_SCRIPT = 'import controller, assembler'
+
+GUI_STARTUP_SCRIPT = """
+import sys
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QApplication
+from controller import Controller
+from window import MainWindow
+app = QApplication(sys.argv)
+window = MainWindow(pos_x=0, pos_y=0, width=1610, height=600, title='', controller=Controller())
+window.load_reset()
+QTimer.singleShot(0, app.quit)
+app.exec_()
+"""
+
+
+def benchmark_simulation(num_instructions, seed=0) -> dict:
+    controller = Controller()
+    generator = WorkloadGenerator(seed=seed)
+    start = time.perf_counter()
+    controller.upload_to_memory(generator.instructions(num_instructions))
+    while controller.there_is_work_to_do():
+        controller.tick()
+    elapsed = time.perf_counter() - start
+    cycles = controller.get_cycle_count()
+    return {
+        'instructions': num_instructions,
+        'cycles': cycles,
+        'seconds': elapsed,
+        'cycles_per_second': cycles / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def benchmark_compiled_simulation(num_instructions, seed=0) -> dict:
+    instructions = list(WorkloadGenerator(seed=seed).instructions(num_instructions))
+    start = time.perf_counter()
+    result = CompiledEngine().run(instructions)
+    elapsed = time.perf_counter() - start
+    return {
+        'instructions': num_instructions,
+        'cycles': result.cycles,
+        'seconds': elapsed,
+        'cycles_per_second': result.cycles / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def benchmark_cold_start(script, repeats=5) -> float:
+    environment = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', script], cwd=SOURCE_DIRECTORY, env=environment, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_startup() -> dict:
+    results = {
+        'interpreter_seconds': benchmark_cold_start('pass'),
+        'engine_import_seconds': benchmark_cold_start(ENGINE_STARTUP_SCRIPT),
+    }
+    if importlib.util.find_spec('PyQt5') is not None:
+        results['gui_startup_seconds'] = benchmark_cold_start(GUI_STARTUP_SCRIPT)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ToMasulator benchmarks')
+    parser.add_argument('--instructions', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--record', help='Append the results as a JSON line to this file to track them over time')
+    args = parser.parse_args()
+
+    startup = benchmark_startup()
+    for name, seconds in startup.items():
+        print(f'startup: {name} {seconds * 1000:.0f} ms')
+    result = benchmark_simulation(args.instructions, args.seed)
+    print(f"simulation: {result['instructions']} instructions, {result['cycles']} cycles in "
+          f"{result['seconds']:.2f} s ({result['cycles_per_second']:.0f} cycles/s)")
+    compiled_result = benchmark_compiled_simulation(args.instructions, args.seed)
+    print(f"compiled simulation: {compiled_result['instructions']} instructions, {compiled_result['cycles']} cycles "
+          f"in {compiled_result['seconds']:.2f} s ({compiled_result['cycles_per_second']:.0f} cycles/s)")
+
+    if args.record:
+        with open(args.record, 'a') as f:
+            f.write(json.dumps({
+                'time': time.time(), 'startup': startup, 'simulation': result, 'compiled_simulation': compiled_result,
+            }) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+from functools import lru_cache
+from typing import Callable, List
+
+from instruction import Instruction
+from machine_config import MachineConfig, validate_config
+from memory_hierarchy import CACHE_COUNTERS
+from processor import STALL_DETECTION_CYCLES, TOMASULO_WITH_ROB, SimulationStalledError
+from simulation import SimulationResult
+
+# Plain integer station states of the generated code, in the same order as ReservationStation.State
+FREE, JUST_ISSUED, WAITING_FOR_OPERANDS, EXECUTING, MEMORY, ATTEMPT_MEMORY_ACCESS, ATTEMPT_WRITEBACK, WRITE_BACK, \
+    READ_OPERANDS = range(9)
+STATE_ABBREVIATIONS = ['', 'I', '-', 'E', 'M', '-', '-', 'W', 'R']
+STATE_NAMES = [
+    'free', 'just issued', 'waiting for operands', 'executing', 'memory', 'attempt memory access',
+    'attempt writeback', 'write back', 'read operands',
+]
+
+LOAD, STORE, ADD_SUB, MUL_DIV = range(4)
+_KINDS = {
+    Instruction.LOAD: LOAD, Instruction.STORE: STORE,
+    Instruction.ADD: ADD_SUB, Instruction.SUB: ADD_SUB, Instruction.MUL: MUL_DIV, Instruction.DIV: MUL_DIV,
+}
+NO_REGISTER = -1
+REGISTER_FILE = -1
+NO_WRITER = -2
+
+
+class CompiledEngine:
+    # For one fixed machine config, the whole simulation loop is generated as Python source with the algorithm
+    # resolved, the stations unrolled, their latencies inlined and the states turned into integers, and compiled
+    # once. It produces the same cycles, trace and counters as the reference engine.
+    def __init__(self, config=MachineConfig()):
+        validate_config(config)
+        if config.l1_size_bytes:
+            raise ValueError('The compiled engine does not model the memory hierarchy, use simulate() instead')
+        if config.num_functional_units_load_store or config.num_functional_units_add_sub or \
+                config.num_functional_units_mul_div:
+            raise ValueError('The compiled engine does not model shared functional units, use simulate() instead')
+        if config.memory_disambiguation:
+            raise ValueError('The compiled engine does not model memory disambiguation, use simulate() instead')
+        if config.algorithm == TOMASULO_WITH_ROB:
+            raise ValueError('The compiled engine does not model the reorder buffer, use simulate() instead')
+        self.config = config
+        self._run = _compile(config)
+
+    def run(self, instructions, max_cycles=None, record_trace=False) -> SimulationResult:
+        instructions = list(instructions)
+        kinds = [_KINDS[inst.operation] for inst in instructions]
+        destinations = [_register_number(inst.destination) for inst in instructions]
+        sources1 = [_register_number(inst.source1) for inst in instructions]
+        sources2 = [_register_number(inst.source2) for inst in instructions]
+        try:
+            cycles, counters, trace = self._run(kinds, destinations, sources1, sources2, max_cycles, record_trace)
+        except _Stalled as stalled:
+            raise SimulationStalledError(stalled.cycle, self._describe_stations(instructions, *stalled.stations))
+        return SimulationResult(cycles=cycles, trace=trace, counters=counters)
+
+    def _describe_stations(self, instructions, states, issue_numbers) -> List[str]:
+        descriptions = []
+        for index, (state, issue_number) in enumerate(zip(states, issue_numbers)):
+            if state != FREE:
+                name, number = _station_name(self.config, index)
+                descriptions.append(
+                    f'{name} RS {number} ({instructions[issue_number].raw_text}, {STATE_NAMES[state]})'
+                )
+        return descriptions
+
+
+def simulate_compiled(instructions, config=MachineConfig(), max_cycles=None, record_trace=True) -> SimulationResult:
+    return CompiledEngine(config).run(instructions, max_cycles, record_trace)
+
+
+def generate_source(config: MachineConfig) -> str:
+    return '\n'.join(_SourceGenerator(config).lines) + '\n'
+
+
+class _Stalled(Exception):
+    def __init__(self, cycle, stations):
+        super().__init__(cycle)
+        self.cycle = cycle
+        self.stations = stations
+
+
+@lru_cache(maxsize=64)
+def _compile(config: MachineConfig) -> Callable:
+    namespace = {'_Stalled': _Stalled}
+    exec(compile(generate_source(config), f'<tomasulator engine {tuple(config)}>', 'exec'), namespace)
+    return namespace['run']
+
+
+class _SourceGenerator:
+    def __init__(self, config: MachineConfig):
+        self.lines: List[str] = []
+        self._tomasulo = config.algorithm == 'Tomasulo'
+        num_load_store = config.num_reservation_stations_load_store
+        num_add_sub = config.num_reservation_stations_add_sub
+        num_mul_div = config.num_reservation_stations_mul_div
+        self._load_store = range(0, num_load_store)
+        self._add_sub = range(num_load_store, num_load_store + num_add_sub)
+        self._mul_div = range(num_load_store + num_add_sub, num_load_store + num_add_sub + num_mul_div)
+        self._num_stations = num_load_store + num_add_sub + num_mul_div
+        self._latencies = (
+            [config.num_cycles_load_store] * num_load_store + [config.num_cycles_add_sub] * num_add_sub +
+            [config.num_cycles_mul_div] * num_mul_div
+        )
+        self._can_issue = config.instruction_queue_size > 0
+        self._generate()
+
+    def _emit(self, depth, line) -> None:
+        self.lines.append('    ' * depth + line)
+
+    def _generate(self) -> None:
+        emit = self._emit
+        emit(0, 'def run(kinds, destinations, sources1, sources2, max_cycles, record_trace):')
+        emit(1, 'num_instructions = len(kinds)')
+        for name, value in [('state', FREE), ('counter', 0), ('issue', 0), ('provider1', REGISTER_FILE),
+                            ('provider2', REGISTER_FILE), ('destination', NO_REGISTER), ('source1', NO_REGISTER),
+                            ('source2', NO_REGISTER), ('kind', 0)]:
+            emit(1, f'{name} = [{value}] * {self._num_stations}')
+        emit(1, f'register_stat = [{REGISTER_FILE}] * 32')
+        emit(1, 'bus_pending = []')
+        emit(1, 'memory_pending = []')
+        emit(1, f'writing = {NO_WRITER}')
+        emit(1, 'issue_number = 0')
+        emit(1, 'cycle = 0')
+        emit(1, 'idle_cycles = 0')
+        emit(1, 'issued_instructions = issue_stall_cycles = write_backs = write_back_stall_cycles = 0')
+        emit(1, 'memory_accesses = memory_stall_cycles = 0')
+        emit(1, 'trace = []')
+        emit(1, 'issue_key = issue.__getitem__')
+        emit(1, 'while max_cycles is None or cycle < max_cycles:')
+        emit(2, 'cycle += 1')
+        emit(2, 'progress = False')
+        for index in range(self._num_stations):
+            self._generate_station_tick(index)
+        self._generate_issue()
+        self._generate_arbitration()
+        emit(2, 'if record_trace:')
+        emit(3, 'states = []')
+        emit(3, f'for index in range({self._num_stations}):')
+        emit(4, 's = state[index]')
+        emit(4, f'if s == {EXECUTING}:')
+        emit(5, "states.append((issue[index] + 1, 'E' + str(counter[index] + 1)))")
+        emit(4, f'elif s != {FREE}:')
+        emit(5, f'states.append((issue[index] + 1, {STATE_ABBREVIATIONS!r}[s]))')
+        emit(3, 'trace.append(states)')
+        emit(2, 'if progress:')
+        emit(3, 'idle_cycles = 0')
+        emit(2, 'else:')
+        emit(3, 'idle_cycles += 1')
+        emit(3, f'if idle_cycles >= {STALL_DETECTION_CYCLES}:')
+        emit(4, 'raise _Stalled(cycle, (state, issue))')
+        emit(2, 'if not any(state):')
+        emit(3, 'break')
+        emit(1, 'counters = {')
+        for name in ['issued_instructions', 'issue_stall_cycles', 'write_backs', 'write_back_stall_cycles',
+                     'memory_accesses', 'memory_stall_cycles']:
+            emit(2, f"'{name}': {name},")
+        for name in CACHE_COUNTERS + [
+            'functional_unit_stall_cycles', 'forwarded_loads', 'store_wait_cycles', 'committed_instructions',
+            'rob_full_stall_cycles',
+        ]:
+            emit(2, f"'{name}': 0,")
+        emit(1, '}')
+        emit(1, 'return cycle, counters, trace')
+
+    def _generate_operand_snoop(self, depth, i) -> None:
+        # Operands whose provider is writing on the CDB this cycle become ready
+        self._emit(depth, f'if provider1[{i}] == writing:')
+        self._emit(depth + 1, f'provider1[{i}] = {REGISTER_FILE}')
+        self._emit(depth, f'if provider2[{i}] == writing:')
+        self._emit(depth + 1, f'provider2[{i}] = {REGISTER_FILE}')
+
+    def _operands_ready(self, i) -> str:
+        return f'provider1[{i}] == {REGISTER_FILE} and provider2[{i}] == {REGISTER_FILE}'
+
+    def _generate_reset(self, depth, i) -> None:
+        emit = self._emit
+        emit(depth, f'state[{i}] = {FREE}')
+        emit(depth, f'counter[{i}] = 0')
+        emit(depth, f'issue[{i}] = 0')
+        emit(depth, f'provider1[{i}] = provider2[{i}] = {REGISTER_FILE}')
+
+    def _generate_station_tick(self, i) -> None:
+        emit = self._emit
+        load_store = i in self._load_store
+        latency = self._latencies[i]
+        emit(2, f's = state[{i}]')
+        emit(2, f'if s == {FREE}:')
+        emit(3, 'pass')
+
+        emit(2, f'elif s == {EXECUTING}:')
+        emit(3, 'progress = True')
+        emit(3, f'counter[{i}] += 1')
+        if load_store:
+            emit(3, f'if kind[{i}] == {STORE}:')
+            self._generate_operand_snoop(4, i)
+        emit(3, f'if counter[{i}] == {latency}:')
+        if load_store:
+            emit(4, f'if kind[{i}] == {LOAD} or {self._operands_ready(i)}:')
+            emit(5, f'memory_pending.append({i})')
+            emit(5, f'state[{i}] = {ATTEMPT_MEMORY_ACCESS}')
+            emit(4, 'else:')
+            emit(5, f'state[{i}] = {WAITING_FOR_OPERANDS}')
+        else:
+            emit(4, f'bus_pending.append({i})')
+            emit(4, f'state[{i}] = {ATTEMPT_WRITEBACK}')
+
+        emit(2, f'elif s == {JUST_ISSUED}:')
+        emit(3, 'progress = True')
+        self._generate_operand_snoop(3, i)
+        if not self._tomasulo:
+            emit(3, f'state[{i}] = {READ_OPERANDS} if {self._operands_ready(i)} else {WAITING_FOR_OPERANDS}')
+        elif load_store:
+            emit(3, f'if {self._operands_ready(i)} or kind[{i}] == {STORE}:')
+            emit(4, f'state[{i}] = {EXECUTING}')
+            emit(3, 'else:')
+            emit(4, f'state[{i}] = {WAITING_FOR_OPERANDS}')
+        else:
+            emit(3, f'state[{i}] = {EXECUTING} if {self._operands_ready(i)} else {WAITING_FOR_OPERANDS}')
+
+        emit(2, f'elif s == {WAITING_FOR_OPERANDS}:')
+        self._generate_operand_snoop(3, i)
+        emit(3, f'if {self._operands_ready(i)}:')
+        emit(4, 'progress = True')
+        if not self._tomasulo:
+            emit(4, f'state[{i}] = {READ_OPERANDS}')
+        elif load_store:
+            emit(4, f'if kind[{i}] == {STORE}:')
+            emit(5, f'memory_pending.append({i})')
+            emit(5, f'state[{i}] = {ATTEMPT_MEMORY_ACCESS}')
+            emit(4, 'else:')
+            emit(5, f'state[{i}] = {EXECUTING}')
+        else:
+            emit(4, f'state[{i}] = {EXECUTING}')
+
+        if not self._tomasulo:
+            emit(2, f'elif s == {READ_OPERANDS}:')
+            emit(3, 'progress = True')
+            emit(3, f'state[{i}] = {EXECUTING}')
+
+        if load_store:
+            emit(2, f'elif s == {MEMORY}:')
+            emit(3, 'progress = True')
+            emit(3, f'if kind[{i}] == {STORE}:')
+            self._generate_reset(4, i)
+            emit(3, 'else:')
+            emit(4, f'bus_pending.append({i})')
+            emit(4, f'state[{i}] = {ATTEMPT_WRITEBACK}')
+
+        emit(2, f'elif s == {WRITE_BACK}:')
+        emit(3, 'progress = True')
+        self._generate_reset(3, i)
+
+    def _generate_issue(self) -> None:
+        emit = self._emit
+        if not self._can_issue:
+            return
+        emit(2, 'if issue_number < num_instructions:')
+        emit(3, 'k = kinds[issue_number]')
+        emit(3, f'free_station = {NO_WRITER}')
+        depth = 3
+        if not self._tomasulo:
+            # Scoreboard does not issue an instruction whose destination is still to be written
+            emit(3, f'if k == {STORE} or register_stat[destinations[issue_number]] == {REGISTER_FILE}:')
+            depth = 4
+        for unit_kinds, stations in [((LOAD, STORE), self._load_store), ((ADD_SUB,), self._add_sub),
+                                     ((MUL_DIV,), self._mul_div)]:
+            test = f'k <= {STORE}' if unit_kinds == (LOAD, STORE) else f'k == {unit_kinds[0]}'
+            emit(depth, f'{"if" if unit_kinds[0] == LOAD else "elif"} {test}:')
+            if not stations:
+                emit(depth + 1, 'pass')
+            for position, station in enumerate(stations):
+                emit(depth + 1, f'{"if" if position == 0 else "elif"} state[{station}] == {FREE}:')
+                emit(depth + 2, f'free_station = {station}')
+        emit(3, f'if free_station != {NO_WRITER}:')
+        emit(4, 'j = free_station')
+        emit(4, 'progress = True')
+        emit(4, f'if k == {LOAD}:')
+        emit(5, f'provider1[j] = provider2[j] = {REGISTER_FILE}')
+        emit(5, 'register_stat[destinations[issue_number]] = j')
+        emit(4, f'elif k == {STORE}:')
+        emit(5, 'provider1[j] = register_stat[sources1[issue_number]]')
+        emit(5, f'provider2[j] = {REGISTER_FILE}')
+        emit(4, 'else:')
+        emit(5, 'provider1[j] = register_stat[sources1[issue_number]]')
+        emit(5, 'provider2[j] = register_stat[sources2[issue_number]]')
+        emit(5, 'register_stat[destinations[issue_number]] = j')
+        emit(4, 'kind[j] = k')
+        emit(4, 'destination[j] = destinations[issue_number]')
+        emit(4, 'source1[j] = sources1[issue_number]')
+        emit(4, 'source2[j] = sources2[issue_number]')
+        emit(4, f'state[j] = {JUST_ISSUED}')
+        emit(4, 'issue[j] = issue_number')
+        emit(4, 'issue_number += 1')
+        emit(4, 'issued_instructions += 1')
+        emit(3, 'else:')
+        emit(4, 'issue_stall_cycles += 1')
+
+    def _generate_arbitration(self) -> None:
+        emit = self._emit
+        emit(2, f'writing = {NO_WRITER}')
+        emit(2, 'if bus_pending:')
+        if self._tomasulo:
+            emit(3, 'writing = min(bus_pending, key=issue_key)')
+        else:
+            # A writer has to wait while an older instruction still has to read the register it overwrites
+            emit(3, 'for candidate in sorted(bus_pending, key=issue_key):')
+            emit(4, 'candidate_issue = issue[candidate]')
+            emit(4, 'candidate_destination = destination[candidate]')
+            emit(4, f'for index in range({self._num_stations}):')
+            emit(5, f'if (state[index] == {WAITING_FOR_OPERANDS} or state[index] == {READ_OPERANDS}) and '
+                    'issue[index] < candidate_issue and '
+                    '(source1[index] == candidate_destination or source2[index] == candidate_destination):')
+            emit(6, 'break')
+            emit(4, 'else:')
+            emit(5, 'writing = candidate')
+            emit(5, 'break')
+        emit(3, f'if writing != {NO_WRITER}:')
+        emit(4, 'bus_pending.remove(writing)')
+        emit(4, f'state[writing] = {WRITE_BACK}')
+        emit(4, 'write_backs += 1')
+        emit(4, 'progress = True')
+        emit(4, 'if register_stat[destination[writing]] == writing:')
+        emit(5, f'register_stat[destination[writing]] = {REGISTER_FILE}')
+        emit(3, 'if bus_pending:')
+        emit(4, 'write_back_stall_cycles += 1')
+        emit(2, 'if memory_pending:')
+        emit(3, 'granted = min(memory_pending, key=issue_key)')
+        emit(3, 'memory_pending.remove(granted)')
+        emit(3, f'state[granted] = {MEMORY}')
+        emit(3, 'memory_accesses += 1')
+        emit(3, 'progress = True')
+        emit(3, 'if memory_pending:')
+        emit(4, 'memory_stall_cycles += 1')
+
+
+def _register_number(register) -> int:
+    return int(register[1:]) if register.startswith('f') else NO_REGISTER
+
+
+def _station_name(config: MachineConfig, index):
+    for name, num_stations in [('load/store', config.num_reservation_stations_load_store),
+                               ('add/sub', config.num_reservation_stations_add_sub),
+                               ('mul/div', config.num_reservation_stations_mul_div)]:
+        if index < num_stations:
+            return name, index + 1
+        index -= num_stations
+    return '', index + 1
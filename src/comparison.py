@@ -0,0 +1,97 @@
+import argparse
+from typing import List, NamedTuple, Optional
+
+from assembler import assemble
+from instruction import Instruction
+from machine_config import MachineConfig
+from simulation import CycleStates, SimulationResult
+from sweep import run_sweep
+
+ALGORITHMS = ('Tomasulo', 'Scoreboard')
+
+
+class InstructionTiming(NamedTuple):
+    issue: int
+    execute: Optional[int]
+    write_back: Optional[int]
+    finish: int
+
+
+class Comparison(NamedTuple):
+    tomasulo: SimulationResult
+    scoreboard: SimulationResult
+    tomasulo_timings: List[InstructionTiming]
+    scoreboard_timings: List[InstructionTiming]
+
+    def finish_deltas(self) -> List[int]:
+        # Positive when the instruction finishes later under Scoreboard
+        return [
+            scoreboard.finish - tomasulo.finish
+            for tomasulo, scoreboard in zip(self.tomasulo_timings, self.scoreboard_timings)
+        ]
+
+
+def compare_algorithms(instructions: List[Instruction], config=MachineConfig(), processes=len(ALGORITHMS)) -> Comparison:
+    # Both algorithms run at the same time in worker processes that share one decoded copy of the program
+    tomasulo, scoreboard = run_sweep(
+        instructions, [config._replace(algorithm=algorithm) for algorithm in ALGORITHMS], processes, record_trace=True
+    )
+    return Comparison(
+        tomasulo=tomasulo,
+        scoreboard=scoreboard,
+        tomasulo_timings=instruction_timings(tomasulo.trace, len(instructions)),
+        scoreboard_timings=instruction_timings(scoreboard.trace, len(instructions)),
+    )
+
+
+def instruction_timings(trace: List[CycleStates], num_instructions) -> List[InstructionTiming]:
+    issue = [0] * num_instructions
+    execute: List[Optional[int]] = [None] * num_instructions
+    write_back: List[Optional[int]] = [None] * num_instructions
+    finish = [0] * num_instructions
+    for cycle, states in enumerate(trace, start=1):
+        for number, state in states:
+            index = number - 1
+            if not issue[index]:
+                issue[index] = cycle
+            if execute[index] is None and state.startswith('E'):
+                execute[index] = cycle
+            if state == 'W':
+                write_back[index] = cycle
+            finish[index] = cycle
+    return [InstructionTiming(*timing) for timing in zip(issue, execute, write_back, finish)]
+
+
+def format_comparison(instructions: List[Instruction], comparison: Comparison) -> str:
+    width = max([len(inst.raw_text) for inst in instructions] + [len('Instruction')])
+    lines = [
+        f'{"#":>4}  {"Instruction":<{width}}  {"Tomasulo I/E/W/end":>19}  {"Scoreboard I/E/W/end":>21}  {"Delta":>5}'
+    ]
+    for number, (inst, tomasulo, scoreboard, delta) in enumerate(zip(
+            instructions, comparison.tomasulo_timings, comparison.scoreboard_timings, comparison.finish_deltas()), start=1):
+        lines.append(
+            f'{number:>4}  {inst.raw_text:<{width}}  {_format_timing(tomasulo):>19}  {_format_timing(scoreboard):>21}  '
+            f'{delta:>+5}'
+        )
+    lines.append(f'Total cycles: Tomasulo {comparison.tomasulo.cycles}, Scoreboard {comparison.scoreboard.cycles}')
+    return '\n'.join(lines)
+
+
+def _format_timing(timing: InstructionTiming) -> str:
+    return '/'.join('-' if cycle is None else str(cycle) for cycle in timing)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the timing of a program under Tomasulo and Scoreboard')
+    parser.add_argument('program', help='Assembly file')
+    args = parser.parse_args()
+
+    with open(args.program) as f:
+        success, offending_line, instructions = assemble(f.read().lower())
+    if not success:
+        parser.exit(1, f'Error at line {offending_line}\n')
+    print(format_comparison(instructions, compare_algorithms(instructions)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+from typing import List
+
+from PyQt5.QtWidgets import QDialog, QGroupBox, QHBoxLayout, QTableWidget, QTableWidgetItem, QVBoxLayout, QSplitter
+from PyQt5.QtCore import Qt
+
+from comparison import Comparison
+from instruction import Instruction
+from simulation import CycleStates
+from window_settings import UiSettings
+
+
+class ComparisonDialog(QDialog):
+    def __init__(self, parent, instructions: List[Instruction], comparison: Comparison):
+        super().__init__(parent)
+        self.setWindowTitle(UiSettings.COMPARISON_WINDOW_TITLE)
+        self.resize(UiSettings.COMPARISON_WINDOW_SIZE)
+        row_labels = [f'{number}) {inst.raw_text}' for number, inst in enumerate(instructions, start=1)]
+
+        splitter = QSplitter(Qt.Horizontal)
+        splitter.addWidget(self._create_timing_table_panel(
+            f'Tomasulo ({comparison.tomasulo.cycles} cycles)', row_labels, comparison.tomasulo.trace
+        ))
+        splitter.addWidget(self._create_timing_table_panel(
+            f'Scoreboard ({comparison.scoreboard.cycles} cycles)', row_labels, comparison.scoreboard.trace
+        ))
+        splitter.addWidget(self._create_delta_table_panel(row_labels, comparison))
+
+        layout = QHBoxLayout()
+        layout.addWidget(splitter)
+        self.setLayout(layout)
+
+    @staticmethod
+    def _create_timing_table_panel(title, row_labels, trace: List[CycleStates]) -> QGroupBox:
+        table = QTableWidget(len(row_labels), len(trace))
+        table.setFont(UiSettings.TIMING_TABEL_FONT)
+        table.setVerticalHeaderLabels(row_labels)
+        table.setHorizontalHeaderLabels([str(cycle) for cycle in range(1, len(trace) + 1)])
+        table.horizontalHeader().setDefaultSectionSize(UiSettings.TIMING_TABLE_COL_WIDTH)
+        for cycle_no, states in enumerate(trace, start=1):
+            for inst_number, inst_state_text in states:
+                table.setItem(inst_number - 1, cycle_no - 1, QTableWidgetItem(inst_state_text))
+        return _titled_panel(title, table)
+
+    @staticmethod
+    def _create_delta_table_panel(row_labels, comparison: Comparison) -> QGroupBox:
+        headers = ['Tomasulo end', 'Scoreboard end', 'Delta']
+        table = QTableWidget(len(row_labels), len(headers))
+        table.setFont(UiSettings.TIMING_TABEL_FONT)
+        table.setVerticalHeaderLabels(row_labels)
+        table.setHorizontalHeaderLabels(headers)
+        rows = zip(comparison.tomasulo_timings, comparison.scoreboard_timings, comparison.finish_deltas())
+        for row, (tomasulo, scoreboard, delta) in enumerate(rows):
+            for column, text in enumerate([str(tomasulo.finish), str(scoreboard.finish), f'{delta:+}']):
+                item = QTableWidgetItem(text)
+                item.setTextAlignment(Qt.AlignCenter)
+                table.setItem(row, column, item)
+        return _titled_panel('Per-instruction delta', table)
+
+
+def _titled_panel(title, table) -> QGroupBox:
+    panel = QGroupBox(title)
+    panel.setFont(UiSettings.SLOT_TITLE_FONT)
+    layout = QVBoxLayout()
+    layout.addWidget(table)
+    panel.setLayout(layout)
+    return panel
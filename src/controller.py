@@ -1,5 +1,11 @@
-from typing import List
+from typing import List, Optional
+
+from dataflow import CycleEstimate, estimate_cycles
+from instruction import Instruction
+from machine_config import MachineConfig, validate_config
+from memory_hierarchy import MemoryHierarchyConfig
 from processor import Processor
+from watchpoints import Watchpoint
 
 
 class Controller:
@@ -9,6 +15,45 @@ class Controller:
     def tick(self) -> None:
         self._cpu.tick()
 
+    def run_until(self, watchpoints: List[Watchpoint], max_cycles=None) -> Optional[Watchpoint]:
+        # Runs without any intermediate updates and returns the first watchpoint that triggers,
+        # or None when the program finishes or max_cycles more cycles have been simulated
+        for watchpoint in watchpoints:
+            watchpoint.arm(self)
+        # Watchpoints listening to events are only checked after a cycle in which one of their events happened
+        affected = set()
+        subscriptions = []
+        for event_type in {event_type for watchpoint in watchpoints for event_type in watchpoint.EVENT_TYPES}:
+            listeners = [watchpoint for watchpoint in watchpoints if event_type in watchpoint.EVENT_TYPES]
+
+            def notify(event, listeners=listeners):
+                for listener in listeners:
+                    if listener.notify(event):
+                        affected.add(listener)
+            subscriptions.append((event_type, notify))
+            self._cpu.subscribe(event_type, notify)
+        polled = [watchpoint for watchpoint in watchpoints if not watchpoint.EVENT_TYPES]
+        last_cycle = None if max_cycles is None else self._cpu.cycle_count + max_cycles
+        try:
+            while self._cpu.there_is_work_to_do() and (last_cycle is None or self._cpu.cycle_count < last_cycle):
+                self._cpu.tick()
+                if not affected and not polled:
+                    continue
+                for watchpoint in watchpoints:
+                    if (watchpoint in affected or not watchpoint.EVENT_TYPES) and watchpoint.is_triggered(self):
+                        return watchpoint
+                affected.clear()
+        finally:
+            for event_type, notify in subscriptions:
+                self._cpu.unsubscribe(event_type, notify)
+        return None
+
+    def subscribe(self, event_type, callback) -> None:
+        self._cpu.subscribe(event_type, callback)
+
+    def unsubscribe(self, event_type, callback) -> None:
+        self._cpu.unsubscribe(event_type, callback)
+
     def reset(self) -> None:
         self._cpu.reset()
 
@@ -24,6 +69,36 @@ class Controller:
     def get_num_instruction_queue_slots(self) -> int:
         return self._cpu.get_num_instruction_queue_slots()
 
+    def set_latency_sampler(self, sampler) -> None:
+        self._cpu.set_latency_sampler(sampler)
+
+    def set_instruction_queue_size(self, num_slots) -> None:
+        self._cpu.set_instruction_queue_size(num_slots)
+
+    def get_counters(self) -> dict:
+        return self._cpu.counters.as_dict()
+
+    def save_state(self) -> tuple:
+        return self._cpu.save_state()
+
+    def restore_state(self, saved_state) -> None:
+        self._cpu.restore_state(saved_state)
+
+    def fast_forward_to_end(self, cycle_count, counters) -> None:
+        self._cpu.fast_forward_to_end(cycle_count, counters)
+
+    def get_num_issued_instructions(self) -> int:
+        return self._cpu.get_num_issued_instructions()
+
+    def get_next_instruction_to_fetch(self) -> int:
+        return self._cpu.instruction_pointer
+
+    def get_normalized_state(self) -> tuple:
+        return self._cpu.get_normalized_state()
+
+    def skip_ahead(self, num_instructions, num_cycles, counter_deltas) -> None:
+        self._cpu.skip_ahead(num_instructions, num_cycles, counter_deltas)
+
     def get_num_cycles_load_store(self) -> int:
         return self._cpu.num_cycles_load_store
 
@@ -78,8 +153,91 @@ class Controller:
     def get_reservation_stations_instruction_states(self) -> List:
         return self._cpu.get_reservation_stations_instruction_states()
 
+    def get_reservation_stations_issue_states(self) -> List:
+        return self._cpu.get_reservation_stations_issue_states()
+
+    def get_reservation_station_states(self) -> List:
+        return self._cpu.get_reservation_station_states()
+
+    def get_write_back_issue_number(self) -> Optional[int]:
+        return self._cpu.get_write_back_issue_number()
+
+    def get_memory_access_issue_number(self) -> Optional[int]:
+        return self._cpu.get_memory_access_issue_number()
+
+    def get_committed_issue_numbers(self) -> List[int]:
+        return self._cpu.get_committed_issue_numbers()
+
     def set_reservation_station_sizes(self, load_store_rs_nums, add_sub_rs_nums, mul_div_rs_nums) -> None:
         self._cpu.set_reservation_station_sizes(load_store_rs_nums, add_sub_rs_nums, mul_div_rs_nums)
 
+    def get_reservation_station_of(self, issue_number):
+        return self._cpu.get_reservation_station_of(issue_number)
+
+    def register_is_busy(self, register) -> bool:
+        return self._cpu.register_is_busy(register)
+
+    def has_write_back_conflict(self) -> bool:
+        return self._cpu.has_write_back_conflict()
+
+    def reservation_station_class_is_full(self, station_class) -> bool:
+        return self._cpu.reservation_station_class_is_full(station_class)
+
     def set_scheduling_algorithm(self, algorithm) -> None:
         self._cpu.set_scheduling_algorithm(algorithm)
+
+    def get_scheduling_algorithm(self) -> str:
+        return self._cpu.get_scheduling_algorithm()
+
+    def get_program(self) -> Optional[List[Instruction]]:
+        return self._cpu.get_program()
+
+    def estimate_cycles(self) -> Optional[CycleEstimate]:
+        program = self.get_program()
+        if program is None:
+            return None
+        return estimate_cycles(program, self.get_machine_config())
+
+    def get_machine_config(self) -> MachineConfig:
+        return MachineConfig(
+            algorithm=self.get_scheduling_algorithm(),
+            num_cycles_load_store=self.get_num_cycles_load_store(),
+            num_cycles_add_sub=self.get_num_cycles_add_sub(),
+            num_cycles_mul_div=self.get_num_cycles_mul_div(),
+            num_reservation_stations_load_store=self.get_num_reservation_stations_load_store(),
+            num_reservation_stations_add_sub=self.get_num_reservation_stations_add_sub(),
+            num_reservation_stations_mul_div=self.get_num_reservation_stations_mul_div(),
+            instruction_queue_size=self.get_num_instruction_queue_slots(),
+            num_functional_units_load_store=self._cpu.num_functional_units_load_store,
+            num_functional_units_add_sub=self._cpu.num_functional_units_add_sub,
+            num_functional_units_mul_div=self._cpu.num_functional_units_mul_div,
+            initiation_interval_load_store=self._cpu.initiation_interval_load_store,
+            initiation_interval_add_sub=self._cpu.initiation_interval_add_sub,
+            initiation_interval_mul_div=self._cpu.initiation_interval_mul_div,
+            memory_disambiguation=self._cpu.memory_disambiguation,
+            x_register_bases=self._cpu.x_register_bases,
+            rob_size=self._cpu.rob_size,
+            commit_width=self._cpu.commit_width,
+            **self._cpu.memory_hierarchy_config._asdict(),
+        )
+
+    def set_machine_config(self, config: MachineConfig) -> None:
+        validate_config(config)
+        self.set_scheduling_algorithm(config.algorithm)
+        self.set_num_cycles(config.num_cycles_load_store, config.num_cycles_add_sub, config.num_cycles_mul_div)
+        self.set_reservation_station_sizes(
+            config.num_reservation_stations_load_store,
+            config.num_reservation_stations_add_sub,
+            config.num_reservation_stations_mul_div,
+        )
+        self._cpu.set_functional_units(
+            config.num_functional_units_load_store, config.num_functional_units_add_sub,
+            config.num_functional_units_mul_div, config.initiation_interval_load_store,
+            config.initiation_interval_add_sub, config.initiation_interval_mul_div,
+        )
+        self._cpu.set_memory_disambiguation(config.memory_disambiguation, config.x_register_bases)
+        self._cpu.set_reorder_buffer_size(config.rob_size, config.commit_width)
+        self.set_instruction_queue_size(config.instruction_queue_size)
+        self._cpu.set_memory_hierarchy_config(
+            MemoryHierarchyConfig(**{field: getattr(config, field) for field in MemoryHierarchyConfig._fields})
+        )
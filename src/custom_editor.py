@@ -1,9 +1,22 @@
-from PyQt5.QtCore import Qt, QRect, QSize
+from threading import Thread
+
+from PyQt5.QtCore import Qt, QRect, QSize, QTimer, pyqtSignal
 from PyQt5.QtWidgets import QWidget, QPlainTextEdit, QTextEdit
 from PyQt5.QtGui import QColor, QPainter, QTextFormat, QSyntaxHighlighter, QTextCharFormat
 
+from assembler import assemble_all_errors
+
+# The text is validated once typing has paused for this long
+VALIDATION_DELAY_MS = 300
+# Larger programs are only validated in the background, expanding them is left to loading
+VALIDATION_MAX_INSTRUCTIONS = 100000
+
 
 class QCodeEditor(QPlainTextEdit):
+    # Success, the numbers of all offending lines and the instructions of the text validated last
+    validation_finished = pyqtSignal(bool, list, object)
+    _validation_done = pyqtSignal(int, str, object)
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.line_number_area = _QLineNumberArea(self)
@@ -13,6 +26,39 @@ class QCodeEditor(QPlainTextEdit):
         self.update_line_number_area_width(0)
         self.highlighter = _SyntaxHighlighter(self.document())
 
+        self._validated_text = None
+        self._validation = None
+        self._num_validations = 0
+        self._validation_timer = QTimer(self)
+        self._validation_timer.setSingleShot(True)
+        self._validation_timer.setInterval(VALIDATION_DELAY_MS)
+        self._validation_timer.timeout.connect(self._start_validation)
+        self.textChanged.connect(self._validation_timer.start)
+        self._validation_done.connect(self._finish_validation)
+
+    def get_validated_program(self, text):
+        # (success, offending lines, instructions) when text is what was validated last, otherwise None
+        if self._validation is not None and text == self._validated_text:
+            return self._validation
+        return None
+
+    def _start_validation(self):
+        self._num_validations += 1
+        thread = Thread(target=self._validate, args=(self._num_validations, self.toPlainText().lower()), daemon=True)
+        thread.start()
+
+    def _validate(self, validation_number, text):
+        # Runs on a worker thread, the signal hands the result back to the GUI thread. Lines that did not change
+        # since the last validation hit the line cache of the assembler.
+        self._validation_done.emit(validation_number, text, assemble_all_errors(text, VALIDATION_MAX_INSTRUCTIONS))
+
+    def _finish_validation(self, validation_number, text, validation):
+        if validation_number != self._num_validations:
+            return  # The text was edited again in the meantime
+        self._validated_text = text
+        self._validation = validation
+        self.validation_finished.emit(*validation)
+
     def line_number_area_width(self):
         digits = 1
         max_value = max(1, self.blockCount())
@@ -97,12 +143,14 @@ class _SyntaxHighlighter(QSyntaxHighlighter):
             char_format = QTextCharFormat()
             char_format.setBackground(QColor(color))
             self._highlight_lines[line] = char_format
-            tb = self.document().findBlockByLineNumber(line)
+            tb = self.document().findBlockByNumber(line)
             self.rehighlightBlock(tb)
 
     def clear_highlight(self):
-        self._highlight_lines = dict()
-        self.rehighlight()
+        # Only the highlighted blocks are redrawn, which matters for long programs
+        highlighted_lines, self._highlight_lines = self._highlight_lines, dict()
+        for line in highlighted_lines:
+            self.rehighlightBlock(self.document().findBlockByNumber(line))
 
     def highlightBlock(self, text):
         line = self.currentBlock().blockNumber()
@@ -0,0 +1,139 @@
+from collections import deque
+from typing import List, NamedTuple
+
+from instruction import Instruction
+from machine_config import MachineConfig
+
+
+class CycleEstimate(NamedTuple):
+    lower_bound: int
+    upper_bound: int
+    critical_path: int
+    resource_bound: int
+
+
+def estimate_cycles(instructions: List[Instruction], config=MachineConfig()) -> CycleEstimate:
+    # A single pass over the program. Every instruction gets the earliest cycle it could issue, execute, access
+    # memory and write back under its RAW dependencies, in-order issue and reservation station occupancy, which
+    # bounds the cycle count from below. The upper bound runs the instructions one after the other with no overlap.
+    scoreboard = config.algorithm == 'Scoreboard'
+    read_operands_cycles = 1 if scoreboard else 0
+    # Memory accesses are taken to hit in a single cycle for the lower bound and to go all the way to memory for
+    # the upper bound
+    extra_memory_cycles = _worst_memory_cycles(config) - 1
+    num_stations = {
+        'load_store': config.num_reservation_stations_load_store,
+        'add_sub': config.num_reservation_stations_add_sub,
+        'mul_div': config.num_reservation_stations_mul_div,
+    }
+    # Shared functional units, a class without any has a unit per station that takes a new operation every cycle
+    num_functional_units = {
+        'load_store': config.num_functional_units_load_store,
+        'add_sub': config.num_functional_units_add_sub,
+        'mul_div': config.num_functional_units_mul_div,
+    }
+    initiation_intervals = {
+        'load_store': config.initiation_interval_load_store if config.num_functional_units_load_store else 1,
+        'add_sub': config.initiation_interval_add_sub if config.num_functional_units_add_sub else 1,
+        'mul_div': config.initiation_interval_mul_div if config.num_functional_units_mul_div else 1,
+    }
+    recent_free_cycles = {unit: deque(maxlen=num) for unit, num in num_stations.items()}
+    unit_busy_cycles = dict.fromkeys(num_stations, 0)
+    num_operations = dict.fromkeys(num_stations, 0)
+    latency_of = dict.fromkeys(num_stations, 0)
+    write_back_cycle_of = {}  # The earliest write back of the latest writer of each register
+    issue_cycle = 0
+    critical_path = 1
+    serial_cycles = 1
+    num_write_backs = 0
+    num_memory_accesses = 0
+
+    for inst in instructions:
+        unit, latency = _unit_and_latency_of(inst, config)
+        num_operations[unit] += 1
+        latency_of[unit] = latency
+        freed_stations = recent_free_cycles[unit]
+        issue_cycle += 1
+        if len(freed_stations) == freed_stations.maxlen:
+            issue_cycle = max(issue_cycle, min(freed_stations))
+        if scoreboard and inst.destination:
+            issue_cycle = max(issue_cycle, write_back_cycle_of.get(inst.destination, 0) + 1)
+
+        sources = [inst.source1] if inst.is_store() else [] if inst.is_load() else [inst.source1, inst.source2]
+        operands_ready = max([write_back_cycle_of.get(source, 0) + 1 for source in sources] + [issue_cycle + 1])
+        if inst.is_store() and not scoreboard:
+            execute_cycle = issue_cycle + 1
+            memory_cycle = max(execute_cycle + latency, operands_ready)
+            free_cycle = memory_cycle + 1
+        else:
+            execute_cycle = operands_ready + read_operands_cycles
+            if inst.is_store():
+                free_cycle = execute_cycle + latency + 1
+            elif inst.is_load():
+                free_cycle = execute_cycle + latency + 2
+            else:
+                free_cycle = execute_cycle + latency + 1
+        # Loads may be forwarded from a store without accessing memory
+        if inst.is_store() or (inst.is_load() and not config.memory_disambiguation):
+            num_memory_accesses += 1
+        if not inst.is_store():
+            num_write_backs += 1
+            write_back_cycle_of[inst.destination] = free_cycle - 1
+
+        freed_stations.append(free_cycle)
+        # Only the cycles an instruction holds its station without waiting for anything count towards the resource
+        # bound, since the waiting in this optimistic schedule need not happen in the real one
+        unit_busy_cycles[unit] += _serial_occupancy(inst, latency, read_operands_cycles)
+        critical_path = max(critical_path, free_cycle)
+        # Run one after the other, an operation may still wait for its unit to take a new one
+        serial_cycles += _serial_occupancy(inst, max(latency, initiation_intervals[unit]), read_operands_cycles)
+        if inst.is_load_store():
+            serial_cycles += extra_memory_cycles
+
+    # The shared units of a class start an operation every initiation interval at best, the first one in cycle 2
+    unit_throughput_bounds = [
+        2 + initiation_intervals[unit] * (-(-num_operations[unit] // num_functional_units[unit]) - 1) +
+        latency_of[unit] + 1
+        for unit in num_stations if num_functional_units[unit] and num_operations[unit]
+    ]
+    resource_bound = max(
+        [-(-busy_cycles // num_stations[unit]) for unit, busy_cycles in unit_busy_cycles.items()] +
+        [num_write_backs + 3 if num_write_backs else 1, num_memory_accesses + 3 if num_memory_accesses else 1] +
+        unit_throughput_bounds
+    )
+    lower_bound = max(critical_path, resource_bound)
+    return CycleEstimate(
+        lower_bound=lower_bound, upper_bound=max(serial_cycles, lower_bound),
+        critical_path=critical_path, resource_bound=resource_bound,
+    )
+
+
+def prune_dominated_configs(instructions: List[Instruction], configs: List[MachineConfig]) -> List[MachineConfig]:
+    # A config whose lower bound exceeds the best upper bound can never be the fastest one
+    estimates = [estimate_cycles(instructions, config) for config in configs]
+    if not estimates:
+        return []
+    best_upper_bound = min(estimate.upper_bound for estimate in estimates)
+    return [config for config, estimate in zip(configs, estimates) if estimate.lower_bound <= best_upper_bound]
+
+
+def _unit_and_latency_of(inst: Instruction, config: MachineConfig):
+    if inst.is_load_store():
+        return 'load_store', config.num_cycles_load_store
+    if inst.is_add_sub():
+        return 'add_sub', config.num_cycles_add_sub
+    return 'mul_div', config.num_cycles_mul_div
+
+
+def _worst_memory_cycles(config: MachineConfig) -> int:
+    if config.l1_size_bytes == 0:
+        return 1
+    return max(config.l1_hit_cycles, config.l2_hit_cycles, config.memory_cycles)
+
+
+def _serial_occupancy(inst: Instruction, latency, read_operands_cycles) -> int:
+    # Cycles from issue until the station is freed when nothing else is in flight
+    occupancy = latency + 2 + read_operands_cycles
+    if inst.is_load():
+        occupancy += 1
+    return occupancy
@@ -0,0 +1,106 @@
+from typing import Callable, Dict, List, NamedTuple
+
+
+class IssueEvent(NamedTuple):
+    cycle: int
+    issue_number: int
+    station: object
+
+
+class OperandWakeupEvent(NamedTuple):
+    # The station captured operand 1 or 2 from the result broadcast on the CDB in the previous cycle
+    cycle: int
+    issue_number: int
+    station: object
+    operand: int
+
+
+class ExecuteStartEvent(NamedTuple):
+    cycle: int
+    issue_number: int
+    station: object
+
+
+class ExecuteEndEvent(NamedTuple):
+    # The cycle is the last one spent executing
+    cycle: int
+    issue_number: int
+    station: object
+
+
+class MemoryGrantEvent(NamedTuple):
+    cycle: int
+    issue_number: int
+    station: object
+
+
+class CdbBroadcastEvent(NamedTuple):
+    cycle: int
+    issue_number: int
+    station: object
+
+
+class StationFreeEvent(NamedTuple):
+    cycle: int
+    issue_number: int
+    station: object
+
+
+class CycleEndEvent(NamedTuple):
+    cycle: int
+
+
+# The engine reads these attributes of EventHooks at every point an event can happen
+HOOK_ATTRIBUTES = {
+    IssueEvent: 'issue',
+    OperandWakeupEvent: 'operand_wakeup',
+    ExecuteStartEvent: 'execute_start',
+    ExecuteEndEvent: 'execute_end',
+    MemoryGrantEvent: 'memory_grant',
+    CdbBroadcastEvent: 'cdb_broadcast',
+    StationFreeEvent: 'station_free',
+    CycleEndEvent: 'cycle_end',
+}
+
+
+class EventHooks:
+    # Every hook is None while nobody subscribes to its event, so the engine only pays for a None check and does not
+    # even build the event. Whenever the subscribers of an event change, its hook is rebuilt as the only callback
+    # or a function calling all of them.
+    def __init__(self):
+        self.issue = None
+        self.operand_wakeup = None
+        self.execute_start = None
+        self.execute_end = None
+        self.memory_grant = None
+        self.cdb_broadcast = None
+        self.station_free = None
+        self.cycle_end = None
+        self._subscribers: Dict[type, List[Callable]] = {event_type: [] for event_type in HOOK_ATTRIBUTES}
+
+    def subscribe(self, event_type, callback: Callable) -> None:
+        self._subscribers_of(event_type).append(callback)
+        self._rebuild_hook(event_type)
+
+    def unsubscribe(self, event_type, callback: Callable) -> None:
+        subscribers = self._subscribers_of(event_type)
+        if callback in subscribers:
+            subscribers.remove(callback)
+            self._rebuild_hook(event_type)
+
+    def _subscribers_of(self, event_type) -> List[Callable]:
+        if event_type not in self._subscribers:
+            raise ValueError(f'Unknown event type {event_type}')
+        return self._subscribers[event_type]
+
+    def _rebuild_hook(self, event_type) -> None:
+        callbacks = tuple(self._subscribers[event_type])
+        if not callbacks:
+            hook = None
+        elif len(callbacks) == 1:
+            hook = callbacks[0]
+        else:
+            def hook(event):
+                for callback in callbacks:
+                    callback(event)
+        setattr(self, HOOK_ATTRIBUTES[event_type], hook)
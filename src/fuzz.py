@@ -0,0 +1,244 @@
+import argparse
+import importlib
+import json
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, NamedTuple, Optional
+
+from codegen_engine import CompiledEngine
+from dataflow import estimate_cycles
+from instruction import Instruction
+from machine_config import MachineConfig
+from simulation import SimulationResult, simulate
+from workload_generator import WorkloadGenerator
+
+DEFAULT_MAX_INSTRUCTIONS = 60
+DEFAULT_OUTPUT_DIRECTORY = 'fuzz_failures'
+# Both engines are cut off at the same cycle, far beyond the fully serial execution of the program,
+# so that a candidate that never finishes cannot hang the harness
+CYCLE_LIMIT_FACTOR = 8
+SHRINKABLE_CONFIG_FIELDS = [
+    'num_cycles_load_store', 'num_cycles_add_sub', 'num_cycles_mul_div', 'num_reservation_stations_load_store',
+    'num_reservation_stations_add_sub', 'num_reservation_stations_mul_div', 'instruction_queue_size',
+]
+
+
+class FuzzCase(NamedTuple):
+    seed: int
+    config: MachineConfig
+    instructions: List[Instruction]
+
+
+class FuzzFailure(NamedTuple):
+    seed: int
+    config: MachineConfig
+    instructions: List[Instruction]
+    message: str
+
+
+def run_reference(instructions, config, max_cycles) -> SimulationResult:
+    return simulate(instructions, config, max_cycles)
+
+
+def run_compiled(instructions, config, max_cycles) -> SimulationResult:
+    return CompiledEngine(config).run(instructions, max_cycles, record_trace=True)
+
+
+ENGINES = {
+    'reference': run_reference,
+    'compiled': run_compiled,
+}
+
+
+def resolve_engine(name) -> Callable:
+    # Either a registered engine or module:function, called as function(instructions, config, max_cycles)
+    if name in ENGINES:
+        return ENGINES[name]
+    module_name, _, function_name = name.partition(':')
+    if not function_name:
+        raise ValueError(f'Unknown engine {name}, expected one of {", ".join(ENGINES)} or module:function')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def generate_case(seed, max_instructions=DEFAULT_MAX_INSTRUCTIONS) -> FuzzCase:
+    rng = random.Random(seed)
+    config = MachineConfig(
+        algorithm=rng.choice(['Tomasulo', 'Scoreboard']),
+        num_cycles_load_store=rng.randint(1, 6),
+        num_cycles_add_sub=rng.randint(1, 8),
+        num_cycles_mul_div=rng.randint(1, 16),
+        num_reservation_stations_load_store=rng.randint(1, 4),
+        num_reservation_stations_add_sub=rng.randint(1, 3),
+        num_reservation_stations_mul_div=rng.randint(1, 2),
+        instruction_queue_size=rng.randint(1, 4),
+    )
+    generator = WorkloadGenerator(
+        seed=seed, num_registers=rng.randint(2, 32), hazard_density=rng.random(),
+        dependency_distances={distance: rng.random() for distance in range(5)},
+    )
+    instructions = list(generator.instructions(rng.randint(1, max_instructions)))
+    return FuzzCase(seed, config, instructions)
+
+
+def compare_engines(instructions, config, reference: Callable, candidate: Callable) -> Optional[str]:
+    max_cycles = cycle_limit_of(instructions, config)
+    return describe_difference(
+        _outcome_of(reference, instructions, config, max_cycles),
+        _outcome_of(candidate, instructions, config, max_cycles),
+    )
+
+
+def cycle_limit_of(instructions, config) -> int:
+    return CYCLE_LIMIT_FACTOR * estimate_cycles(instructions, config).upper_bound + 64
+
+
+def describe_estimate_violation(instructions, config, outcome) -> Optional[str]:
+    # The cycle count of the reference has to lie within the bounds of the dataflow estimate
+    if isinstance(outcome, str):
+        return None
+    estimate = estimate_cycles(instructions, config)
+    if estimate.lower_bound <= outcome.cycles <= estimate.upper_bound:
+        return None
+    return f'{outcome.cycles} cycles outside the estimated [{estimate.lower_bound}, {estimate.upper_bound}]'
+
+
+def describe_difference(expected, actual) -> Optional[str]:
+    # Outcomes are either a SimulationResult or the text of the exception the engine raised
+    if isinstance(expected, str) or isinstance(actual, str):
+        return None if expected == actual else f'reference: {_summary_of(expected)}, candidate: {_summary_of(actual)}'
+    for cycle, (expected_states, actual_states) in enumerate(zip(expected.trace, actual.trace), start=1):
+        if expected_states != actual_states:
+            return f'cycle {cycle}: reference {expected_states}, candidate {actual_states}'
+    if expected.cycles != actual.cycles or len(expected.trace) != len(actual.trace):
+        return f'reference finished after {expected.cycles} cycles, candidate after {actual.cycles}'
+    if expected.counters != actual.counters:
+        return f'counters differ: reference {expected.counters}, candidate {actual.counters}'
+    return None
+
+
+def shrink(instructions: List[Instruction], config: MachineConfig, reference: Callable, candidate: Callable):
+    # Greedily drops chunks of instructions of decreasing size and lowers config values,
+    # keeping every change after which the engines still disagree
+    def fails(trial_instructions, trial_config) -> bool:
+        return compare_engines(trial_instructions, trial_config, reference, candidate) is not None
+
+    return _shrink(instructions, config, fails)
+
+
+def shrink_estimate_violation(instructions: List[Instruction], config: MachineConfig, reference: Callable):
+    def fails(trial_instructions, trial_config) -> bool:
+        return _estimate_violation_of(reference, trial_instructions, trial_config) is not None
+
+    return _shrink(instructions, config, fails)
+
+
+def _shrink(instructions: List[Instruction], config: MachineConfig, fails: Callable):
+    changed = True
+    while changed:
+        changed = False
+        chunk = max(1, len(instructions) // 2)
+        while chunk >= 1:
+            start = 0
+            while start < len(instructions) and len(instructions) > 1:
+                trial = instructions[:start] + instructions[start + chunk:]
+                if trial and fails(trial, config):
+                    instructions = trial
+                    changed = True
+                else:
+                    start += chunk
+            chunk //= 2
+        for field in SHRINKABLE_CONFIG_FIELDS:
+            value = getattr(config, field)
+            for smaller_value in range(1, value):
+                trial_config = config._replace(**{field: smaller_value})
+                if fails(instructions, trial_config):
+                    config = trial_config
+                    changed = True
+                    break
+    return instructions, config
+
+
+def run_fuzzer(
+        num_cases, candidate_name, reference_name='reference', first_seed=0,
+        max_instructions=DEFAULT_MAX_INSTRUCTIONS, processes=None) -> Iterator[FuzzFailure]:
+    reference = resolve_engine(reference_name)
+    candidate = resolve_engine(candidate_name)
+    cases = [generate_case(seed, max_instructions) for seed in range(first_seed, first_seed + num_cases)]
+    # The reference and the candidate run side by side in separate workers
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = []
+        for case in cases:
+            max_cycles = cycle_limit_of(case.instructions, case.config)
+            pending.append((case, [
+                executor.submit(_run_engine_task, engine_name, case.instructions, case.config, max_cycles)
+                for engine_name in (reference_name, candidate_name)
+            ]))
+        for case, (expected, actual) in pending:
+            message = describe_difference(expected.result(), actual.result())
+            if message is not None:
+                instructions, config = shrink(case.instructions, case.config, reference, candidate)
+                yield FuzzFailure(
+                    case.seed, config, instructions, compare_engines(instructions, config, reference, candidate)
+                )
+            elif describe_estimate_violation(case.instructions, case.config, expected.result()) is not None:
+                instructions, config = shrink_estimate_violation(case.instructions, case.config, reference)
+                yield FuzzFailure(
+                    case.seed, config, instructions, _estimate_violation_of(reference, instructions, config)
+                )
+
+
+def write_reproducer(failure: FuzzFailure, directory=DEFAULT_OUTPUT_DIRECTORY) -> str:
+    # The assembler has no comment syntax, so the config goes next to the program instead of into it
+    os.makedirs(directory, exist_ok=True)
+    base_path = os.path.join(directory, f'fuzz-{failure.seed}')
+    with open(base_path + '.asm', 'w') as f:
+        f.write(''.join(inst.raw_text + '\n' for inst in failure.instructions))
+    with open(base_path + '.json', 'w') as f:
+        json.dump({'seed': failure.seed, 'config': failure.config._asdict(), 'difference': failure.message}, f, indent=2)
+    return base_path + '.asm'
+
+
+def _estimate_violation_of(reference: Callable, instructions, config) -> Optional[str]:
+    outcome = _outcome_of(reference, instructions, config, cycle_limit_of(instructions, config))
+    return describe_estimate_violation(instructions, config, outcome)
+
+
+def _run_engine_task(engine_name, instructions, config, max_cycles):
+    return _outcome_of(resolve_engine(engine_name), instructions, config, max_cycles)
+
+
+def _outcome_of(engine: Callable, instructions, config, max_cycles):
+    try:
+        return engine(instructions, config, max_cycles)
+    except Exception as error:  # A stalled or crashing engine is a finding, not a harness failure
+        return f'{type(error).__name__}: {error}'
+
+
+def _summary_of(outcome) -> str:
+    return outcome if isinstance(outcome, str) else f'{outcome.cycles} cycles'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Differential fuzzing of a ToMasulator engine against the reference')
+    parser.add_argument('--candidate', default='compiled', help='Registered engine name or module:function')
+    parser.add_argument('--reference', default='reference')
+    parser.add_argument('--cases', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first case')
+    parser.add_argument('--max-instructions', type=int, default=DEFAULT_MAX_INSTRUCTIONS)
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIRECTORY, help='Where minimal reproducers are written')
+    args = parser.parse_args()
+
+    num_failures = 0
+    for failure in run_fuzzer(args.cases, args.candidate, args.reference, args.seed, args.max_instructions, args.jobs):
+        num_failures += 1
+        path = write_reproducer(failure, args.output_dir)
+        print(f'FAIL seed {failure.seed}: {len(failure.instructions)} instructions in {path}: {failure.message}')
+    print(f'{args.cases - num_failures} of {args.cases} cases matched')
+    sys.exit(1 if num_failures else 0)
+
+
+if __name__ == '__main__':
+    main()
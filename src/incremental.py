@@ -0,0 +1,132 @@
+from typing import List, Optional, Tuple
+
+from controller import Controller
+from instruction import Instruction
+from machine_config import MachineConfig
+from processor import SimulationStalledError
+from simulation import CycleStates, SimulationResult, configure, iterate_controller_cycles
+
+CHECKPOINT_INTERVAL_CYCLES = 16
+
+LATENCY_FIELDS = {
+    'num_cycles_load_store': Instruction.is_load_store,
+    'num_cycles_add_sub': Instruction.is_add_sub,
+    'num_cycles_mul_div': Instruction.is_mul_div,
+}
+
+
+class IncrementalSimulator:
+    # Keeps checkpoints of the previous run. After an edit to the program or to the latencies, the simulation
+    # restarts from the last checkpoint before the first cycle the edit could affect, instead of from cycle 0.
+    def __init__(self, controller: Controller, cache=None, checkpoint_interval=CHECKPOINT_INTERVAL_CYCLES):
+        self._controller = controller
+        self._cache = cache
+        self._checkpoint_interval = checkpoint_interval
+        self._instructions: Optional[List[Instruction]] = None
+        self._config: Optional[MachineConfig] = None
+        self._trace: List[CycleStates] = []
+        self._checkpoints: List[Tuple[int, tuple]] = []
+
+    def forget(self) -> None:
+        self._instructions = None
+        self._config = None
+        self._trace = []
+        self._checkpoints = []
+
+    def run(self, instructions, config=MachineConfig(), max_cycles=None) -> SimulationResult:
+        instructions = list(instructions)
+        first_affected_cycle = self._first_affected_cycle(instructions, config)
+        while self._checkpoints and self._checkpoints[-1][0] >= first_affected_cycle:
+            self._checkpoints.pop()
+
+        controller = self._controller
+        controller.reset()
+        configure(controller, config)
+        controller.upload_to_memory(instructions)
+        if self._checkpoints:
+            checkpoint_cycle, saved_state = self._checkpoints[-1]
+            controller.restore_state(saved_state)
+            trace = self._trace[:checkpoint_cycle]
+        else:
+            cached_result = self._get_cached_result(instructions, config, max_cycles)
+            if cached_result is not None:
+                self.forget()
+                return cached_result
+            trace = []
+
+        remaining_cycles = None if max_cycles is None else max_cycles - controller.get_cycle_count()
+        try:
+            for cycle, states in iterate_controller_cycles(controller, remaining_cycles):
+                trace.append(states)
+                if cycle % self._checkpoint_interval == 0:
+                    self._checkpoints.append((cycle, controller.save_state()))
+        except SimulationStalledError:
+            self.forget()
+            raise
+        self._instructions = instructions
+        self._config = config
+        self._trace = trace
+        result = SimulationResult(cycles=controller.get_cycle_count(), trace=trace, counters=controller.get_counters())
+        if self._cache is not None and not controller.there_is_work_to_do():
+            self._cache.put(self._cache.key(instructions, config, max_cycles), result)
+        return result
+
+    def _get_cached_result(self, instructions, config, max_cycles) -> Optional[SimulationResult]:
+        if self._cache is None:
+            return None
+        result = self._cache.get(self._cache.key(instructions, config, max_cycles))
+        if result is None or not result.trace:
+            return None
+        self._controller.fast_forward_to_end(result.cycles, result.counters)
+        return result
+
+    def _first_affected_cycle(self, instructions: List[Instruction], config: MachineConfig) -> int:
+        previous_config = self._config
+        if previous_config is None:
+            return 1
+        latencies = {field: getattr(config, field) for field in LATENCY_FIELDS}
+        if previous_config._replace(**latencies) != config:
+            return 1
+        first_cycle = len(self._trace) + 1
+
+        # An instruction can only affect the machine once it reaches the head of the queue, which is right after
+        # the instruction before it issues
+        first_changed_instruction = _first_changed_instruction(self._instructions, instructions)
+        if first_changed_instruction is not None:
+            if first_changed_instruction == 0:
+                return 1
+            first_cycle = min(first_cycle, self._issue_cycle_of(first_changed_instruction - 1) + 1)
+
+        changed_units = [
+            belongs_to_unit for field, belongs_to_unit in LATENCY_FIELDS.items()
+            if getattr(config, field) != getattr(previous_config, field)
+        ]
+        if changed_units:
+            first_cycle = min(first_cycle, self._first_execution_cycle(changed_units))
+        return first_cycle
+
+    def _issue_cycle_of(self, index) -> int:
+        for cycle, states in enumerate(self._trace, start=1):
+            if (index + 1, 'I') in states:
+                return cycle
+        return len(self._trace)
+
+    def _first_execution_cycle(self, units) -> int:
+        for cycle, states in enumerate(self._trace, start=1):
+            for number, state in states:
+                if state == 'E1' and any(belongs_to_unit(self._instructions[number - 1]) for belongs_to_unit in units):
+                    return cycle
+        return len(self._trace) + 1
+
+
+def _first_changed_instruction(old_instructions: List[Instruction], new_instructions: List[Instruction]) -> Optional[int]:
+    for index, (old, new) in enumerate(zip(old_instructions, new_instructions)):
+        if _key_of(old) != _key_of(new):
+            return index
+    if len(old_instructions) != len(new_instructions):
+        return min(len(old_instructions), len(new_instructions))
+    return None
+
+
+def _key_of(inst: Instruction) -> tuple:
+    return inst.operation, inst.destination, inst.source1, inst.source2, inst.offset
@@ -40,3 +40,10 @@ class Instruction:
 
     def is_mul_div(self):
         return self.is_mul() or self.is_div()
+
+    def format_text(self) -> str:
+        if self.is_load():
+            return f'{self.operation} {self.destination}, {self.offset}({self.source1})'
+        if self.is_store():
+            return f'{self.operation} {self.source1}, {self.offset}({self.source2})'
+        return f'{self.operation} {self.destination}, {self.source1}, {self.source2}'
@@ -0,0 +1,78 @@
+from typing import NamedTuple, Tuple
+
+from processor import (
+    LOAD_STORE_LATENCY_CYCLES, ADD_SUB_LATENCY_CYCLES, MUL_DIV_LATENCY_CYCLES,
+    LOAD_STORE_RS_NUMS, ADD_SUB_RS_NUMS, MUL_DIV_RS_NUMS, FUNCTIONAL_UNIT_NUMS, INITIATION_INTERVAL_CYCLES,
+    ROB_ENTRY_NUMS, COMMIT_WIDTH, SCHEDULING_ALGORITHMS)
+from processor_components import INSTRUCTION_QUEUE_SLOT_NUMS
+from memory_hierarchy import (
+    L1_SIZE_BYTES, L1_ASSOCIATIVITY, L1_HIT_CYCLES, L2_SIZE_BYTES, L2_ASSOCIATIVITY, L2_HIT_CYCLES, MEMORY_CYCLES,
+    CACHE_LINE_BYTES, NUM_MSHRS, MemoryHierarchy, MemoryHierarchyConfig)
+
+
+class MachineConfig(NamedTuple):
+    algorithm: str = 'Tomasulo'
+    num_cycles_load_store: int = LOAD_STORE_LATENCY_CYCLES
+    num_cycles_add_sub: int = ADD_SUB_LATENCY_CYCLES
+    num_cycles_mul_div: int = MUL_DIV_LATENCY_CYCLES
+    num_reservation_stations_load_store: int = LOAD_STORE_RS_NUMS
+    num_reservation_stations_add_sub: int = ADD_SUB_RS_NUMS
+    num_reservation_stations_mul_div: int = MUL_DIV_RS_NUMS
+    instruction_queue_size: int = INSTRUCTION_QUEUE_SLOT_NUMS
+    # With 0 functional units every reservation station has a unit of its own, see FunctionalUnitPool
+    num_functional_units_load_store: int = FUNCTIONAL_UNIT_NUMS
+    num_functional_units_add_sub: int = FUNCTIONAL_UNIT_NUMS
+    num_functional_units_mul_div: int = FUNCTIONAL_UNIT_NUMS
+    initiation_interval_load_store: int = INITIATION_INTERVAL_CYCLES
+    initiation_interval_add_sub: int = INITIATION_INTERVAL_CYCLES
+    initiation_interval_mul_div: int = INITIATION_INTERVAL_CYCLES
+    # The memory hierarchy model is off while l1_size_bytes is 0, see memory_hierarchy.py
+    l1_size_bytes: int = L1_SIZE_BYTES
+    l1_associativity: int = L1_ASSOCIATIVITY
+    l1_hit_cycles: int = L1_HIT_CYCLES
+    l2_size_bytes: int = L2_SIZE_BYTES
+    l2_associativity: int = L2_ASSOCIATIVITY
+    l2_hit_cycles: int = L2_HIT_CYCLES
+    memory_cycles: int = MEMORY_CYCLES
+    cache_line_bytes: int = CACHE_LINE_BYTES
+    num_mshrs: int = NUM_MSHRS
+    # Orders loads after older stores to the same address and forwards the store data to them. Addresses are
+    # offset(xN) with the base of xN taken from x_register_bases, see memory_hierarchy.effective_address().
+    memory_disambiguation: bool = False
+    x_register_bases: Tuple[int, ...] = ()
+    # Only used by the Tomasulo+ROB algorithm
+    rob_size: int = ROB_ENTRY_NUMS
+    commit_width: int = COMMIT_WIDTH
+
+
+# A latency of 0 would never finish executing, and without stations or queue slots nothing can issue
+POSITIVE_FIELDS = [
+    'num_cycles_load_store', 'num_cycles_add_sub', 'num_cycles_mul_div', 'num_reservation_stations_load_store',
+    'num_reservation_stations_add_sub', 'num_reservation_stations_mul_div', 'instruction_queue_size',
+    'initiation_interval_load_store', 'initiation_interval_add_sub', 'initiation_interval_mul_div', 'rob_size',
+    'commit_width',
+]
+NON_NEGATIVE_FIELDS = [
+    'num_functional_units_load_store', 'num_functional_units_add_sub', 'num_functional_units_mul_div',
+    'l1_size_bytes', 'l2_size_bytes',
+]
+
+
+def validate_config(config: MachineConfig) -> None:
+    # Raises ValueError for a config the processor cannot run, before any of it is applied
+    if config.algorithm not in SCHEDULING_ALGORITHMS:
+        raise ValueError(f'Unknown scheduling algorithm {config.algorithm}')
+    for field in POSITIVE_FIELDS:
+        if getattr(config, field) < 1:
+            raise ValueError(f'{field} must be at least 1, not {getattr(config, field)}')
+    for field in NON_NEGATIVE_FIELDS:
+        if getattr(config, field) < 0:
+            raise ValueError(f'{field} must not be negative, not {getattr(config, field)}')
+    if config.l1_size_bytes:
+        # The memory hierarchy checks its own fields
+        MemoryHierarchy(MemoryHierarchyConfig(**{field: getattr(config, field) for field in MemoryHierarchyConfig._fields}))
+
+
+def config_from_dict(fields: dict) -> MachineConfig:
+    # For configs read back from JSON, which turns tuples into lists
+    return MachineConfig(**{name: tuple(value) if isinstance(value, list) else value for name, value in fields.items()})
@@ -1,10 +1,6 @@
 import sys
 
-from PyQt5.QtWidgets import QApplication
-
 from controller import Controller
-from settings import get_style_from_settings_file
-from window import MainWindow
 
 
 WINDOW_WIDTH = 1610
@@ -13,6 +9,11 @@ WINDOW_TITLE = 'ToMasulator'
 
 
 def main():
+    # Qt and the window modules are only imported here so that the engine modules stay importable without Qt
+    from PyQt5.QtWidgets import QApplication
+    from settings import get_style_from_settings_file
+    from window import MainWindow
+
     app = QApplication(sys.argv)
     app.setStyle(get_style_from_settings_file())
 
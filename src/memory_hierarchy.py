@@ -0,0 +1,215 @@
+import argparse
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from instruction import Instruction
+
+# An L1 size of 0 turns the model off: every memory access is granted at once and takes a single cycle
+L1_SIZE_BYTES = 0
+L1_ASSOCIATIVITY = 2
+L1_HIT_CYCLES = 1
+# An L2 size of 0 sends L1 misses straight to memory
+L2_SIZE_BYTES = 0
+L2_ASSOCIATIVITY = 4
+L2_HIT_CYCLES = 8
+MEMORY_CYCLES = 40
+CACHE_LINE_BYTES = 32
+NUM_MSHRS = 4
+
+# The x registers are never written by a program, so each holds a fixed base address. Registers without a base in
+# the machine config get one of their own, this far apart.
+X_REGISTER_STRIDE_BYTES = 4096
+
+CACHE_COUNTERS = ['l1_hits', 'l1_misses', 'l2_hits', 'l2_misses', 'mshr_stall_cycles']
+
+
+class MemoryHierarchyConfig(NamedTuple):
+    l1_size_bytes: int = L1_SIZE_BYTES
+    l1_associativity: int = L1_ASSOCIATIVITY
+    l1_hit_cycles: int = L1_HIT_CYCLES
+    l2_size_bytes: int = L2_SIZE_BYTES
+    l2_associativity: int = L2_ASSOCIATIVITY
+    l2_hit_cycles: int = L2_HIT_CYCLES
+    memory_cycles: int = MEMORY_CYCLES
+    cache_line_bytes: int = CACHE_LINE_BYTES
+    num_mshrs: int = NUM_MSHRS
+
+    def is_enabled(self) -> bool:
+        return self.l1_size_bytes > 0
+
+
+def effective_address(inst: Instruction, x_register_bases=()) -> int:
+    register_number = int((inst.source1 if inst.is_load() else inst.source2)[1:])
+    if register_number < len(x_register_bases):
+        base = x_register_bases[register_number]
+    else:
+        base = register_number * X_REGISTER_STRIDE_BYTES
+    return base + (int(inst.offset) if inst.offset else 0)
+
+
+def hit_rates(counters: dict) -> Tuple[Optional[float], Optional[float]]:
+    # The L1 and L2 hit rates, None for a level that was never accessed
+    return (
+        _hit_rate(counters.get('l1_hits', 0), counters.get('l1_misses', 0)),
+        _hit_rate(counters.get('l2_hits', 0), counters.get('l2_misses', 0)),
+    )
+
+
+class Cache:
+    # Set-associative with LRU replacement. Each set lists its line numbers from least to most recently used.
+    def __init__(self, size_bytes, associativity, line_bytes):
+        if associativity < 1 or size_bytes % (associativity * line_bytes) != 0:
+            raise ValueError(
+                f'A cache of {size_bytes} bytes cannot be split into {associativity}-way sets of {line_bytes} byte lines'
+            )
+        self._associativity = associativity
+        self._num_sets = size_bytes // (associativity * line_bytes)
+        self._sets: List[List[int]] = [[] for _ in range(self._num_sets)]
+
+    def reset(self) -> None:
+        for lines in self._sets:
+            lines.clear()
+
+    def lookup(self, line) -> bool:
+        lines = self._sets[line % self._num_sets]
+        if line not in lines:
+            return False
+        lines.remove(line)
+        lines.append(line)
+        return True
+
+    def fill(self, line) -> None:
+        lines = self._sets[line % self._num_sets]
+        if line in lines:
+            lines.remove(line)
+        elif len(lines) == self._associativity:
+            del lines[0]
+        lines.append(line)
+
+    def save_state(self) -> tuple:
+        return tuple(tuple(lines) for lines in self._sets)
+
+    def restore_state(self, saved_state) -> None:
+        self._sets = [list(lines) for lines in saved_state]
+
+
+class MemoryHierarchy:
+    # Timing only: loads and stores alike allocate their line. A miss holds a miss status holding register (MSHR)
+    # until its line arrives, later misses to the same line merge into it, and a miss to another line that finds
+    # every MSHR busy has to wait.
+    def __init__(self, config: MemoryHierarchyConfig):
+        if config.cache_line_bytes < 1 or config.num_mshrs < 1:
+            raise ValueError('The cache line size and the number of MSHRs must be positive')
+        if min(config.l1_hit_cycles, config.l2_hit_cycles, config.memory_cycles) < 1:
+            raise ValueError('Memory latencies must be at least one cycle')
+        self.config = config
+        self._l1 = Cache(config.l1_size_bytes, config.l1_associativity, config.cache_line_bytes)
+        self._l2 = None
+        if config.l2_size_bytes > 0:
+            self._l2 = Cache(config.l2_size_bytes, config.l2_associativity, config.cache_line_bytes)
+        # Line number -> cycles until it arrives
+        self._mshrs: Dict[int, int] = {}
+
+    def reset(self) -> None:
+        self._l1.reset()
+        if self._l2 is not None:
+            self._l2.reset()
+        self._mshrs.clear()
+
+    def tick(self) -> None:
+        for line in list(self._mshrs):
+            self._mshrs[line] -= 1
+            if self._mshrs[line] == 0:
+                del self._mshrs[line]
+                self._l1.fill(line)
+                if self._l2 is not None:
+                    self._l2.fill(line)
+
+    def access(self, address, counters) -> Optional[int]:
+        # The number of cycles the access takes, or None when it misses and no MSHR is free
+        line = address // self.config.cache_line_bytes
+        if self._l1.lookup(line):
+            counters.l1_hits += 1
+            return self.config.l1_hit_cycles
+        if line in self._mshrs:
+            counters.l1_misses += 1
+            return self._mshrs[line]
+        if len(self._mshrs) >= self.config.num_mshrs:
+            return None
+        counters.l1_misses += 1
+        if self._l2 is None:
+            latency = self.config.memory_cycles
+        elif self._l2.lookup(line):
+            counters.l2_hits += 1
+            latency = self.config.l2_hit_cycles
+        else:
+            counters.l2_misses += 1
+            latency = self.config.memory_cycles
+        self._mshrs[line] = latency
+        return latency
+
+    def save_state(self) -> tuple:
+        return (
+            self._l1.save_state(), None if self._l2 is None else self._l2.save_state(),
+            tuple(sorted(self._mshrs.items())),
+        )
+
+    def restore_state(self, saved_state) -> None:
+        l1_state, l2_state, mshrs = saved_state
+        self._l1.restore_state(l1_state)
+        if self._l2 is not None:
+            self._l2.restore_state(l2_state)
+        self._mshrs = dict(mshrs)
+
+
+def _hit_rate(hits, misses) -> Optional[float]:
+    return hits / (hits + misses) if hits + misses else None
+
+
+def main():
+    # Imported here since the engine itself imports this module
+    from assembler import assemble_lazily
+    from comparison import ALGORITHMS
+    from machine_config import MachineConfig
+    from simulation import simulate
+
+    parser = argparse.ArgumentParser(description='Simulate a program behind a set-associative cache hierarchy')
+    parser.add_argument('program', help='Assembly file')
+    parser.add_argument('--l1-size', type=int, default=1024, help='L1 size in bytes')
+    parser.add_argument('--l1-associativity', type=int, default=L1_ASSOCIATIVITY)
+    parser.add_argument('--l1-hit-cycles', type=int, default=L1_HIT_CYCLES)
+    parser.add_argument('--l2-size', type=int, default=L2_SIZE_BYTES, help='L2 size in bytes, 0 for no L2')
+    parser.add_argument('--l2-associativity', type=int, default=L2_ASSOCIATIVITY)
+    parser.add_argument('--l2-hit-cycles', type=int, default=L2_HIT_CYCLES)
+    parser.add_argument('--memory-cycles', type=int, default=MEMORY_CYCLES)
+    parser.add_argument('--line-size', type=int, default=CACHE_LINE_BYTES, help='Cache line size in bytes')
+    parser.add_argument('--mshrs', type=int, default=NUM_MSHRS, help='Number of outstanding misses')
+    args = parser.parse_args()
+
+    with open(args.program) as f:
+        program_text = f.read().lower()
+    success, offending_line, _ = assemble_lazily(program_text)
+    if not success:
+        parser.exit(1, f'Error at line {offending_line}\n')
+    config = MachineConfig(
+        l1_size_bytes=args.l1_size, l1_associativity=args.l1_associativity, l1_hit_cycles=args.l1_hit_cycles,
+        l2_size_bytes=args.l2_size, l2_associativity=args.l2_associativity, l2_hit_cycles=args.l2_hit_cycles,
+        memory_cycles=args.memory_cycles, cache_line_bytes=args.line_size, num_mshrs=args.mshrs,
+    )
+    for algorithm in ALGORITHMS:
+        # Streamed, so that long repeat blocks are expanded as the instructions are fetched
+        _, _, instructions = assemble_lazily(program_text)
+        result = simulate(instructions, config._replace(algorithm=algorithm), record_trace=False)
+        l1_hit_rate, l2_hit_rate = hit_rates(result.counters)
+        print(
+            f'{algorithm}: {result.cycles} cycles, L1 hit rate {_format_rate(l1_hit_rate)}, '
+            f'L2 hit rate {_format_rate(l2_hit_rate)}, {result.counters["mshr_stall_cycles"]} MSHR stall cycles, '
+            f'{result.counters["memory_stall_cycles"]} memory stall cycles'
+        )
+
+
+def _format_rate(rate) -> str:
+    return '-' if rate is None else f'{rate:.1%}'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+import argparse
+import os
+import random
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from assembler import assemble
+from controller import Controller
+from instruction import Instruction
+from machine_config import MachineConfig
+from processor import SCHEDULING_ALGORITHMS
+from program_buffer import ProgramBuffer, load_program
+from simulation import configure, run_to_completion
+
+DEFAULT_NUM_REPLICAS = 1000
+DEFAULT_CONFIDENCE_LEVEL = 0.95
+# Replicas are handed to the workers in chunks, a few per worker so that uneven chunks still balance out
+CHUNKS_PER_WORKER = 4
+HISTOGRAM_BINS = 10
+HISTOGRAM_WIDTH = 50
+
+# Multiply and divide are sampled separately, mul_div sets both
+UNIT_CLASSES = {
+    'load_store': Instruction.is_load_store,
+    'add_sub': Instruction.is_add_sub,
+    'mul': Instruction.is_mul,
+    'div': Instruction.is_div,
+}
+
+
+class Distribution(NamedTuple):
+    kind: str
+    parameters: tuple
+
+    def sample(self, rng: random.Random) -> int:
+        if self.kind == 'fixed':
+            return self.parameters[0]
+        if self.kind == 'uniform':
+            return rng.randint(*self.parameters)
+        if self.kind == 'normal':
+            return max(1, round(rng.gauss(*self.parameters)))
+        values, weights = self.parameters
+        return rng.choices(values, weights)[0]
+
+
+class MonteCarloResult(NamedTuple):
+    num_instructions: int
+    cycles: List[int]
+    mean: float
+    stdev: float
+    confidence_interval: Tuple[float, float]
+    confidence_level: float
+
+    def percentile(self, percent) -> float:
+        # percent from 1 to 99
+        if len(self.cycles) < 2:
+            return float(self.cycles[0])
+        return statistics.quantiles(self.cycles, n=100, method='inclusive')[percent - 1]
+
+
+class LatencySampler:
+    # Draws the execution latency of each instruction as it issues. Draws are remembered by issue number, so the
+    # latency of an instruction stays the same when a state is restored and the instruction issues again.
+    def __init__(self, distributions: Dict[str, Distribution], seed):
+        self._distributions = [
+            (belongs_to_unit, distributions[unit]) for unit, belongs_to_unit in UNIT_CLASSES.items()
+            if unit in distributions
+        ]
+        self._rng = random.Random(seed)
+        self._latencies: Dict[int, int] = {}
+
+    def __call__(self, instruction: Instruction, issue_number) -> Optional[int]:
+        if issue_number in self._latencies:
+            return self._latencies[issue_number]
+        for belongs_to_unit, distribution in self._distributions:
+            if belongs_to_unit(instruction):
+                latency = distribution.sample(self._rng)
+                self._latencies[issue_number] = latency
+                return latency
+        return None
+
+
+def parse_distribution(text) -> Distribution:
+    # N or fixed:N, uniform:LOW:HIGH, normal:MEAN:STDEV (rounded, at least 1) or choice:VALUE=WEIGHT,...
+    kind, _, arguments = text.partition(':')
+    try:
+        if not arguments:
+            return _checked(Distribution('fixed', (int(kind),)))
+        if kind == 'fixed':
+            return _checked(Distribution('fixed', (int(arguments),)))
+        if kind == 'uniform':
+            low, high = arguments.split(':')
+            return _checked(Distribution('uniform', (int(low), int(high))))
+        if kind == 'normal':
+            mean, stdev = arguments.split(':')
+            return _checked(Distribution('normal', (float(mean), float(stdev))))
+        if kind == 'choice':
+            pairs = [pair.split('=') for pair in arguments.split(',')]
+            return _checked(Distribution(
+                'choice', (tuple(int(value) for value, _ in pairs), tuple(float(weight) for _, weight in pairs))
+            ))
+    except ValueError:
+        pass
+    raise ValueError(f'Invalid latency distribution {text}')
+
+
+def parse_distributions(text) -> Dict[str, Distribution]:
+    # UNIT=DISTRIBUTION entries separated by ;, e.g. load_store=choice:1=9,20=1;div=uniform:10:30
+    distributions = {}
+    for entry in filter(None, (entry.strip() for entry in text.split(';'))):
+        unit, _, distribution = entry.partition('=')
+        units = ['mul', 'div'] if unit == 'mul_div' else [unit]
+        if not distribution or any(unit not in UNIT_CLASSES for unit in units):
+            raise ValueError(f'Invalid latency entry {entry}, expected one of {", ".join(UNIT_CLASSES)} or mul_div')
+        for unit in units:
+            distributions[unit] = parse_distribution(distribution)
+    return distributions
+
+
+def run_monte_carlo(
+        instructions: List[Instruction], distributions: Dict[str, Distribution], config=MachineConfig(),
+        num_replicas=DEFAULT_NUM_REPLICAS, seed=0, processes=None,
+        confidence_level=DEFAULT_CONFIDENCE_LEVEL) -> MonteCarloResult:
+    # Replica i samples its latencies with seed + i, so any replica can be rerun on its own
+    num_workers = processes or os.cpu_count() or 1
+    num_chunks = max(1, min(num_replicas, num_workers * CHUNKS_PER_WORKER))
+    with ProgramBuffer(instructions) as program, ProcessPoolExecutor(max_workers=num_workers) as executor:
+        bounds = [seed + num_replicas * chunk // num_chunks for chunk in range(num_chunks + 1)]
+        tasks = [(program.handle, config, distributions, first, last) for first, last in zip(bounds, bounds[1:])]
+        cycles = [cycle for chunk in executor.map(_run_replicas, tasks) for cycle in chunk]
+    return summarize(len(instructions), cycles, confidence_level)
+
+
+def run_replica(instructions, distributions: Dict[str, Distribution], config=MachineConfig(), seed=0) -> int:
+    controller = Controller()
+    configure(controller, config)
+    controller.set_latency_sampler(LatencySampler(distributions, seed))
+    controller.upload_to_memory(instructions)
+    return run_to_completion(controller, record_trace=False).cycles
+
+
+def summarize(num_instructions, cycles: List[int], confidence_level=DEFAULT_CONFIDENCE_LEVEL) -> MonteCarloResult:
+    mean = statistics.fmean(cycles)
+    stdev = statistics.stdev(cycles) if len(cycles) > 1 else 0.0
+    # Normal approximation of the distribution of the mean, which holds for the usual hundreds of replicas
+    margin = statistics.NormalDist().inv_cdf(0.5 + confidence_level / 2) * stdev / len(cycles) ** 0.5
+    return MonteCarloResult(
+        num_instructions=num_instructions, cycles=cycles, mean=mean, stdev=stdev,
+        confidence_interval=(mean - margin, mean + margin), confidence_level=confidence_level,
+    )
+
+
+def format_result(result: MonteCarloResult, histogram=True) -> str:
+    low, high = result.confidence_interval
+    level = f'{result.confidence_level:.0%}'
+    lines = [
+        f'{len(result.cycles)} replicas of {result.num_instructions} instructions',
+        f'Cycles: mean {result.mean:.1f}, stdev {result.stdev:.1f}, {level} confidence interval of the mean '
+        f'[{low:.1f}, {high:.1f}]',
+        f'Min {min(result.cycles)}, 5th percentile {result.percentile(5):.0f}, median {result.percentile(50):.0f}, '
+        f'95th percentile {result.percentile(95):.0f}, max {max(result.cycles)}',
+        f'Throughput: {result.num_instructions / result.mean:.3f} instructions per cycle, {level} confidence interval '
+        f'[{result.num_instructions / high:.3f}, {result.num_instructions / low:.3f}]',
+    ]
+    if histogram:
+        lines.extend(_format_histogram(result.cycles))
+    return '\n'.join(lines)
+
+
+def _checked(distribution: Distribution) -> Distribution:
+    if distribution.kind == 'normal':
+        valid = distribution.parameters[1] >= 0
+    elif distribution.kind == 'choice':
+        values, weights = distribution.parameters
+        valid = min(values) >= 1 and min(weights) >= 0 and sum(weights) > 0
+    else:
+        valid = min(distribution.parameters) >= 1 and distribution.parameters == tuple(sorted(distribution.parameters))
+    if not valid:
+        raise ValueError
+    return distribution
+
+
+def _run_replicas(task) -> List[int]:
+    handle, config, distributions, first_seed, last_seed = task
+    return [
+        run_replica(load_program(handle), distributions, config, seed) for seed in range(first_seed, last_seed)
+    ]
+
+
+def _format_histogram(cycles: List[int]) -> List[str]:
+    low, high = min(cycles), max(cycles)
+    bin_width = max(1, -(-(high - low + 1) // HISTOGRAM_BINS))
+    counts = [0] * (-(-(high - low + 1) // bin_width))
+    for cycle in cycles:
+        counts[(cycle - low) // bin_width] += 1
+    largest = max(counts)
+    return [
+        f'{low + index * bin_width:>8}-{low + (index + 1) * bin_width - 1:<8} {count:>6} '
+        + '#' * round(HISTOGRAM_WIDTH * count / largest)
+        for index, count in enumerate(counts)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distribution of the cycle count of a program under random latencies')
+    parser.add_argument('program', help='Assembly file')
+    parser.add_argument(
+        '--latencies', required=True,
+        help='UNIT=DISTRIBUTION entries separated by ; where UNIT is load_store, add_sub, mul, div or mul_div and '
+             'DISTRIBUTION is N, uniform:LOW:HIGH, normal:MEAN:STDEV or choice:VALUE=WEIGHT,...; units that are '
+             'left out keep their fixed latency'
+    )
+    parser.add_argument('--algorithm', choices=SCHEDULING_ALGORITHMS, default='Tomasulo')
+    parser.add_argument('--replicas', type=int, default=DEFAULT_NUM_REPLICAS)
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first replica')
+    parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE_LEVEL)
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='Number of worker processes')
+    args = parser.parse_args()
+
+    try:
+        distributions = parse_distributions(args.latencies)
+    except ValueError as error:
+        parser.error(str(error))
+    with open(args.program) as f:
+        success, offending_line, instructions = assemble(f.read().lower())
+    if not success:
+        parser.exit(1, f'Error at line {offending_line}\n')
+    result = run_monte_carlo(
+        instructions, distributions, MachineConfig(algorithm=args.algorithm), args.replicas, args.seed, args.jobs,
+        args.confidence,
+    )
+    print(format_result(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,14 @@
-from typing import List
+from typing import List, Optional
 
-from processor_components import InstructionMemory, ReservationStation, InstructionQueue, CommonDataBus, DataMemory, Scheduler
+from processor_components import (
+    InstructionMemory, ReservationStation, FunctionalUnitPool, InstructionQueue, CommonDataBus, DataMemory, Scheduler,
+    ReorderBuffer, PerformanceCounters, INSTRUCTION_QUEUE_SLOT_NUMS, REGISTER_FILE)
+from events import EventHooks, CycleEndEvent
 from instruction import Instruction
+from memory_hierarchy import MemoryHierarchyConfig, effective_address
+
+# Bump whenever a change alters the simulated timing, so that stored results are invalidated
+ENGINE_VERSION = 2
 
 LOAD_STORE_LATENCY_CYCLES = 1
 ADD_SUB_LATENCY_CYCLES = 3
@@ -11,6 +18,31 @@ LOAD_STORE_RS_NUMS = 4
 ADD_SUB_RS_NUMS = 3
 MUL_DIV_RS_NUMS = 2
 
+# 0 functional units gives every reservation station a unit of its own, which is busy for the whole latency
+FUNCTIONAL_UNIT_NUMS = 0
+INITIATION_INTERVAL_CYCLES = 1
+
+# Tomasulo with a reorder buffer commits the instructions in program order, at most COMMIT_WIDTH per cycle
+TOMASULO_WITH_ROB = 'Tomasulo+ROB'
+SCHEDULING_ALGORITHMS = ('Tomasulo', 'Scoreboard', TOMASULO_WITH_ROB)
+ROB_ENTRY_NUMS = 16
+COMMIT_WIDTH = 2
+
+# A machine that goes this many cycles without any station changing state, issuing, writing back or accessing memory
+# while work is still pending will never finish
+STALL_DETECTION_CYCLES = 32
+
+
+class SimulationStalledError(RuntimeError):
+    def __init__(self, cycle, stuck_stations: List[str]):
+        super().__init__(f'No forward progress by cycle {cycle}, stuck stations: ' + '; '.join(stuck_stations))
+        self.cycle = cycle
+        self.stuck_stations = stuck_stations
+
+    def __reduce__(self):
+        # Keeps the error intact when it is raised in a worker process
+        return SimulationStalledError, (self.cycle, self.stuck_stations)
+
 
 class Processor:
     def __init__(self):
@@ -20,17 +52,38 @@ class Processor:
         self.num_reservation_stations_load_store = LOAD_STORE_RS_NUMS
         self.num_reservation_stations_add_sub = ADD_SUB_RS_NUMS
         self.num_reservation_stations_mul_div = MUL_DIV_RS_NUMS
+        self.num_functional_units_load_store = FUNCTIONAL_UNIT_NUMS
+        self.num_functional_units_add_sub = FUNCTIONAL_UNIT_NUMS
+        self.num_functional_units_mul_div = FUNCTIONAL_UNIT_NUMS
+        self.initiation_interval_load_store = INITIATION_INTERVAL_CYCLES
+        self.initiation_interval_add_sub = INITIATION_INTERVAL_CYCLES
+        self.initiation_interval_mul_div = INITIATION_INTERVAL_CYCLES
+        self.rob_size = ROB_ENTRY_NUMS
+        self.commit_width = COMMIT_WIDTH
 
         self.program_loaded = False
         self.instruction_memory = InstructionMemory()
         self.instruction_pointer = 0
         self.cycle_count = 0
-        self.data_memory = DataMemory()
+        self.stall_detection_cycles = STALL_DETECTION_CYCLES
+        self._num_idle_cycles = 0
+        # Bumped by the components on every change of state, an unchanged count over a cycle means no progress
+        self.num_state_changes = 0
+        self.hooks = EventHooks()
+        self.memory_hierarchy_config = MemoryHierarchyConfig()
+        self.latency_sampler = None
+        self.memory_disambiguation = False
+        self.x_register_bases = ()
+        self.data_memory = DataMemory(self)
         self.common_data_bus = CommonDataBus(self)
-        self.instruction_queue = InstructionQueue()
+        self.instruction_queue = InstructionQueue(INSTRUCTION_QUEUE_SLOT_NUMS)
+        self.counters = PerformanceCounters()
         self.add_sub_reservation_stations: List[ReservationStation] = []
         self.mul_div_reservation_stations: List[ReservationStation] = []
         self.load_store_reservation_stations: List[ReservationStation] = []
+        self.load_store_functional_units: Optional[FunctionalUnitPool] = None
+        self.add_sub_functional_units: Optional[FunctionalUnitPool] = None
+        self.mul_div_functional_units: Optional[FunctionalUnitPool] = None
         self.set_reservation_station_sizes(
             load_store_rs_nums=self.num_reservation_stations_load_store,
             add_sub_rs_nums=self.num_reservation_stations_add_sub,
@@ -41,12 +94,18 @@ class Processor:
     def reset(self) -> None:
         self.instruction_pointer = 0
         self.cycle_count = 0
+        self._num_idle_cycles = 0
         self.instruction_queue.reset()
+        self.counters.reset()
         self.data_memory.reset()
         self.common_data_bus.reset()
         for rs in self.get_all_reservation_stations():
             rs.reset()
+        for functional_units in self.get_functional_unit_pools():
+            functional_units.reset()
         self.scheduler.reset()
+        if self.scheduler.reorder_buffer is not None:
+            self.scheduler.reorder_buffer.reset()
 
     def set_latency_cycles(self, num_cycles_load_store, num_cycles_add_sub, num_cycles_mul_div) -> None:
         self.num_cycles_load_store = num_cycles_load_store
@@ -72,20 +131,187 @@ class Processor:
             self.add_sub_reservation_stations.append(ReservationStation(cpu=self, latency_in_cycles=self.num_cycles_add_sub))
         for i in range(mul_div_rs_nums):
             self.mul_div_reservation_stations.append(ReservationStation(cpu=self, latency_in_cycles=self.num_cycles_mul_div))
+        self._attach_functional_units()
+
+    def set_functional_units(
+            self, num_units_load_store, num_units_add_sub, num_units_mul_div,
+            initiation_interval_load_store, initiation_interval_add_sub, initiation_interval_mul_div) -> None:
+        self.num_functional_units_load_store = num_units_load_store
+        self.num_functional_units_add_sub = num_units_add_sub
+        self.num_functional_units_mul_div = num_units_mul_div
+        self.initiation_interval_load_store = initiation_interval_load_store
+        self.initiation_interval_add_sub = initiation_interval_add_sub
+        self.initiation_interval_mul_div = initiation_interval_mul_div
+        self.load_store_functional_units = _create_functional_units(
+            self, num_units_load_store, initiation_interval_load_store)
+        self.add_sub_functional_units = _create_functional_units(self, num_units_add_sub, initiation_interval_add_sub)
+        self.mul_div_functional_units = _create_functional_units(self, num_units_mul_div, initiation_interval_mul_div)
+        self._attach_functional_units()
+
+    def set_reorder_buffer_size(self, num_entries, commit_width) -> None:
+        ReorderBuffer(num_entries, commit_width)  # Validates the size before anything changes
+        self.rob_size = num_entries
+        self.commit_width = commit_width
+        if self.scheduler.reorder_buffer is not None:
+            self.scheduler.reorder_buffer = ReorderBuffer(num_entries, commit_width)
+
+    def set_memory_hierarchy_config(self, config: MemoryHierarchyConfig) -> None:
+        self.memory_hierarchy_config = config
+        self.data_memory.set_hierarchy_config(config)
+
+    def set_memory_disambiguation(self, enabled, x_register_bases=()) -> None:
+        self.memory_disambiguation = enabled
+        self.x_register_bases = tuple(x_register_bases)
+
+    def get_older_store_to_same_address(self, load_rs: ReservationStation) -> Optional[ReservationStation]:
+        # The youngest store issued before the load that writes the address it reads
+        address = effective_address(load_rs.instruction, self.x_register_bases)
+        matching_store = None
+        for rs in self.load_store_reservation_stations:
+            if rs.is_busy() and rs.instruction.is_store() and rs.is_issued_earlier_than(load_rs) and \
+                    effective_address(rs.instruction, self.x_register_bases) == address:
+                if matching_store is None or matching_store.is_issued_earlier_than(rs):
+                    matching_store = rs
+        return matching_store
+
+    def set_latency_sampler(self, sampler) -> None:
+        # sampler(instruction, issue_number) gives the execution latency of an instruction as it issues,
+        # or None for the latency of its unit
+        self.latency_sampler = sampler
+
+    def set_instruction_queue_size(self, num_slots) -> None:
+        self.instruction_queue.set_num_slots(num_slots)
+        if self.program_loaded:
+            self._fill_instruction_queue()
 
     def upload_to_memory(self, instructions) -> None:
         self.program_loaded = True
         self.instruction_memory.upload(instructions)
+        # Anything fetched from the previous program, e.g. when resizing the queue after a reset, is dropped
+        self.instruction_pointer = 0
+        self.instruction_queue.reset()
         self._fill_instruction_queue()
 
     def tick(self) -> None:
         if self.program_loaded and self._there_is_work_to_do():
             self.cycle_count += 1
+            num_state_changes = self.num_state_changes
             self.scheduler.tick()
+            if self.hooks.cycle_end is not None:
+                self.hooks.cycle_end(CycleEndEvent(self.cycle_count))
+            if self.num_state_changes != num_state_changes:
+                self._num_idle_cycles = 0
+            else:
+                self._num_idle_cycles += 1
+                if self._num_idle_cycles >= self.stall_detection_cycles:
+                    raise SimulationStalledError(self.cycle_count, self._describe_busy_stations())
 
     def there_is_work_to_do(self) -> bool:
         return self._there_is_work_to_do()
 
+    def subscribe(self, event_type, callback) -> None:
+        # Subscriptions survive resets and reconfiguration; see events.py for the event types
+        self.hooks.subscribe(event_type, callback)
+
+    def unsubscribe(self, event_type, callback) -> None:
+        self.hooks.unsubscribe(event_type, callback)
+
+    def get_program(self) -> Optional[List[Instruction]]:
+        if not self.program_loaded or self.instruction_memory.is_streaming():
+            return None
+        return self.instruction_memory.instructions
+
+    def get_num_issued_instructions(self) -> int:
+        return self.scheduler.get_issue_number()
+
+    def get_normalized_state(self) -> tuple:
+        # Everything that determines the future of the machine, with issue numbers relative to the next instruction
+        # to issue, so that a periodic program in a periodic steady state produces equal states
+        base_issue_number = self.scheduler.get_issue_number()
+        return (
+            tuple(rs.get_normalized_state(base_issue_number) for rs in self.get_all_reservation_stations()),
+            self.scheduler.get_normalized_state(),
+            self.common_data_bus.get_normalized_state(),
+            self.data_memory.get_normalized_state(),
+            tuple(functional_units.get_normalized_state() for functional_units in self.get_functional_unit_pools()),
+            None if self.scheduler.reorder_buffer is None else
+            self.scheduler.reorder_buffer.get_normalized_state(base_issue_number),
+            len(self.instruction_queue.instructions),
+            self.instruction_pointer - base_issue_number,
+        )
+
+    def skip_ahead(self, num_instructions, num_cycles, counter_deltas) -> None:
+        # Only valid when the instructions num_instructions further down the program are identical to the ones
+        # in flight, i.e. when jumping by whole periods of a periodic program
+        num_queued = len(self.instruction_queue.instructions)
+        for rs in self.get_all_reservation_stations():
+            rs.shift_issue_number(num_instructions, self.instruction_memory)
+        self.scheduler.shift_issue_number(num_instructions)
+        if self.scheduler.reorder_buffer is not None:
+            self.scheduler.reorder_buffer.shift_issue_number(num_instructions, self.instruction_memory)
+        self.instruction_pointer += num_instructions
+        first_queued = self.scheduler.get_issue_number()
+        self.instruction_queue.reset()
+        for index in range(first_queued, first_queued + num_queued):
+            self.instruction_queue.insert(self.instruction_memory[index])
+        self.cycle_count += num_cycles
+        self.counters.add_dict(counter_deltas)
+
+    def save_state(self) -> tuple:
+        stations = self.get_all_reservation_stations()
+        # Stations are referred to by their position, since they are recreated whenever their number changes
+        station_index_of = {rs.id(): index for index, rs in enumerate(stations)}
+        station_index_of[REGISTER_FILE] = REGISTER_FILE
+        return (
+            self._get_reservation_station_sizes(),
+            self.cycle_count,
+            tuple(rs.save_state(station_index_of) for rs in stations),
+            self.scheduler.save_state(station_index_of),
+            self.common_data_bus.save_state(station_index_of),
+            self.data_memory.save_state(station_index_of),
+            self.counters.as_dict(),
+            tuple(functional_units.save_state(station_index_of) for functional_units in self.get_functional_unit_pools()),
+            None if self.scheduler.reorder_buffer is None else self.scheduler.reorder_buffer.save_state(),
+        )
+
+    def restore_state(self, saved_state) -> None:
+        # The instructions in flight and in the queue are taken from the loaded program by their position, so a state
+        # can be restored on top of an edited program as long as the edits come after the instructions issued so far
+        (sizes, cycle_count, station_states, scheduler_state, bus_state, memory_state, counters,
+         functional_unit_states, reorder_buffer_state) = saved_state
+        if sizes != self._get_reservation_station_sizes():
+            raise ValueError('The saved state has a different number of reservation stations or functional units')
+        if (reorder_buffer_state is None) != (self.scheduler.reorder_buffer is None):
+            raise ValueError('The saved state was taken with a different scheduling algorithm')
+        if self.instruction_memory.is_streaming():
+            raise ValueError('The state of a streamed program cannot be restored')
+        stations = self.get_all_reservation_stations()
+        station_id_of = {index: rs.id() for index, rs in enumerate(stations)}
+        station_id_of[REGISTER_FILE] = REGISTER_FILE
+        for rs, station_state in zip(stations, station_states):
+            rs.restore_state(station_state, station_id_of, self.instruction_memory)
+        self.scheduler.restore_state(scheduler_state, station_id_of)
+        self.common_data_bus.restore_state(bus_state, stations)
+        self.data_memory.restore_state(memory_state, stations)
+        for functional_units, functional_unit_state in zip(self.get_functional_unit_pools(), functional_unit_states):
+            functional_units.restore_state(functional_unit_state, stations)
+        if reorder_buffer_state is not None:
+            self.scheduler.reorder_buffer.restore_state(reorder_buffer_state, self.instruction_memory)
+        self.cycle_count = cycle_count
+        self._num_idle_cycles = 0
+        self.counters.reset()
+        self.counters.load_dict(counters)
+        self.instruction_pointer = self.scheduler.get_issue_number()
+        self.instruction_queue.reset()
+        self._fill_instruction_queue()
+
+    def fast_forward_to_end(self, cycle_count, counters) -> None:
+        self.reset()
+        while self._fetch_instruction() is not None:
+            pass
+        self.cycle_count = cycle_count
+        self.counters.load_dict(counters)
+
     def update_instruction_queue(self) -> None:
         self.instruction_queue.consume()
         if not self._is_program_finished():
@@ -96,6 +322,13 @@ class Processor:
     def get_all_reservation_stations(self) -> List[ReservationStation]:
         return self.load_store_reservation_stations + self.add_sub_reservation_stations + self.mul_div_reservation_stations
 
+    def get_functional_unit_pools(self) -> List[FunctionalUnitPool]:
+        return [
+            functional_units for functional_units in
+            (self.load_store_functional_units, self.add_sub_functional_units, self.mul_div_functional_units)
+            if functional_units is not None
+        ]
+
     def get_instruction_texts_in_queue(self) -> List[str]:
         return self.instruction_queue.get_instructions_list_text()
 
@@ -136,13 +369,113 @@ class Processor:
                 instruction_id = id(rs.instruction)
                 instruction_state_in_text = rs.get_state_abbreviation()
                 instruction_state_table.append((instruction_id, instruction_state_in_text))
+        instruction_state_table.extend((id(instruction), 'C') for _, instruction in self._get_committed_instructions())
         return instruction_state_table
 
+    def get_reservation_stations_issue_states(self) -> List:
+        issue_state_table = []
+        for rs in self.get_all_reservation_stations():
+            if rs.state is not ReservationStation.State.FREE:
+                issue_state_table.append((rs.issue_number, rs.get_state_abbreviation()))
+        issue_state_table.extend((issue_number, 'C') for issue_number, _ in self._get_committed_instructions())
+        return issue_state_table
+
+    def get_reservation_station_states(self) -> List:
+        # One entry per station in station order: None when free, otherwise (issue number, state)
+        return [None if rs.is_free() else (rs.issue_number, rs.get_state_abbreviation())
+                for rs in self.get_all_reservation_stations()]
+
+    def get_write_back_issue_number(self) -> Optional[int]:
+        writing_rs = self.common_data_bus.get_writing_rs()
+        return None if writing_rs is None else writing_rs.issue_number
+
+    def get_memory_access_issue_number(self) -> Optional[int]:
+        winning_rs = self.data_memory.get_winning_rs()
+        return None if winning_rs is None else winning_rs.issue_number
+
+    def get_committed_issue_numbers(self) -> List[int]:
+        return [issue_number for issue_number, _ in self._get_committed_instructions()]
+
+    def get_reservation_station_of(self, issue_number) -> Optional[ReservationStation]:
+        for rs in self.get_all_reservation_stations():
+            if rs.is_busy() and rs.issue_number == issue_number:
+                return rs
+        return None
+
+    def register_is_busy(self, register) -> bool:
+        return self.scheduler.register_is_busy(register)
+
+    def has_write_back_conflict(self) -> bool:
+        # Another station lost the CDB arbitration to this cycle's writer
+        return self.common_data_bus.get_writing_rs() is not None and self.common_data_bus.has_pending_writes()
+
+    def reservation_station_class_is_full(self, station_class) -> bool:
+        stations = {
+            'load_store': self.load_store_reservation_stations,
+            'add_sub': self.add_sub_reservation_stations,
+            'mul_div': self.mul_div_reservation_stations,
+        }[station_class]
+        return all(rs.is_busy() for rs in stations)
+
     def set_scheduling_algorithm(self, algorithm) -> None:
-        self.scheduler.set_algorithm(is_tomasulo=algorithm == 'Tomasulo')
+        reorder_buffer = ReorderBuffer(self.rob_size, self.commit_width) if algorithm == TOMASULO_WITH_ROB else None
+        self.scheduler.set_algorithm(
+            is_tomasulo=algorithm in ('Tomasulo', TOMASULO_WITH_ROB), reorder_buffer=reorder_buffer
+        )
+
+    def get_scheduling_algorithm(self) -> str:
+        if self.scheduler.reorder_buffer is not None:
+            return TOMASULO_WITH_ROB
+        return 'Tomasulo' if self.scheduler.algorithm_is_tomasulo() else 'Scoreboard'
 
     def _there_is_work_to_do(self) -> bool:
-        return not(self.cycle_count != 0 and self._all_reservation_stations_are_free())
+        reorder_buffer = self.scheduler.reorder_buffer
+        return not(
+            self.cycle_count != 0 and self._all_reservation_stations_are_free()
+            and (reorder_buffer is None or reorder_buffer.is_empty())
+            # Instructions that can never issue, e.g. without a station of their class, are still work left
+            and not self.instruction_queue.has_pending_instructions() and self._is_program_finished()
+        )
+
+    def _get_committed_instructions(self) -> list:
+        reorder_buffer = self.scheduler.reorder_buffer
+        return [] if reorder_buffer is None else reorder_buffer.committed
+
+    def _describe_busy_stations(self) -> List[str]:
+        station_classes = [
+            ('load/store', self.load_store_reservation_stations),
+            ('add/sub', self.add_sub_reservation_stations),
+            ('mul/div', self.mul_div_reservation_stations),
+        ]
+        descriptions = [
+            f'{name} RS {index + 1} ({rs.instruction.raw_text}, {rs.get_state_name()})'
+            for name, stations in station_classes for index, rs in enumerate(stations) if rs.is_busy()
+        ]
+        next_instruction = self.instruction_queue.top()
+        if next_instruction is not None:
+            descriptions.append(f'instruction queue ({next_instruction.raw_text}, waiting to issue)')
+        elif not self._is_program_finished():
+            descriptions.append('instruction queue (empty, waiting to fetch)')
+        return descriptions
+
+    def _get_reservation_station_sizes(self) -> tuple:
+        return (
+            self.num_reservation_stations_load_store, self.num_reservation_stations_add_sub,
+            self.num_reservation_stations_mul_div, self.num_functional_units_load_store,
+            self.num_functional_units_add_sub, self.num_functional_units_mul_div,
+        )
+
+    def _attach_functional_units(self) -> None:
+        station_classes = [
+            (self.load_store_reservation_stations, self.load_store_functional_units),
+            (self.add_sub_reservation_stations, self.add_sub_functional_units),
+            (self.mul_div_reservation_stations, self.mul_div_functional_units),
+        ]
+        for stations, functional_units in station_classes:
+            if functional_units is not None:
+                functional_units.reset()
+            for rs in stations:
+                rs.functional_units = functional_units
 
     def _all_reservation_stations_are_free(self) -> bool:
         all_are_free = True
@@ -164,4 +497,8 @@ class Processor:
         return instruction
 
     def _is_program_finished(self):
-        return self.instruction_pointer == len(self.instruction_memory.instructions)
+        return self.instruction_memory[self.instruction_pointer] is None
+
+
+def _create_functional_units(cpu, num_units, initiation_interval) -> Optional[FunctionalUnitPool]:
+    return FunctionalUnitPool(cpu, num_units, initiation_interval) if num_units else None
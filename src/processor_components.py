@@ -1,7 +1,11 @@
 from enum import auto
-from typing import List
+from typing import List, Tuple
 
+from events import (
+    IssueEvent, OperandWakeupEvent, ExecuteStartEvent, ExecuteEndEvent, MemoryGrantEvent, CdbBroadcastEvent,
+    StationFreeEvent)
 from instruction import Instruction
+from memory_hierarchy import MemoryHierarchy, effective_address
 
 INSTRUCTION_QUEUE_SLOT_NUMS = 3
 
@@ -14,16 +18,49 @@ class InstructionMemory:
     def __init__(self):
         self.instructions = []
         self.num_instructions = 0
+        self._stream = None
+        self._stream_offset = 0
 
     def upload(self, instructions):
-        self.instructions = instructions
-        self.num_instructions = len(instructions)
+        if isinstance(instructions, list):
+            self.instructions = instructions
+            self.num_instructions = len(instructions)
+            self._stream = None
+        else:
+            self.instructions = []
+            self.num_instructions = 0
+            self._stream = iter(instructions)
+            self._stream_offset = 0
+
+    def is_streaming(self) -> bool:
+        return self._stream is not None
 
     def __getitem__(self, index):
-        if isinstance(index, int) and index < self.num_instructions:
+        if not isinstance(index, int):
+            return None
+        if self._stream is not None:
+            return self._get_streamed_instruction(index)
+        if index < self.num_instructions:
             return self.instructions[index]
         return None
 
+    def _get_streamed_instruction(self, index):
+        # Streamed programs are fetched strictly in order, so only the instructions
+        # that have not been fetched yet need to be kept around.
+        if index < self._stream_offset:
+            return None
+        num_consumed = min(index - self._stream_offset, len(self.instructions))
+        if num_consumed > 0:
+            del self.instructions[:num_consumed]
+            self._stream_offset += num_consumed
+        while self._stream_offset + len(self.instructions) <= index:
+            instruction = next(self._stream, None)
+            if instruction is None:
+                return None
+            self.instructions.append(instruction)
+            self.num_instructions += 1
+        return self.instructions[index - self._stream_offset]
+
 
 class ReservationStation:
     class State:
@@ -36,10 +73,15 @@ class ReservationStation:
         ATTEMPT_WRITEBACK = auto(), "-"
         WRITE_BACK = auto(), "W"
         READ_OPERANDS = auto(), "R"
+        WAITING_FOR_UNIT = auto(), "-"
+        WAITING_FOR_STORE = auto(), "-"
+        FORWARDED = auto(), "F"
 
     def __init__(self, cpu, latency_in_cycles):
         self._cpu = cpu
         self._latency_in_cycles = latency_in_cycles
+        # None when the station has a functional unit of its own
+        self.functional_units = None
         self.state = self.State.FREE
         self.source1_provider = REGISTER_FILE
         self.source2_provider = REGISTER_FILE
@@ -48,6 +90,8 @@ class ReservationStation:
         self.issue_number = 0
         self._writeback_succeeded = False
         self._memory_access_succeeded = False
+        self._memory_cycles_left = 0
+        self._sampled_latency_in_cycles = None
 
     def reset(self) -> None:
         self.state = self.State.FREE
@@ -58,6 +102,8 @@ class ReservationStation:
         self.issue_number = 0
         self._writeback_succeeded = False
         self._memory_access_succeeded = False
+        self._memory_cycles_left = 0
+        self._sampled_latency_in_cycles = None
 
     def id(self) -> int:
         return id(self)
@@ -74,13 +120,24 @@ class ReservationStation:
             state_abbreviation += str(self._execution_counter + 1)
         return state_abbreviation
 
+    def get_state_name(self) -> str:
+        for name, state in vars(self.State).items():
+            if state is self.state:
+                return name.lower().replace('_', ' ')
+        return ''
+
     def issue(self, instruction, issue_number) -> None:
         self.instruction = instruction
         self.state = self.State.JUST_ISSUED
         self.issue_number = issue_number
+        self._cpu.num_state_changes += 1
+        # Without a sampler, or when it has no distribution for this unit, the latency of the station applies
+        sampler = self._cpu.latency_sampler
+        self._sampled_latency_in_cycles = None if sampler is None else sampler(instruction, issue_number)
 
-    def set_memory_access_success(self, status) -> None:
+    def set_memory_access_success(self, status, latency_in_cycles=1) -> None:
         self._memory_access_succeeded = status
+        self._memory_cycles_left = latency_in_cycles
 
     def set_writeback_success(self, status) -> None:
         self._writeback_succeeded = status
@@ -91,9 +148,17 @@ class ReservationStation:
         elif self.state is self.State.WAITING_FOR_OPERANDS:
             self._state_waiting_for_operands_logic()
         elif self.state is self.State.READ_OPERANDS:
-            self.state = self.State.EXECUTING
+            self._start_execution()
         elif self.state is self.State.EXECUTING:
             self._state_executing_logic()
+        elif self.state is self.State.WAITING_FOR_UNIT:
+            self._operands_are_ready()  # A store keeps snooping the CDB for its data; resolved in arbitration
+        elif self.state is self.State.WAITING_FOR_STORE:
+            self._attempt_load()
+        elif self.state is self.State.FORWARDED:
+            self._cpu.common_data_bus.attempt_write(self)
+            self.state = self.State.ATTEMPT_WRITEBACK
+            self._cpu.num_state_changes += 1
         elif self.state is self.State.ATTEMPT_MEMORY_ACCESS:
             pass  # Resolved in after_tick()
         elif self.state is self.State.MEMORY:
@@ -101,15 +166,47 @@ class ReservationStation:
         elif self.state is self.State.ATTEMPT_WRITEBACK:
             pass  # Resolved in after_tick()
         elif self.state is self.State.WRITE_BACK:
-            self.reset()
+            self._free()
 
     def after_tick(self) -> None:
         if self.state is self.State.ATTEMPT_MEMORY_ACCESS and self._memory_access_succeeded:
             self.state = self.State.MEMORY
             self._memory_access_succeeded = False
+            self._cpu.num_state_changes += 1
         if self.state is self.State.ATTEMPT_WRITEBACK and self._writeback_succeeded:
             self.state = self.State.WRITE_BACK
             self._writeback_succeeded = False
+            self._cpu.num_state_changes += 1
+
+    def get_normalized_state(self, base_issue_number) -> tuple:
+        if self.is_free():
+            return self.State.FREE,
+        return (
+            self.state, self._execution_counter, self.issue_number - base_issue_number,
+            self.source1_provider, self.source2_provider, self._writeback_succeeded, self._memory_access_succeeded,
+            self._memory_cycles_left, self._sampled_latency_in_cycles,
+        )
+
+    def shift_issue_number(self, num_instructions, instruction_memory) -> None:
+        if self.is_busy():
+            self.issue_number += num_instructions
+            self.instruction = instruction_memory[self.issue_number]
+
+    def save_state(self, station_index_of) -> tuple:
+        return (
+            self.state, self._execution_counter, self.issue_number,
+            station_index_of[self.source1_provider], station_index_of[self.source2_provider],
+            self._writeback_succeeded, self._memory_access_succeeded, self._memory_cycles_left,
+            self._sampled_latency_in_cycles,
+        )
+
+    def restore_state(self, saved_state, station_id_of, instruction_memory) -> None:
+        (self.state, self._execution_counter, self.issue_number, source1_station, source2_station,
+         self._writeback_succeeded, self._memory_access_succeeded, self._memory_cycles_left,
+         self._sampled_latency_in_cycles) = saved_state
+        self.source1_provider = station_id_of[source1_station]
+        self.source2_provider = station_id_of[source2_station]
+        self.instruction = None if self.is_free() else instruction_memory[self.issue_number]
 
     def is_issued_earlier_than(self, rs: 'ReservationStation') -> bool:
         return self.issue_number < rs.issue_number
@@ -120,33 +217,59 @@ class ReservationStation:
         there_is_war_hazard = i_am_issued_earlier and i_still_need_operands and self.has_same_source_as_destination_of(rs)
         return there_is_war_hazard
 
+    def has_store_data(self) -> bool:
+        # Data on the CDB this cycle counts too, so the answer does not depend on whether this station ticked yet
+        return self.source1_provider in (REGISTER_FILE_OR_COMMON_DATA_BUS, self._cpu.common_data_bus.writing_rs_id())
+
     def has_same_source_as_destination_of(self, rs: 'ReservationStation') -> bool:
         return self.instruction.source1 == rs.instruction.destination or self.instruction.source2 == rs.instruction.destination
 
     def _state_just_issued_logic(self) -> None:
+        self._cpu.num_state_changes += 1
         tomasulo = self._cpu.scheduler.algorithm_is_tomasulo()
         inst_is_store = self.instruction.is_store()
         if self._operands_are_ready():
-            self.state = self.State.EXECUTING if tomasulo else self.State.READ_OPERANDS
+            if tomasulo:
+                self._start_execution()
+            else:
+                self.state = self.State.READ_OPERANDS
+        elif tomasulo and inst_is_store:
+            self._start_execution()
         else:
-            self.state = self.State.EXECUTING if tomasulo and inst_is_store else self.State.WAITING_FOR_OPERANDS
+            self.state = self.State.WAITING_FOR_OPERANDS
 
     def _state_waiting_for_operands_logic(self) -> None:
         tomasulo = self._cpu.scheduler.algorithm_is_tomasulo()
         if self._operands_are_ready():
+            self._cpu.num_state_changes += 1
             if self.instruction.is_store():
                 if tomasulo:
                     self._cpu.data_memory.attempt_access(self)
                     self.state = self.State.ATTEMPT_MEMORY_ACCESS
                 else:
                     self.state = self.State.READ_OPERANDS
+            elif tomasulo:
+                self._start_execution()
             else:
-                self.state = self.State.EXECUTING if tomasulo else self.State.READ_OPERANDS
+                self.state = self.State.READ_OPERANDS
 
     def _state_executing_logic(self) -> None:
         self._execution_counter += 1
-        if self._execution_counter == self._latency_in_cycles:
-            if self.instruction.is_load() or (self.instruction.is_store() and self._operands_are_ready()):
+        if self.instruction.is_store():
+            self._operands_are_ready()  # Snoop the CDB for the store data while the address is being computed
+        latency_in_cycles = self._latency_in_cycles
+        if self._sampled_latency_in_cycles is not None:
+            latency_in_cycles = self._sampled_latency_in_cycles
+        if self._execution_counter <= latency_in_cycles:
+            # Counting past the latency never finishes the execution, so only counting up to it is progress
+            self._cpu.num_state_changes += 1
+        if self._execution_counter == latency_in_cycles:
+            hook = self._cpu.hooks.execute_end
+            if hook is not None:
+                hook(ExecuteEndEvent(self._cpu.cycle_count - 1, self.issue_number, self))
+            if self.instruction.is_load():
+                self._attempt_load()
+            elif self.instruction.is_store() and self._operands_are_ready():
                 self._cpu.data_memory.attempt_access(self)
                 self.state = self.State.ATTEMPT_MEMORY_ACCESS
             elif self.instruction.is_store() and not self._operands_are_ready():
@@ -156,27 +279,197 @@ class ReservationStation:
                 self.state = self.State.ATTEMPT_WRITEBACK
 
     def _state_memory_logic(self) -> None:
+        self._memory_cycles_left -= 1
+        self._cpu.num_state_changes += 1
+        if self._memory_cycles_left > 0:
+            return
         if self.instruction.is_store():
-            self.reset()
+            self._free()
         else:
             self._cpu.common_data_bus.attempt_write(self)
             self.state = self.State.ATTEMPT_WRITEBACK
 
+    def _attempt_load(self) -> None:
+        # With memory disambiguation, a load that reads the address of an older store in flight takes the data
+        # from that store instead of memory, waiting for the data if the store does not have it yet
+        if self._cpu.memory_disambiguation:
+            store = self._cpu.get_older_store_to_same_address(self)
+            if store is not None:
+                if store.has_store_data():
+                    self.state = self.State.FORWARDED
+                    self._cpu.counters.forwarded_loads += 1
+                    self._cpu.num_state_changes += 1
+                else:
+                    self.state = self.State.WAITING_FOR_STORE
+                    self._cpu.counters.store_wait_cycles += 1
+                return
+        self._cpu.data_memory.attempt_access(self)
+        self.state = self.State.ATTEMPT_MEMORY_ACCESS
+        self._cpu.num_state_changes += 1
+
+    def _start_execution(self) -> None:
+        self._cpu.num_state_changes += 1
+        if self.functional_units is not None:
+            self.state = self.State.WAITING_FOR_UNIT
+            self.functional_units.request(self)
+        else:
+            self.begin_execution()
+
+    def begin_execution(self) -> None:
+        self.state = self.State.EXECUTING
+        self._cpu.num_state_changes += 1
+        hook = self._cpu.hooks.execute_start
+        if hook is not None:
+            hook(ExecuteStartEvent(self._cpu.cycle_count, self.issue_number, self))
+
+    def _free(self) -> None:
+        self._cpu.num_state_changes += 1
+        hook = self._cpu.hooks.station_free
+        if hook is not None:
+            hook(StationFreeEvent(self._cpu.cycle_count, self.issue_number, self))
+        reorder_buffer = self._cpu.scheduler.reorder_buffer
+        if reorder_buffer is not None:
+            reorder_buffer.complete(self.issue_number)
+        self.reset()
+
     def _operands_are_ready(self) -> bool:
         op1_ready = self.source1_provider == REGISTER_FILE_OR_COMMON_DATA_BUS
         op2_ready = self.source2_provider == REGISTER_FILE_OR_COMMON_DATA_BUS
         if not op1_ready and self.source1_provider == self._cpu.common_data_bus.writing_rs_id():
             self.source1_provider = COMMON_DATA_BUS
             op1_ready = True
+            self._wake_up_operand(1)
         if not op2_ready and self.source2_provider == self._cpu.common_data_bus.writing_rs_id():
             self.source2_provider = COMMON_DATA_BUS
             op2_ready = True
+            self._wake_up_operand(2)
         return op1_ready and op2_ready
 
+    def _wake_up_operand(self, operand) -> None:
+        hook = self._cpu.hooks.operand_wakeup
+        if hook is not None:
+            hook(OperandWakeupEvent(self._cpu.cycle_count, self.issue_number, self, operand))
+
+
+class FunctionalUnitPool:
+    # Identical units shared by the stations of one class. A unit takes a new operation every initiation_interval
+    # cycles, and the oldest waiting stations are dispatched first.
+    def __init__(self, cpu, num_units, initiation_interval):
+        if num_units < 1 or initiation_interval < 1:
+            raise ValueError('Functional units need at least one unit and an initiation interval of at least one cycle')
+        self._cpu = cpu
+        self._initiation_interval = initiation_interval
+        self._cycles_until_free = [0] * num_units
+        self._waiting_stations: List[ReservationStation] = []
+
+    def reset(self) -> None:
+        self._cycles_until_free = [0] * len(self._cycles_until_free)
+        self._waiting_stations.clear()
+
+    def get_size(self) -> tuple:
+        return len(self._cycles_until_free), self._initiation_interval
+
+    def request(self, rs: ReservationStation) -> None:
+        self._waiting_stations.append(rs)
+
+    def dispatch(self) -> bool:
+        # Returns whether any station is left waiting for a unit
+        if any(self._cycles_until_free):
+            # A unit that is still busy counts down towards taking the next operation, which is progress too
+            self._cpu.num_state_changes += 1
+            self._cycles_until_free = [max(0, cycles - 1) for cycles in self._cycles_until_free]
+        if self._waiting_stations:
+            self._waiting_stations.sort(key=lambda rs: rs.issue_number)
+            for unit, cycles in enumerate(self._cycles_until_free):
+                if cycles == 0 and self._waiting_stations:
+                    self._cycles_until_free[unit] = self._initiation_interval
+                    self._waiting_stations.pop(0).begin_execution()
+        return bool(self._waiting_stations)
+
+    def get_normalized_state(self) -> tuple:
+        return tuple(self._cycles_until_free), tuple(rs.id() for rs in self._waiting_stations)
+
+    def save_state(self, station_index_of) -> tuple:
+        return tuple(self._cycles_until_free), tuple(station_index_of[rs.id()] for rs in self._waiting_stations)
+
+    def restore_state(self, saved_state, stations: List[ReservationStation]) -> None:
+        cycles_until_free, waiting_stations = saved_state
+        self._cycles_until_free = list(cycles_until_free)
+        self._waiting_stations = [stations[index] for index in waiting_stations]
+
+
+class ReorderBuffer:
+    # Holds every issued instruction in issue order. An entry completes when its station is freed, i.e. after the
+    # write back or, for a store, the memory access, and up to commit_width completed entries commit from the head
+    # every cycle.
+    def __init__(self, num_entries, commit_width):
+        if num_entries < 1 or commit_width < 1:
+            raise ValueError('The reorder buffer needs at least one entry and a commit width of at least one')
+        self._num_entries = num_entries
+        self._commit_width = commit_width
+        self._entries: List[list] = []  # [issue number, instruction, completed]
+        self.committed: List[Tuple[int, Instruction]] = []  # In the current cycle
+
+    def reset(self) -> None:
+        self._entries.clear()
+        self.committed = []
+
+    def get_size(self) -> tuple:
+        return self._num_entries, self._commit_width
+
+    def has_space(self) -> bool:
+        return len(self._entries) < self._num_entries
+
+    def is_empty(self) -> bool:
+        return not self._entries
+
+    def allocate(self, issue_number, instruction) -> None:
+        self._entries.append([issue_number, instruction, False])
+
+    def complete(self, issue_number) -> None:
+        # Issue numbers in the buffer are consecutive
+        self._entries[issue_number - self._entries[0][0]][2] = True
+
+    def commit(self) -> int:
+        self.committed = []
+        while self._entries and self._entries[0][2] and len(self.committed) < self._commit_width:
+            issue_number, instruction, _ = self._entries.pop(0)
+            self.committed.append((issue_number, instruction))
+        return len(self.committed)
+
+    def get_normalized_state(self, base_issue_number) -> tuple:
+        return (
+            tuple((issue_number - base_issue_number, completed) for issue_number, _, completed in self._entries),
+            tuple(issue_number - base_issue_number for issue_number, _ in self.committed),
+        )
+
+    def shift_issue_number(self, num_instructions, instruction_memory) -> None:
+        for entry in self._entries:
+            entry[0] += num_instructions
+            entry[1] = instruction_memory[entry[0]]
+        self.committed = [
+            (issue_number + num_instructions, instruction_memory[issue_number + num_instructions])
+            for issue_number, _ in self.committed
+        ]
+
+    def save_state(self) -> tuple:
+        return (
+            tuple((issue_number, completed) for issue_number, _, completed in self._entries),
+            tuple(issue_number for issue_number, _ in self.committed),
+        )
+
+    def restore_state(self, saved_state, instruction_memory) -> None:
+        entries, committed = saved_state
+        self._entries = [
+            [issue_number, instruction_memory[issue_number], completed] for issue_number, completed in entries
+        ]
+        self.committed = [(issue_number, instruction_memory[issue_number]) for issue_number in committed]
+
 
 class InstructionQueue:
-    def __init__(self):
+    def __init__(self, num_slots=INSTRUCTION_QUEUE_SLOT_NUMS):
         self.instructions: List[Instruction] = []
+        self._num_slots = num_slots
 
     def reset(self):
         self.instructions.clear()
@@ -184,9 +477,11 @@ class InstructionQueue:
     def has_pending_instructions(self):
         return len(self.instructions) > 0
 
-    @staticmethod
-    def get_num_slots():
-        return INSTRUCTION_QUEUE_SLOT_NUMS
+    def get_num_slots(self):
+        return self._num_slots
+
+    def set_num_slots(self, num_slots):
+        self._num_slots = num_slots
 
     def get_instructions_list_text(self) -> List[str]:
         inst_list = []
@@ -195,10 +490,10 @@ class InstructionQueue:
         return inst_list
 
     def has_space(self):
-        return len(self.instructions) < INSTRUCTION_QUEUE_SLOT_NUMS
+        return len(self.instructions) < self._num_slots
 
     def num_empty_slots(self):
-        return INSTRUCTION_QUEUE_SLOT_NUMS - len(self.instructions)
+        return max(0, self._num_slots - len(self.instructions))
 
     def insert(self, instruction):
         if self.has_space():
@@ -216,7 +511,7 @@ class InstructionQueue:
             return None
 
     def __getitem__(self, index):
-        if isinstance(index, int) and index < INSTRUCTION_QUEUE_SLOT_NUMS:
+        if isinstance(index, int) and index < len(self.instructions):
             return self.instructions[index]
         return None
 
@@ -246,9 +541,25 @@ class CommonDataBus:
     def get_writing_rs(self) -> ReservationStation:
         return self._writing_rs
 
+    def get_normalized_state(self) -> tuple:
+        return tuple(rs.id() for rs in self._pending_rs_writers), self._writing_rs_id
+
+    def save_state(self, station_index_of) -> tuple:
+        writing_station = None if self._writing_rs is None else station_index_of[self._writing_rs.id()]
+        return tuple(station_index_of[rs.id()] for rs in self._pending_rs_writers), writing_station
+
+    def restore_state(self, saved_state, stations: List[ReservationStation]) -> None:
+        pending_stations, writing_station = saved_state
+        self._pending_rs_writers = [stations[index] for index in pending_stations]
+        self._writing_rs = None if writing_station is None else stations[writing_station]
+        self._writing_rs_id = 0 if self._writing_rs is None else self._writing_rs.id()
+
     def writing_rs_id(self) -> int:
         return self._writing_rs_id
 
+    def has_pending_writes(self) -> bool:
+        return self._we_have_pending_writes()
+
     def _we_have_pending_writes(self) -> bool:
         return len(self._pending_rs_writers) > 0
 
@@ -279,11 +590,42 @@ class CommonDataBus:
 
 
 class DataMemory:
-    def __init__(self):
+    def __init__(self, cpu):
+        self._cpu = cpu
         self._pending_accesses: List[ReservationStation] = []
+        self._winning_rs = None
+        self._hierarchy = None
 
     def reset(self) -> None:
         self._pending_accesses.clear()
+        self._winning_rs = None
+        if self._hierarchy is not None:
+            self._hierarchy.reset()
+
+    def set_hierarchy_config(self, config) -> None:
+        self._hierarchy = MemoryHierarchy(config) if config.is_enabled() else None
+
+    def get_winning_rs(self) -> ReservationStation:
+        return self._winning_rs
+
+    def has_pending_accesses(self) -> bool:
+        return self._there_are_pending_accesses()
+
+    def get_normalized_state(self) -> tuple:
+        hierarchy_state = None if self._hierarchy is None else self._hierarchy.save_state()
+        return tuple(rs.id() for rs in self._pending_accesses), hierarchy_state
+
+    def save_state(self, station_index_of) -> tuple:
+        winning_station = None if self._winning_rs is None else station_index_of[self._winning_rs.id()]
+        hierarchy_state = None if self._hierarchy is None else self._hierarchy.save_state()
+        return tuple(station_index_of[rs.id()] for rs in self._pending_accesses), winning_station, hierarchy_state
+
+    def restore_state(self, saved_state, stations: List[ReservationStation]) -> None:
+        pending_stations, winning_station, hierarchy_state = saved_state
+        self._pending_accesses = [stations[index] for index in pending_stations]
+        self._winning_rs = None if winning_station is None else stations[winning_station]
+        if self._hierarchy is not None:
+            self._hierarchy.restore_state(hierarchy_state)
 
     def _there_are_pending_accesses(self) -> bool:
         return len(self._pending_accesses) > 0
@@ -292,17 +634,92 @@ class DataMemory:
         self._pending_accesses.append(rs)
 
     def arbitrate_accesses(self) -> None:
+        self._winning_rs = None
+        if self._hierarchy is not None:
+            self._hierarchy.tick()
         if self._there_are_pending_accesses():
             sorted_pending_accesses = sorted(self._pending_accesses, key=lambda x: x.issue_number)
-            winning_rs = sorted_pending_accesses[0]
-            winning_rs.set_memory_access_success(True)
-            self._pending_accesses.remove(winning_rs)
+            if self._hierarchy is None:
+                self._grant_access(sorted_pending_accesses[0], latency_in_cycles=1)
+            else:
+                self._arbitrate_cached_accesses(sorted_pending_accesses)
+
+    def _arbitrate_cached_accesses(self, sorted_pending_accesses) -> None:
+        # The oldest access that can proceed wins, so hits and merged misses go ahead of a miss waiting for an MSHR
+        counters = self._cpu.counters
+        for rs in sorted_pending_accesses:
+            address = effective_address(rs.instruction, self._cpu.x_register_bases)
+            latency_in_cycles = self._hierarchy.access(address, counters)
+            if latency_in_cycles is None:
+                continue
+            if rs is not sorted_pending_accesses[0]:
+                counters.mshr_stall_cycles += 1
+            self._grant_access(rs, latency_in_cycles)
+            return
+        counters.mshr_stall_cycles += 1
+
+    def _grant_access(self, rs, latency_in_cycles) -> None:
+        rs.set_memory_access_success(True, latency_in_cycles)
+        self._pending_accesses.remove(rs)
+        self._winning_rs = rs
+
+
+class PerformanceCounters:
+    def __init__(self):
+        self.issued_instructions = 0
+        self.issue_stall_cycles = 0
+        self.write_backs = 0
+        self.write_back_stall_cycles = 0
+        self.memory_accesses = 0
+        self.memory_stall_cycles = 0
+        self.l1_hits = 0
+        self.l1_misses = 0
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.mshr_stall_cycles = 0
+        self.functional_unit_stall_cycles = 0
+        self.forwarded_loads = 0
+        self.store_wait_cycles = 0
+        self.committed_instructions = 0
+        self.rob_full_stall_cycles = 0
+
+    def reset(self) -> None:
+        self.issued_instructions = 0
+        self.issue_stall_cycles = 0
+        self.write_backs = 0
+        self.write_back_stall_cycles = 0
+        self.memory_accesses = 0
+        self.memory_stall_cycles = 0
+        self.l1_hits = 0
+        self.l1_misses = 0
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.mshr_stall_cycles = 0
+        self.functional_unit_stall_cycles = 0
+        self.forwarded_loads = 0
+        self.store_wait_cycles = 0
+        self.committed_instructions = 0
+        self.rob_full_stall_cycles = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+    def load_dict(self, counters) -> None:
+        for name, value in counters.items():
+            if hasattr(self, name):
+                setattr(self, name, value)
+
+    def add_dict(self, counters) -> None:
+        for name, value in counters.items():
+            if hasattr(self, name):
+                setattr(self, name, getattr(self, name) + value)
 
 
 class Scheduler:
     def __init__(self, cpu):
         self._cpu = cpu
         self._algorithm_is_tomasulo = True
+        self.reorder_buffer = None
         self._issue_number = 0
         self._register_stat = {"": REGISTER_FILE}
         for i in range(32):
@@ -313,8 +730,10 @@ class Scheduler:
         self._register_stat = {f'f{i}': REGISTER_FILE for i in range(32)}
         self._register_stat[""] = REGISTER_FILE
 
-    def set_algorithm(self, is_tomasulo=True) -> None:
+    def set_algorithm(self, is_tomasulo=True, reorder_buffer=None) -> None:
+        # A reorder buffer adds in-order commit on top of Tomasulo
         self._algorithm_is_tomasulo = is_tomasulo
+        self.reorder_buffer = reorder_buffer
 
     def algorithm_is_tomasulo(self) -> bool:
         return self._algorithm_is_tomasulo
@@ -322,12 +741,42 @@ class Scheduler:
     def algorithm_is_scoreboard(self) -> bool:
         return not self._algorithm_is_tomasulo
 
+    def get_issue_number(self) -> int:
+        return self._issue_number
+
+    def get_normalized_state(self) -> tuple:
+        return tuple(sorted(self._register_stat.items()))
+
+    def shift_issue_number(self, num_instructions) -> None:
+        self._issue_number += num_instructions
+
+    def register_is_busy(self, register) -> bool:
+        return self._register_stat[register] != REGISTER_FILE
+
+    def save_state(self, station_index_of) -> tuple:
+        register_stations = tuple((register, station_index_of[provider]) for register, provider in self._register_stat.items())
+        return self._issue_number, register_stations
+
+    def restore_state(self, saved_state, station_id_of) -> None:
+        self._issue_number, register_stations = saved_state
+        self._register_stat = {register: station_id_of[station] for register, station in register_stations}
+
     def tick(self) -> None:
         for rs in self._cpu.get_all_reservation_stations():
             rs.tick()
-        issued = self.attempt_issue(self._cpu.instruction_queue.top())
+        if self.reorder_buffer is not None:
+            num_committed = self.reorder_buffer.commit()
+            self._cpu.counters.committed_instructions += num_committed
+            self._cpu.num_state_changes += num_committed
+        next_instruction = self._cpu.instruction_queue.top()
+        issued = self.attempt_issue(next_instruction)
         if issued:
             self._cpu.update_instruction_queue()
+            self._cpu.counters.issued_instructions += 1
+        elif next_instruction is not None:
+            self._cpu.counters.issue_stall_cycles += 1
+            if self.reorder_buffer is not None and not self.reorder_buffer.has_space():
+                self._cpu.counters.rob_full_stall_cycles += 1
         self.arbitrate()
         for rs in self._cpu.get_all_reservation_stations():
             rs.after_tick()
@@ -336,6 +785,8 @@ class Scheduler:
         issued = False
         if instruction is None or (self.algorithm_is_scoreboard() and self._there_is_write_after_write_hazard(instruction)):
             pass
+        elif self.reorder_buffer is not None and not self.reorder_buffer.has_space():
+            pass
         elif instruction.is_add_sub():
             issued = self._attempt_assign_add_sub_inst(instruction)
         elif instruction.is_mul_div():
@@ -350,6 +801,19 @@ class Scheduler:
         self._cpu.common_data_bus.arbitrate_write_backs()
         self.update_register_stat()
         self._cpu.data_memory.arbitrate_accesses()
+        self._update_arbitration_counters()
+        stations_wait_for_units = False
+        for functional_units in self._cpu.get_functional_unit_pools():
+            stations_wait_for_units = functional_units.dispatch() or stations_wait_for_units
+        if stations_wait_for_units:
+            self._cpu.counters.functional_unit_stall_cycles += 1
+        hooks = self._cpu.hooks
+        if hooks.cdb_broadcast is not None and self._cpu.common_data_bus.get_writing_rs() is not None:
+            writing_rs = self._cpu.common_data_bus.get_writing_rs()
+            hooks.cdb_broadcast(CdbBroadcastEvent(self._cpu.cycle_count, writing_rs.issue_number, writing_rs))
+        if hooks.memory_grant is not None and self._cpu.data_memory.get_winning_rs() is not None:
+            winning_rs = self._cpu.data_memory.get_winning_rs()
+            hooks.memory_grant(MemoryGrantEvent(self._cpu.cycle_count, winning_rs.issue_number, winning_rs))
 
     def update_register_stat(self) -> None:
         writing_rs = self._cpu.common_data_bus.get_writing_rs()
@@ -413,7 +877,23 @@ class Scheduler:
 
     def _complete_assignment(self, rs, instruction) -> None:
         rs.issue(instruction, self._issue_number)
+        if self.reorder_buffer is not None:
+            self.reorder_buffer.allocate(self._issue_number, instruction)
+        hook = self._cpu.hooks.issue
+        if hook is not None:
+            hook(IssueEvent(self._cpu.cycle_count, self._issue_number, rs))
         self._issue_number += 1
 
     def _there_is_write_after_write_hazard(self, instruction) -> bool:
         return self._register_stat[instruction.destination] != REGISTER_FILE
+
+    def _update_arbitration_counters(self) -> None:
+        counters = self._cpu.counters
+        if self._cpu.common_data_bus.get_writing_rs() is not None:
+            counters.write_backs += 1
+        if self._cpu.common_data_bus.has_pending_writes():
+            counters.write_back_stall_cycles += 1
+        if self._cpu.data_memory.get_winning_rs() is not None:
+            counters.memory_accesses += 1
+        if self._cpu.data_memory.has_pending_accesses():
+            counters.memory_stall_cycles += 1
@@ -0,0 +1,90 @@
+import mmap
+import os
+import struct
+import tempfile
+from typing import Iterator, List, NamedTuple
+
+from instruction import Instruction
+
+# One fixed-size record per instruction: operation, destination, first and second source register numbers
+# (-1 when unused) and the memory offset. Loads and stores keep their x register in a source field.
+_RECORD = struct.Struct('<bbbbq')
+_MIN_OFFSET = -(1 << 63)
+_MAX_OFFSET = (1 << 63) - 1
+_HEADER = struct.Struct('<8sQ')
+_MAGIC = b'TOMAPROG'
+_OPERATIONS = [Instruction.LOAD, Instruction.STORE, Instruction.ADD, Instruction.SUB, Instruction.MUL, Instruction.DIV]
+_OPERATION_CODES = {operation: code for code, operation in enumerate(_OPERATIONS)}
+
+
+class ProgramHandle(NamedTuple):
+    path: str
+    num_instructions: int
+
+
+class ProgramBuffer:
+    # A decoded program written once to a memory-mapped file. Worker processes only receive the small handle
+    # and map the file themselves, so the program is neither pickled per task nor duplicated per worker.
+    def __init__(self, instructions: List[Instruction], directory=None):
+        file_descriptor, self._path = tempfile.mkstemp(prefix='tomasulator-', suffix='.prog', dir=directory)
+        with os.fdopen(file_descriptor, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(instructions)))
+            for inst in instructions:
+                f.write(_encode(inst))
+        self.handle = ProgramHandle(self._path, len(instructions))
+
+    def close(self) -> None:
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+    def __enter__(self) -> 'ProgramBuffer':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def load_program(handle: ProgramHandle) -> Iterator[Instruction]:
+    # Instructions are decoded one at a time straight from the mapped pages as the processor fetches them
+    with open(handle.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        magic, num_instructions = _HEADER.unpack_from(mapped, 0)
+        if magic != _MAGIC or num_instructions != handle.num_instructions:
+            raise ValueError(f'{handle.path} is not a valid program buffer')
+        for offset in range(_HEADER.size, _HEADER.size + num_instructions * _RECORD.size, _RECORD.size):
+            yield _decode(_RECORD.unpack_from(mapped, offset))
+
+
+def _encode(inst: Instruction) -> bytes:
+    offset = int(inst.offset) if inst.offset else 0
+    if not _MIN_OFFSET <= offset <= _MAX_OFFSET:
+        raise ValueError(f'The offset of "{inst.raw_text}" does not fit in a 64-bit program buffer record')
+    return _RECORD.pack(
+        _OPERATION_CODES[inst.operation], _register_number(inst.destination),
+        _register_number(inst.source1), _register_number(inst.source2), offset,
+    )
+
+
+def _decode(record) -> Instruction:
+    operation_code, destination, source1, source2, offset = record
+    inst = Instruction("")
+    inst.operation = _OPERATIONS[operation_code]
+    if inst.is_load():
+        inst.destination = f'f{destination}'
+        inst.source1 = f'x{source1}'
+        inst.offset = str(offset)
+    elif inst.is_store():
+        inst.source1 = f'f{source1}'
+        inst.source2 = f'x{source2}'
+        inst.offset = str(offset)
+    else:
+        inst.destination = f'f{destination}'
+        inst.source1 = f'f{source1}'
+        inst.source2 = f'f{source2}'
+    inst.raw_text = inst.format_text()
+    return inst
+
+
+def _register_number(register) -> int:
+    return int(register[1:]) if register else -1
@@ -0,0 +1,123 @@
+import argparse
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional
+
+from assembler import assemble
+from machine_config import MachineConfig
+from processor import SimulationStalledError
+from simulation import CycleStates, iterate_cycles, simulate, format_trace, parse_trace
+
+REGRESSION_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'regression')
+GOLDEN_EXTENSION = '.golden'
+
+
+class RegressionResult(NamedTuple):
+    file_name: str
+    passed: bool
+    message: str
+    cycle: Optional[int] = None
+
+
+def golden_file_of(program_file) -> str:
+    return os.path.splitext(program_file)[0] + GOLDEN_EXTENSION
+
+
+def find_programs(directory=REGRESSION_DIRECTORY) -> List[str]:
+    return sorted(glob.glob(os.path.join(directory, '*.asm')))
+
+
+def check_program(program_file, config=MachineConfig()) -> RegressionResult:
+    name = os.path.basename(program_file)
+    with open(program_file) as f:
+        success, offending_line, instructions = assemble(f.read().lower())
+    if not success:
+        return RegressionResult(name, False, f'assembly error at line {offending_line}')
+    try:
+        with open(golden_file_of(program_file)) as f:
+            golden_trace = parse_trace(f.read())
+    except FileNotFoundError:
+        return RegressionResult(name, False, 'missing golden trace')
+
+    num_cycles = 0
+    try:
+        for cycle, states in iterate_cycles(instructions, config):
+            num_cycles = cycle
+            expected = golden_trace[cycle - 1] if cycle <= len(golden_trace) else None
+            if states != expected:
+                return RegressionResult(name, False, _describe_mismatch(expected, states), cycle)
+    except SimulationStalledError as error:
+        return RegressionResult(name, False, str(error), error.cycle)
+    if num_cycles != len(golden_trace):
+        return RegressionResult(
+            name, False, f'finished after {num_cycles} cycles, expected {len(golden_trace)}', num_cycles + 1
+        )
+    return RegressionResult(name, True, f'{num_cycles} cycles')
+
+
+def update_golden(program_file, config=MachineConfig()) -> bool:
+    with open(program_file) as f:
+        success, _, instructions = assemble(f.read().lower())
+    if success:
+        with open(golden_file_of(program_file), 'w') as f:
+            f.write(format_trace(simulate(instructions, config).trace))
+    return success
+
+
+def run_regression(directory=REGRESSION_DIRECTORY, processes=None) -> List[RegressionResult]:
+    program_files = find_programs(directory)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(check_program, program_files))
+
+
+def format_report(results: List[RegressionResult]) -> str:
+    lines = []
+    for result in results:
+        status = 'PASS' if result.passed else 'FAIL'
+        location = f' (cycle {result.cycle})' if result.cycle is not None else ''
+        lines.append(f'{status} {result.file_name}{location}: {result.message}')
+    num_failed = sum(not result.passed for result in results)
+    if num_failed:
+        lines.append(f'Regression failed! {num_failed} of {len(results)} programs diverged')
+    else:
+        lines.append(f'Regression successful! {len(results)} programs passed')
+    return '\n'.join(lines)
+
+
+def _describe_mismatch(expected: Optional[CycleStates], actual: CycleStates) -> str:
+    if expected is None:
+        return 'simulation ran past the end of the golden trace'
+    expected_states = dict(expected)
+    actual_states = dict(actual)
+    differences = []
+    for number in sorted(set(expected_states) | set(actual_states)):
+        expected_state = expected_states.get(number, 'free')
+        actual_state = actual_states.get(number, 'free')
+        if expected_state != actual_state:
+            differences.append(f'instruction {number}: expected {expected_state}, got {actual_state}')
+    if not differences:
+        differences.append('reservation station order differs')
+    return '; '.join(differences)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the ToMasulator regression programs against their golden traces')
+    parser.add_argument('directory', nargs='?', default=REGRESSION_DIRECTORY)
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--update', action='store_true', help='Regenerate the golden traces')
+    args = parser.parse_args()
+
+    if args.update:
+        for program_file in find_programs(args.directory):
+            if not update_golden(program_file):
+                print(f'Could not assemble {program_file}')
+        return
+    results = run_regression(args.directory, args.jobs)
+    print(format_report(results))
+    sys.exit(0 if all(result.passed for result in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Optional
+
+from controller import Controller
+from machine_config import MachineConfig
+from processor import ENGINE_VERSION
+from simulation import SimulationResult, run_to_completion
+
+DEFAULT_CACHE_DIRECTORY = os.environ.get(
+    'TOMASULATOR_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'tomasulator')
+)
+DEFAULT_MAX_CACHE_BYTES = 256 * 1024 * 1024
+CACHE_FILE_EXTENSION = '.json'
+
+
+class ResultCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, max_bytes=DEFAULT_MAX_CACHE_BYTES):
+        self._directory = directory
+        self._max_bytes = max_bytes
+
+    @staticmethod
+    def key(instructions, config: MachineConfig, max_cycles=None) -> str:
+        return ResultCache.key_of_digest(ResultCache.program_digest(instructions), config, max_cycles)
+
+    @staticmethod
+    def program_digest(instructions) -> str:
+        digest = hashlib.sha256()
+        for inst in instructions:
+            digest.update(f'\n{inst.operation} {inst.destination} {inst.source1} {inst.source2} {inst.offset}'.encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def key_of_digest(program_digest, config: MachineConfig, max_cycles=None) -> str:
+        digest = hashlib.sha256()
+        digest.update(f'engine={ENGINE_VERSION};max_cycles={max_cycles};program={program_digest};'.encode())
+        digest.update(repr(sorted(config._asdict().items())).encode())
+        return digest.hexdigest()
+
+    def get(self, key) -> Optional[SimulationResult]:
+        path = self._path_of(key)
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+            os.utime(path)  # The modification time doubles as the last access time for LRU eviction
+        except (OSError, ValueError):
+            return None
+        if stored.get('engine_version') != ENGINE_VERSION:
+            return None
+        trace = [[(number, state) for number, state in states] for states in stored['trace']]
+        return SimulationResult(cycles=stored['cycles'], trace=trace, counters=stored['counters'])
+
+    def put(self, key, result: SimulationResult) -> None:
+        stored = {
+            'engine_version': ENGINE_VERSION,
+            'cycles': result.cycles,
+            'trace': result.trace,
+            'counters': result.counters,
+        }
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            file_descriptor, temp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+            with os.fdopen(file_descriptor, 'w') as f:
+                json.dump(stored, f, separators=(',', ':'))
+            os.replace(temp_path, self._path_of(key))
+            self._evict()
+        except OSError:
+            pass
+
+    def clear(self) -> None:
+        for path, _, _ in self._entries():
+            _remove_quietly(path)
+
+    def _path_of(self, key) -> str:
+        return os.path.join(self._directory, key + CACHE_FILE_EXTENSION)
+
+    def _entries(self):
+        entries = []
+        try:
+            names = os.listdir(self._directory)
+        except OSError:
+            return entries
+        for name in names:
+            if name.endswith(CACHE_FILE_EXTENSION):
+                path = os.path.join(self._directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _evict(self) -> None:
+        entries = self._entries()
+        total_bytes = sum(size for _, _, size in entries)
+        for path, _, size in sorted(entries, key=lambda entry: entry[1]):
+            if total_bytes <= self._max_bytes:
+                break
+            _remove_quietly(path)
+            total_bytes -= size
+
+
+def run_cached(controller: Controller, instructions, cache: ResultCache, max_cycles=None) -> SimulationResult:
+    key = cache.key(instructions, controller.get_machine_config(), max_cycles)
+    result = cache.get(key)
+    if result is None:
+        result = run_to_completion(controller, max_cycles)
+        if not controller.there_is_work_to_do():
+            cache.put(key, result)
+    else:
+        controller.fast_forward_to_end(result.cycles, result.counters)
+    return result
+
+
+def _remove_quietly(path) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
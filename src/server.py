@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, Iterator, List, Tuple
+
+from assembler import assemble
+from machine_config import MachineConfig, config_from_dict, validate_config
+from result_cache import ResultCache
+from simulation import simulate
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+BATCH_WINDOW_SECONDS = 0.01
+
+# Jobs and results are exchanged as one JSON object per line:
+#   request:  {"id": ..., "program": "<assembly>", "config": {<MachineConfig fields>}, "trace": false, "max_cycles": N or null}
+#   response: {"id": ..., "status": "ok", "cycles": N, "counters": {...}, "trace": [...]}
+#             {"id": ..., "status": "error", "message": "..."}
+
+
+class SimulationServer:
+    def __init__(self, processes=None, cache_directory=None, batch_window=BATCH_WINDOW_SECONDS):
+        # Forked workers would inherit the sockets of open connections and keep them from closing
+        self._num_workers = processes or os.cpu_count() or 1
+        self._executor = ProcessPoolExecutor(
+            max_workers=self._num_workers, mp_context=multiprocessing.get_context('spawn')
+        )
+        self._cache_directory = cache_directory
+        self._batch_window = batch_window
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+        self._pending_batches: Dict[tuple, List[Tuple[MachineConfig, asyncio.Future]]] = {}
+        self._program_texts: Dict[str, str] = {}
+        self._flush_scheduled = False
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT) -> None:
+        await self._warm_up()
+        server = await asyncio.start_server(self._handle_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+    async def _warm_up(self) -> None:
+        # Start the workers and import the simulator in them before the first job arrives
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self._executor, _warm_up_worker) for _ in range(self._num_workers)])
+
+    async def _handle_client(self, reader, writer) -> None:
+        write_lock = asyncio.Lock()
+        jobs = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                jobs.append(asyncio.ensure_future(self._answer(line, writer, write_lock)))
+        # Every job writes its own response, so a failure in one must not cancel the others
+        await asyncio.gather(*jobs, return_exceptions=True)
+        writer.close()
+
+    async def _answer(self, line, writer, write_lock) -> None:
+        job_id = None
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError('A job must be a JSON object')
+            job_id = job.get('id')
+            response = await self._run_job(job)
+        except Exception as error:
+            response = {'status': 'error', 'message': str(error)}
+        response['id'] = job_id
+        async with write_lock:
+            writer.write((json.dumps(response) + '\n').encode())
+            await writer.drain()
+
+    async def _run_job(self, job) -> dict:
+        program_text = job['program'].lower()
+        config = config_from_dict(job.get('config', {}))
+        # An invalid config is answered on its own instead of joining a batch
+        validate_config(config)
+        max_cycles = job.get('max_cycles')
+        max_cycles = None if max_cycles is None else int(max_cycles)
+        record_trace = bool(job.get('trace', False))
+        program_digest = hashlib.sha256(program_text.encode()).hexdigest()
+        key = (program_digest, config, max_cycles, record_trace)
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            self._in_flight[key] = future
+            self._program_texts[program_digest] = program_text
+            batch_key = (program_digest, max_cycles, record_trace)
+            self._pending_batches.setdefault(batch_key, []).append((config, future))
+            self._schedule_flush()
+        return dict(await asyncio.shield(future))
+
+    def _schedule_flush(self) -> None:
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_later(self._batch_window, self._flush)
+
+    def _flush(self) -> None:
+        # Jobs on the same program are grouped into one task, so that it is assembled once per batch
+        self._flush_scheduled = False
+        batches, self._pending_batches = self._pending_batches, {}
+        programs, self._program_texts = self._program_texts, {}
+        loop = asyncio.get_running_loop()
+        for (program_digest, max_cycles, record_trace), jobs in batches.items():
+            configs = [config for config, _ in jobs]
+            task = loop.run_in_executor(
+                self._executor, _run_batch, programs[program_digest], configs, max_cycles, record_trace,
+                self._cache_directory,
+            )
+            task.add_done_callback(partial(_resolve, [future for _, future in jobs]))
+
+
+def _resolve(futures, done) -> None:
+    error = done.exception()
+    for index, future in enumerate(futures):
+        if future.done():
+            continue
+        if error is not None:
+            future.set_result({'status': 'error', 'message': str(error)})
+        else:
+            future.set_result(done.result()[index])
+
+
+def _warm_up_worker() -> None:
+    pass
+
+
+def _run_batch(program_text, configs, max_cycles, record_trace, cache_directory) -> List[dict]:
+    success, offending_line, instructions = assemble(program_text)
+    if not success:
+        return [{'status': 'error', 'message': f'Error at line {offending_line}'}] * len(configs)
+    cache = ResultCache(cache_directory) if cache_directory else ResultCache()
+    responses = []
+    for config in configs:
+        # A failing config only fails its own job, not the rest of the batch
+        try:
+            result = simulate(instructions, config, max_cycles, cache=cache, record_trace=record_trace)
+        except Exception as error:
+            responses.append({'status': 'error', 'message': str(error)})
+            continue
+        response = {'status': 'ok', 'cycles': result.cycles, 'counters': result.counters}
+        if record_trace:
+            response['trace'] = result.trace
+        responses.append(response)
+    return responses
+
+
+def submit_jobs(jobs: List[dict], host=DEFAULT_HOST, port=DEFAULT_PORT) -> Iterator[dict]:
+    # Sends all jobs over one connection and yields the responses in the order they finish
+    with socket.create_connection((host, port)) as connection:
+        connection.sendall(''.join(json.dumps(job) + '\n' for job in jobs).encode())
+        connection.shutdown(socket.SHUT_WR)
+        with connection.makefile('r') as responses:
+            for line in responses:
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local ToMasulator simulation server')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--cache-dir', default=None, help='Result cache directory shared by all clients')
+    args = parser.parse_args()
+
+    server = SimulationServer(processes=args.jobs, cache_directory=args.cache_dir)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
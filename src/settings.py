@@ -4,10 +4,20 @@ import os
 
 _SETTINGS_FILE = 'settings.ini'
 
+_config = None
 
-def _read_settings_file(settings_file):
+
+def _get_config() -> configparser.ConfigParser:
+    global _config
+    if _config is None:
+        _config = configparser.ConfigParser()
+        _read_settings_file(_config, _SETTINGS_FILE)
+    return _config
+
+
+def _read_settings_file(config, settings_file):
     try:
-        _config.read(settings_file)
+        config.read(settings_file)
     except FileNotFoundError:
         pass
 
@@ -15,24 +25,18 @@ def _read_settings_file(settings_file):
 def get_style_from_settings_file() -> str:
     style = 'Fusion'
     try:
-        style = _config['WindowSettings']['style']
+        style = _get_config()['WindowSettings']['style']
     except KeyError:
         pass
     return style
 
 
 def save_style_in_settings_file(style: str) -> None:
+    config = _get_config()
     try:
-        _config['WindowSettings']['style'] = style
+        config['WindowSettings']['style'] = style
         if os.path.exists(_SETTINGS_FILE):
             with open(_SETTINGS_FILE, 'w') as configfile:
-                _config.write(configfile)
+                config.write(configfile)
     except (KeyError, FileNotFoundError):
         pass
-
-
-_config = configparser.ConfigParser()
-_read_settings_file(_SETTINGS_FILE)
-
-
-
@@ -0,0 +1,93 @@
+from itertools import count
+from typing import Iterator, List, NamedTuple, Tuple
+
+from controller import Controller
+from machine_config import MachineConfig
+
+# The states of all busy stations in one cycle as (instruction number, state) pairs,
+# where instruction numbers start from 1 in program order
+CycleStates = List[Tuple[int, str]]
+
+
+class SimulationResult(NamedTuple):
+    cycles: int
+    trace: List[CycleStates]
+    counters: dict
+
+
+def configure(controller: Controller, config: MachineConfig) -> None:
+    controller.set_machine_config(config)
+
+
+def iterate_controller_cycles(controller: Controller, max_cycles=None) -> Iterator[Tuple[int, CycleStates]]:
+    # Without max_cycles the simulation runs until the program finishes, a stuck machine raises SimulationStalledError
+    for _ in cycle_range(max_cycles):
+        if not controller.there_is_work_to_do():
+            break
+        controller.tick()
+        states = [(issue_number + 1, state) for issue_number, state in controller.get_reservation_stations_issue_states()]
+        yield controller.get_cycle_count(), states
+
+
+def iterate_cycles(instructions, config=MachineConfig(), max_cycles=None) -> Iterator[Tuple[int, CycleStates]]:
+    controller = Controller()
+    configure(controller, config)
+    controller.upload_to_memory(instructions)
+    return iterate_controller_cycles(controller, max_cycles)
+
+
+def run_to_completion(controller: Controller, max_cycles=None, record_trace=True) -> SimulationResult:
+    trace: List[CycleStates] = []
+    if record_trace:
+        trace = [states for _, states in iterate_controller_cycles(controller, max_cycles)]
+    else:
+        for _ in cycle_range(max_cycles):
+            if not controller.there_is_work_to_do():
+                break
+            controller.tick()
+    return SimulationResult(cycles=controller.get_cycle_count(), trace=trace, counters=controller.get_counters())
+
+
+def simulate(
+        instructions, config=MachineConfig(), max_cycles=None, cache=None, record_trace=True
+) -> SimulationResult:
+    use_cache = cache is not None and isinstance(instructions, list)
+    if use_cache:
+        key = cache.key(instructions, config, max_cycles)
+        result = cache.get(key)
+        if result is not None and (result.trace or not record_trace):
+            return result
+    controller = Controller()
+    configure(controller, config)
+    controller.upload_to_memory(instructions)
+    result = run_to_completion(controller, max_cycles, record_trace)
+    if use_cache and not controller.there_is_work_to_do():
+        cache.put(key, result)
+    return result
+
+
+def cycle_range(max_cycles) -> Iterator[int]:
+    return count() if max_cycles is None else iter(range(max_cycles))
+
+
+def format_cycle(cycle, states: CycleStates) -> str:
+    entries = ''.join(f'{number} {state} , ' for number, state in states)
+    return f'Cycle: {cycle}\n\t{entries}\n'
+
+
+def format_trace(trace: List[CycleStates]) -> str:
+    return ''.join(format_cycle(cycle, states) for cycle, states in enumerate(trace, start=1))
+
+
+def parse_trace(text) -> List[CycleStates]:
+    trace: List[CycleStates] = []
+    for line in text.split('\n'):
+        if line.startswith('Cycle:'):
+            trace.append([])
+        elif line.strip() and trace:
+            for entry in line.split(','):
+                entry = entry.strip()
+                if entry:
+                    number, state = entry.split()
+                    trace[-1].append((int(number), state))
+    return trace
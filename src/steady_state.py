@@ -0,0 +1,67 @@
+from typing import List
+
+from controller import Controller
+from instruction import Instruction
+from machine_config import MachineConfig
+from simulation import SimulationResult, configure
+
+MAX_REMEMBERED_STATES = 4096
+
+
+def find_program_period(instructions: List[Instruction]) -> int:
+    # Smallest p such that instruction i equals instruction i + p everywhere (the prefix function of KMP)
+    keys = [(inst.operation, inst.destination, inst.source1, inst.source2, inst.offset) for inst in instructions]
+    if not keys:
+        return 0
+    prefix = [0] * len(keys)
+    for i in range(1, len(keys)):
+        k = prefix[i - 1]
+        while k > 0 and keys[i] != keys[k]:
+            k = prefix[k - 1]
+        if keys[i] == keys[k]:
+            k += 1
+        prefix[i] = k
+    return len(keys) - prefix[-1]
+
+
+def run_with_extrapolation(controller: Controller, num_instructions, period) -> None:
+    # Block boundaries are the cycles in which the number of issued instructions reaches a multiple of the
+    # program period. Once the machine state at a boundary repeats, the intermediate periods are skipped.
+    seen_states = {}
+    last_num_issued = 0
+    can_skip = 0 < period <= num_instructions // 2
+    while controller.there_is_work_to_do():
+        controller.tick()
+        num_issued = controller.get_num_issued_instructions()
+        if not can_skip or num_issued == last_num_issued or num_issued % period != 0:
+            continue
+        last_num_issued = num_issued
+        state = controller.get_normalized_state()
+        cycle = controller.get_cycle_count()
+        counters = controller.get_counters()
+        if state not in seen_states:
+            if len(seen_states) >= MAX_REMEMBERED_STATES:
+                seen_states.clear()
+            seen_states[state] = num_issued, cycle, counters
+            continue
+        previous_num_issued, previous_cycle, previous_counters = seen_states[state]
+        instructions_per_period = num_issued - previous_num_issued
+        # Stay clear of the end of the program, whose arrival changes the behaviour of the fetch logic
+        remaining_instructions = num_instructions - 1 - controller.get_next_instruction_to_fetch()
+        num_periods = remaining_instructions // instructions_per_period
+        if num_periods > 0:
+            counter_deltas = {
+                name: num_periods * (value - previous_counters[name]) for name, value in counters.items()
+            }
+            controller.skip_ahead(
+                num_periods * instructions_per_period, num_periods * (cycle - previous_cycle), counter_deltas
+            )
+        can_skip = False
+
+
+def simulate_steady_state(instructions: List[Instruction], config=MachineConfig()) -> SimulationResult:
+    controller = Controller()
+    configure(controller, config)
+    controller.upload_to_memory(instructions)
+    run_with_extrapolation(controller, len(instructions), find_program_period(instructions))
+    return SimulationResult(cycles=controller.get_cycle_count(), trace=[], counters=controller.get_counters())
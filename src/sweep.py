@@ -0,0 +1,39 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from codegen_engine import CompiledEngine
+from instruction import Instruction
+from machine_config import MachineConfig
+from program_buffer import ProgramBuffer, load_program
+from simulation import SimulationResult, simulate
+
+
+def run_sweep(
+        instructions: List[Instruction], configs: List[MachineConfig], processes=None,
+        max_cycles=None, cache=None, record_trace=False, compiled=False) -> List[SimulationResult]:
+    results: List[Optional[SimulationResult]] = [None] * len(configs)
+    pending = list(range(len(configs)))
+    if cache is not None:
+        program_digest = cache.program_digest(instructions)
+        keys = [cache.key_of_digest(program_digest, config, max_cycles) for config in configs]
+        for index in list(pending):
+            result = cache.get(keys[index])
+            if result is not None and (result.trace or not record_trace):
+                results[index] = result
+                pending.remove(index)
+
+    if pending:
+        with ProgramBuffer(instructions) as program, ProcessPoolExecutor(max_workers=processes) as executor:
+            tasks = [(program.handle, configs[index], max_cycles, record_trace, compiled) for index in pending]
+            for index, result in zip(pending, executor.map(_simulate_task, tasks)):
+                results[index] = result
+                if cache is not None and (max_cycles is None or result.cycles < max_cycles):
+                    cache.put(keys[index], result)
+    return results
+
+
+def _simulate_task(task) -> SimulationResult:
+    handle, config, max_cycles, record_trace, compiled = task
+    if compiled:
+        return CompiledEngine(config).run(load_program(handle), max_cycles, record_trace)
+    return simulate(load_program(handle), config, max_cycles, record_trace=record_trace)
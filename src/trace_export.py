@@ -0,0 +1,395 @@
+import argparse
+import gzip
+import json
+import os
+import queue
+import threading
+import zlib
+from bisect import bisect_right
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from assembler import assemble
+from controller import Controller
+from machine_config import MachineConfig, config_from_dict
+from processor import SCHEDULING_ALGORITHMS
+from simulation import CycleStates, SimulationResult, configure, cycle_range
+
+TRACE_FORMAT = 'tomasulator-trace'
+TRACE_FORMAT_VERSION = 2
+# Version 1 files have no keyframes and no index, they are a single gzip member ending in the footer line
+READABLE_TRACE_FORMAT_VERSIONS = (1, 2)
+
+# A trace file is gzipped JSON Lines. The first line is a header:
+#   {"format": "tomasulator-trace", "version": 2, "config": {<MachineConfig fields>}, "instructions": [...]}
+# followed by one line per cycle in which anything changed, cycles without changes are left out:
+#   {"c": cycle, "s": [[station, instruction number, state], [station]], "w": number, "m": number, "k": [numbers]}
+# "s" only lists the stations whose state changed, a station without a number and state became free.
+# Stations are numbered in the order load/store, add/sub, mul/div. A run of execution cycles E1..En is recorded
+# once as "E" on its first cycle. "w" and "m" are the instructions that won the CDB and the memory port, "k" the
+# instructions the reorder buffer committed, which are in no station any more.
+# Every KEYFRAME_INTERVAL_CYCLES cycles a new gzip member starts with a keyframe, which lists every station instead of
+# the changed ones and the number of instructions issued so far, i.e. "f" and "i" in place of "s":
+#   {"c": cycle, "f": [[instruction number, state, first cycle of the state], null], "i": number, ...}
+# so that decoding can start at any member.
+# A member of its own then holds the footer, with the byte offset and first cycle of every member before it:
+#   {"end": cycles, "counters": {...}, "members": [[offset, first cycle], ...]}
+# The file ends in an uncompressed member of fixed size, {"index": byte offset of the footer member}, so that a reader
+# finds the footer, and from it any member, without inflating the rest of the file.
+EXECUTION_SPAN = 'E'
+JUST_ISSUED = 'I'
+COMMIT = 'C'
+KEYFRAME_INTERVAL_CYCLES = 1024
+# Members are inflated in chunks of this size
+READ_CHUNK_BYTES = 1 << 20
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# Members decoded by TraceReader that are kept, so that scrubbing around a member boundary stays cheap
+NUM_CACHED_MEMBERS = 4
+_TRAILER = '{{"index":{:20d}}}\n'
+
+
+def _encode_trailer(footer_offset) -> bytes:
+    # Stored rather than deflated and without a time stamp, so that every trailer has the same size
+    return gzip.compress(_TRAILER.format(footer_offset).encode(), compresslevel=0, mtime=0)
+
+
+TRAILER_BYTES = len(_encode_trailer(0))
+
+
+class _MemberStart(NamedTuple):
+    first_cycle: int
+
+
+class _Footer(NamedTuple):
+    record: dict
+
+
+class TraceFrame(NamedTuple):
+    cycle: int
+    # One entry per station in station order: None when free, otherwise (instruction number, state)
+    stations: List[Optional[Tuple[int, str]]]
+    num_issued: int
+    instruction_queue: List[str]
+    write_back: Optional[int]
+    memory_access: Optional[int]
+    committed: List[int]
+
+
+class TraceWriter:
+    # Records are encoded and compressed on a background thread, so writing never blocks the simulation loop
+    def __init__(self, path, header: dict):
+        self._records = queue.SimpleQueue()
+        self._error = None
+        self._thread = threading.Thread(target=self._write_records, args=(path,), daemon=True)
+        self._thread.start()
+        self.write(header)
+
+    def write(self, record: dict) -> None:
+        self._records.put(record)
+
+    def start_member(self, first_cycle) -> None:
+        self._records.put(_MemberStart(first_cycle))
+
+    def write_footer(self, footer: dict) -> None:
+        # Ends the trace, nothing may be written after the footer
+        self._records.put(_Footer(footer))
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._records.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self) -> 'TraceWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _write_records(self, path) -> None:
+        try:
+            with open(path, 'wb') as f:
+                members = [[0, 1]]  # [offset, first cycle]
+                member = gzip.GzipFile(fileobj=f, mode='wb')
+                while True:
+                    record = self._records.get()
+                    if record is None:
+                        break
+                    if isinstance(record, _MemberStart):
+                        member.close()
+                        members.append([f.tell(), record.first_cycle])
+                        member = gzip.GzipFile(fileobj=f, mode='wb')
+                    elif isinstance(record, _Footer):
+                        member.close()
+                        footer_offset = f.tell()
+                        member = gzip.GzipFile(fileobj=f, mode='wb')
+                        _write_line(member, dict(record.record, members=members))
+                        member.close()
+                        f.write(_encode_trailer(footer_offset))
+                    else:
+                        _write_line(member, record)
+                member.close()
+        except OSError as error:
+            self._error = error
+
+
+def export_trace(controller: Controller, path, max_cycles=None) -> SimulationResult:
+    program = controller.get_program()
+    header = {
+        'format': TRACE_FORMAT,
+        'version': TRACE_FORMAT_VERSION,
+        'config': controller.get_machine_config()._asdict(),
+        'instructions': None if program is None else [inst.raw_text for inst in program],
+    }
+    with TraceWriter(path, header) as writer:
+        stations: List[Optional[list]] = [None] * len(controller.get_reservation_station_states())
+        for _ in cycle_range(max_cycles):
+            if not controller.there_is_work_to_do():
+                break
+            controller.tick()
+            record = _cycle_record(controller, stations)
+            if controller.get_cycle_count() % KEYFRAME_INTERVAL_CYCLES == 0:
+                writer.start_member(controller.get_cycle_count())
+                record = _keyframe_record(controller, record, stations)
+            if record is not None:
+                writer.write(record)
+        writer.write_footer({'end': controller.get_cycle_count(), 'counters': controller.get_counters()})
+    return SimulationResult(cycles=controller.get_cycle_count(), trace=[], counters=controller.get_counters())
+
+
+def export_simulation(instructions, path, config=MachineConfig(), max_cycles=None) -> SimulationResult:
+    controller = Controller()
+    configure(controller, config)
+    controller.upload_to_memory(instructions)
+    return export_trace(controller, path, max_cycles)
+
+
+def read_trace_header(path) -> dict:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+    if header.get('format') != TRACE_FORMAT or header.get('version') not in READABLE_TRACE_FORMAT_VERSIONS:
+        versions = ' or '.join(str(version) for version in READABLE_TRACE_FORMAT_VERSIONS)
+        raise ValueError(f'{path} is not a version {versions} trace file')
+    return header
+
+
+def iterate_trace(path) -> Iterator[Tuple[int, CycleStates]]:
+    # Expands a trace file back into the states of all busy stations in every cycle, as simulation.iterate_cycles()
+    header = read_trace_header(path)
+    config = config_from_dict(header['config'])
+    num_stations = (
+        config.num_reservation_stations_load_store + config.num_reservation_stations_add_sub +
+        config.num_reservation_stations_mul_div
+    )
+    stations: List[Optional[list]] = [None] * num_stations  # [instruction number, state, first cycle of the state]
+    committed: List[Tuple[int, str]] = []  # Only in the cycle of the last record
+    cycle = 0
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        f.readline()
+        for line in f:
+            record = json.loads(line)
+            last_cycle = record['end'] if 'end' in record else record['c'] - 1
+            while cycle < last_cycle:
+                cycle += 1
+                yield cycle, _expand_states(stations, cycle) + committed
+                committed = []
+            if 'end' in record:
+                break
+            stations = _apply_record(record, stations)
+            committed = [(number, COMMIT) for number in record.get('k', [])]
+
+
+class TraceReader:
+    # Random access to the cycles of a trace file. Opening the file only reads the footer, which tells where each gzip
+    # member starts; a lookup then only decodes the member holding the cycle, from its keyframe on.
+    def __init__(self, path):
+        self.path = path
+        self.header = read_trace_header(path)
+        self.config = config_from_dict(self.header['config'])
+        self.instructions: Optional[List[str]] = self.header['instructions']
+        self.num_stations = (
+            self.config.num_reservation_stations_load_store + self.config.num_reservation_stations_add_sub +
+            self.config.num_reservation_stations_mul_div
+        )
+        self._member_offsets: List[int] = []
+        self._member_first_cycles: List[int] = []
+        self._cached_members: Dict[int, List[dict]] = {}
+        footer = self._read_footer()
+        self.num_cycles = footer['end']
+        self.counters = footer['counters']
+
+    def frame_at(self, cycle) -> TraceFrame:
+        cycle = min(max(cycle, 0), self.num_cycles)
+        stations, num_issued, record = [None] * self.num_stations, 0, None
+        if cycle > 0:
+            for _, stations, num_issued, record in self._replay(cycle):
+                break
+        record = record or {}
+        return TraceFrame(
+            cycle=cycle,
+            stations=[None if station is None else _station_state(station, cycle) for station in stations],
+            num_issued=num_issued,
+            instruction_queue=(self.instructions or [])[num_issued:num_issued + self.config.instruction_queue_size],
+            write_back=record.get('w'),
+            memory_access=record.get('m'),
+            committed=record.get('k', []),
+        )
+
+    def cycle_states(self, first_cycle, last_cycle) -> Iterator[Tuple[int, CycleStates]]:
+        # The same states as iterate_trace() for the given cycles
+        for cycle, stations, _, record in self._replay(max(first_cycle, 1)):
+            if cycle > last_cycle:
+                break
+            committed = [(number, COMMIT) for number in record.get('k', [])] if record else []
+            yield cycle, _expand_states(stations, cycle) + committed
+
+    def _replay(self, first_cycle) -> Iterator[Tuple[int, list, int, Optional[dict]]]:
+        # Yields the stations, the number of issued instructions and the record, if any, of every cycle from
+        # first_cycle to the end. The stations are updated in place.
+        member = max(0, bisect_right(self._member_first_cycles, first_cycle) - 1)
+        stations: List[Optional[list]] = [None] * self.num_stations
+        num_issued = 0
+        cycle = self._member_first_cycles[member] - 1
+        for member in range(member, len(self._member_offsets)):
+            for record in self._records_of_member(member):
+                while cycle < record['c'] - 1:
+                    cycle += 1
+                    if cycle >= first_cycle:
+                        yield cycle, stations, num_issued, None
+                cycle = record['c']
+                stations = _apply_record(record, stations)
+                num_issued = record.get('i', num_issued)
+                for change in record.get('s', []):
+                    if len(change) > 1:
+                        num_issued = max(num_issued, change[1])
+                if cycle >= first_cycle:
+                    yield cycle, stations, num_issued, record
+        while cycle < self.num_cycles:
+            cycle += 1
+            if cycle >= first_cycle:
+                yield cycle, stations, num_issued, None
+
+    def _records_of_member(self, member) -> List[dict]:
+        if member not in self._cached_members:
+            if len(self._cached_members) >= NUM_CACHED_MEMBERS:
+                del self._cached_members[next(iter(self._cached_members))]
+            lines = self._inflate_member(self._member_offsets[member])
+            records = [json.loads(line) for line in lines[1 if member == 0 else 0:]]
+            self._cached_members[member] = [record for record in records if 'end' not in record]
+        return self._cached_members[member]
+
+    def _inflate_member(self, offset) -> List[bytes]:
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+            data = []
+            while not decompressor.eof:
+                chunk = f.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                data.append(decompressor.decompress(chunk))
+        return b''.join(data).splitlines()
+
+    def _read_footer(self) -> dict:
+        footer = {}
+        if self.header['version'] == 1:
+            # A single member without an index that has to be inflated to its last line
+            self._member_offsets = [0]
+            self._member_first_cycles = [1]
+            lines = self._inflate_member(0)
+            if len(lines) > 1:
+                footer = json.loads(lines[-1])
+        else:
+            with open(self.path, 'rb') as f:
+                f.seek(max(0, f.seek(0, os.SEEK_END) - TRAILER_BYTES))
+                trailer = f.read()
+            try:
+                footer_offset = json.loads(gzip.decompress(trailer))['index']
+                footer = json.loads(self._inflate_member(footer_offset)[0])
+            except (OSError, EOFError, zlib.error, ValueError, KeyError, IndexError, TypeError):
+                pass  # No trailer, the trace was not written to the end
+            for offset, first_cycle in footer.get('members', []):
+                self._member_offsets.append(offset)
+                self._member_first_cycles.append(first_cycle)
+        if 'end' not in footer:
+            raise ValueError(f'{self.path} has no footer, the trace was not written to the end')
+        return footer
+
+
+def _write_line(member, record) -> None:
+    member.write((json.dumps(record, separators=(',', ':')) + '\n').encode())
+
+
+def _cycle_record(controller: Controller, stations) -> Optional[dict]:
+    # Updates the stations, kept in the same form as in keyframes
+    cycle = controller.get_cycle_count()
+    changes = []
+    for index, state in enumerate(controller.get_reservation_station_states()):
+        if state is not None:
+            issue_number, abbreviation = state
+            if abbreviation.startswith(EXECUTION_SPAN):
+                abbreviation = EXECUTION_SPAN
+            state = [issue_number + 1, abbreviation]
+        station = stations[index]
+        if (None if station is None else station[:2]) != state:
+            stations[index] = None if state is None else state + [cycle]
+            changes.append([index] if state is None else [index] + state)
+    record = {'c': cycle}
+    if changes:
+        record['s'] = changes
+    write_back = controller.get_write_back_issue_number()
+    if write_back is not None:
+        record['w'] = write_back + 1
+    memory_access = controller.get_memory_access_issue_number()
+    if memory_access is not None:
+        record['m'] = memory_access + 1
+    committed = controller.get_committed_issue_numbers()
+    if committed:
+        record['k'] = [issue_number + 1 for issue_number in committed]
+    return record if len(record) > 1 else None
+
+
+def _keyframe_record(controller: Controller, record, stations) -> dict:
+    keyframe = {key: value for key, value in (record or {'c': controller.get_cycle_count()}).items() if key != 's'}
+    keyframe['f'] = [None if station is None else list(station) for station in stations]
+    keyframe['i'] = controller.get_num_issued_instructions()
+    return keyframe
+
+
+def _apply_record(record, stations) -> List[Optional[list]]:
+    if 'f' in record:
+        stations = [None if station is None else list(station) for station in record['f']]
+    for change in record.get('s', []):
+        stations[change[0]] = [change[1], change[2], record['c']] if len(change) > 1 else None
+    return stations
+
+
+def _station_state(station, cycle) -> Tuple[int, str]:
+    number, state, first_cycle = station
+    if state == EXECUTION_SPAN:
+        state += str(cycle - first_cycle + 1)
+    return number, state
+
+
+def _expand_states(stations, cycle) -> CycleStates:
+    return [_station_state(station, cycle) for station in stations if station is not None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a program and export its delta-encoded trace')
+    parser.add_argument('program', help='Assembly file')
+    parser.add_argument('output', help='Trace file, e.g. trace.jsonl.gz')
+    parser.add_argument('--algorithm', choices=SCHEDULING_ALGORITHMS, default='Tomasulo')
+    parser.add_argument('--max-cycles', type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.program) as f:
+        success, offending_line, instructions = assemble(f.read().lower())
+    if not success:
+        parser.exit(1, f'Error at line {offending_line}\n')
+    result = export_simulation(instructions, args.output, MachineConfig(algorithm=args.algorithm), args.max_cycles)
+    print(f'{result.cycles} cycles written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
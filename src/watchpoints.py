@@ -0,0 +1,172 @@
+import re
+from abc import ABC, abstractmethod
+from typing import List
+
+from events import CdbBroadcastEvent, CycleEndEvent, IssueEvent, StationFreeEvent
+
+NUM_F_REGISTERS = 32
+
+
+class Watchpoint(ABC):
+    # arm() is called once before running, so that watchpoints on a transition only fire on a change that happens
+    # during the run. The controller passes the engine events in EVENT_TYPES (see events.py) to notify() and only
+    # checks the watchpoint at the end of a cycle in which notify() returned True. A watchpoint without event types
+    # is checked after every cycle.
+    EVENT_TYPES = ()
+
+    def arm(self, controller) -> None:
+        pass
+
+    def notify(self, event) -> bool:
+        return True
+
+    @abstractmethod
+    def is_triggered(self, controller) -> bool:
+        pass
+
+
+class CycleWatchpoint(Watchpoint):
+    def __init__(self, cycle):
+        self.cycle = cycle
+
+    def is_triggered(self, controller) -> bool:
+        return controller.get_cycle_count() >= self.cycle
+
+    def __str__(self):
+        return f'cycle == {self.cycle}'
+
+
+class InstructionStateWatchpoint(Watchpoint):
+    # Instructions are numbered from 1 in program order, as in the timing table. A state of E matches every
+    # execution cycle, while E3 only matches the third one. Only the station holding the instruction is looked at,
+    # every cycle from its issue until the station is freed, and a commit is looked up every cycle.
+    EVENT_TYPES = (IssueEvent, StationFreeEvent, CycleEndEvent)
+
+    def __init__(self, instruction_number, state):
+        self.instruction_number = instruction_number
+        self.state = state
+        self._station = None
+
+    def arm(self, controller) -> None:
+        self._station = controller.get_reservation_station_of(self.instruction_number - 1)
+
+    def notify(self, event) -> bool:
+        if type(event) is CycleEndEvent:
+            return self._station is not None or self.state == 'C'
+        if event.issue_number != self.instruction_number - 1:
+            return False
+        self._station = event.station if type(event) is IssueEvent else None
+        return True
+
+    def is_triggered(self, controller) -> bool:
+        issue_number = self.instruction_number - 1
+        station = self._station
+        if station is not None and station.is_busy() and station.issue_number == issue_number:
+            state = station.get_state_abbreviation()
+            return state == self.state or (self.state == 'E' and state.startswith('E'))
+        return self.state == 'C' and issue_number in controller.get_committed_issue_numbers()
+
+    def __str__(self):
+        return f'instruction {self.instruction_number} {self.state}'
+
+
+class RegisterWatchpoint(Watchpoint):
+    # A register becomes busy when a writer of it issues and free when the result is written back
+    EVENT_TYPES = (IssueEvent, CdbBroadcastEvent, StationFreeEvent)
+
+    def __init__(self, register, busy):
+        self.register = register
+        self.busy = busy
+        self._was_busy = None
+
+    def arm(self, controller) -> None:
+        self._was_busy = controller.register_is_busy(self.register)
+
+    def notify(self, event) -> bool:
+        return event.station.instruction.destination == self.register
+
+    def is_triggered(self, controller) -> bool:
+        is_busy = controller.register_is_busy(self.register)
+        became = is_busy != self._was_busy and is_busy == self.busy
+        self._was_busy = is_busy
+        return became
+
+    def __str__(self):
+        return f'{self.register} {"busy" if self.busy else "free"}'
+
+
+class CdbConflictWatchpoint(Watchpoint):
+    # There can only be a conflict in a cycle in which a result is written back
+    EVENT_TYPES = (CdbBroadcastEvent,)
+
+    def is_triggered(self, controller) -> bool:
+        return controller.has_write_back_conflict()
+
+    def __str__(self):
+        return 'cdb conflict'
+
+
+class StationsFullWatchpoint(Watchpoint):
+    STATION_CLASSES = ('load_store', 'add_sub', 'mul_div')
+    EVENT_TYPES = (IssueEvent, StationFreeEvent)
+
+    def __init__(self, station_class):
+        self.station_class = station_class
+        self._was_full = None
+
+    def arm(self, controller) -> None:
+        self._was_full = self._is_full(controller)
+
+    def notify(self, event) -> bool:
+        return _station_class_of(event.station.instruction) == self.station_class
+
+    def is_triggered(self, controller) -> bool:
+        is_full = self._is_full(controller)
+        became_full = is_full and not self._was_full
+        self._was_full = is_full
+        return became_full
+
+    def _is_full(self, controller) -> bool:
+        return controller.reservation_station_class_is_full(self.station_class)
+
+    def __str__(self):
+        return f'{self.station_class} full'
+
+
+def _station_class_of(instruction) -> str:
+    if instruction.is_load_store():
+        return 'load_store'
+    if instruction.is_add_sub():
+        return 'add_sub'
+    return 'mul_div'
+
+
+_CYCLE_PATTERN = re.compile(r'cycle\s*(?:==?)?\s*(\d+)')
+_INSTRUCTION_PATTERN = re.compile(r'(?:instruction|i)\s*(\d+)\s*(?:==?)?\s*([a-z]\d*|-)')
+_REGISTER_PATTERN = re.compile(r'(f\d+)\s*(?:==?)?\s*(busy|free)')
+_CDB_CONFLICT_PATTERN = re.compile(r'cdb\s+conflict')
+_STATIONS_FULL_PATTERN = re.compile(r'(load[_/]store|add[_/]sub|mul[_/]div)\s*(?:==?)?\s*full')
+
+
+def parse_watchpoint(text) -> Watchpoint:
+    text = text.strip().lower()
+    match = _CYCLE_PATTERN.fullmatch(text)
+    if match:
+        return CycleWatchpoint(int(match.group(1)))
+    match = _INSTRUCTION_PATTERN.fullmatch(text)
+    if match and int(match.group(1)) > 0:
+        return InstructionStateWatchpoint(int(match.group(1)), match.group(2).upper())
+    match = _REGISTER_PATTERN.fullmatch(text)
+    if match and int(match.group(1)[1:]) < NUM_F_REGISTERS:
+        return RegisterWatchpoint(match.group(1), match.group(2) == 'busy')
+    if _CDB_CONFLICT_PATTERN.fullmatch(text):
+        return CdbConflictWatchpoint()
+    match = _STATIONS_FULL_PATTERN.fullmatch(text)
+    if match:
+        return StationsFullWatchpoint(match.group(1).replace('/', '_'))
+    raise ValueError(f'Invalid watchpoint: {text}')
+
+
+def parse_watchpoints(text) -> List[Watchpoint]:
+    # Several watchpoints are separated by semicolons, the run stops at the first one that triggers
+    return [parse_watchpoint(part) for part in text.split(';') if part.strip()]
@@ -3,34 +3,45 @@ from typing import List
 from PyQt5.QtWidgets import (
     QPushButton, QLabel, QMainWindow, QTableWidget, QTableWidgetItem, QLineEdit, QGroupBox,
     QFrame, QVBoxLayout, QHBoxLayout, QComboBox, QApplication, QMessageBox, QSplitter, QWidget,
-    QStyleFactory, QAction, QFileDialog)
+    QStyleFactory, QAction, QFileDialog, QInputDialog, QSlider)
 from PyQt5.QtGui import QPainter
-from PyQt5.QtCore import Qt, QPoint
+from PyQt5.QtCore import Qt, QPoint, QTimer
 
 from custom_editor import QCodeEditor
-from assembler import assemble
+from assembler import assemble_all_errors
+from incremental import IncrementalSimulator
+from result_cache import ResultCache
 from settings import save_style_in_settings_file
+from processor import SimulationStalledError
+from simulation import run_to_completion
+from trace_export import JUST_ISSUED, TraceFrame, TraceReader
+from watchpoints import parse_watchpoints
 from window_settings import UiSettings
 
 import os
-import glob
 
 
 DEFAULT_PROGRAM = \
     "fsw  f1, 0(x1) \nfadd f1, f2, f3 \nfsub f3, f4, f1\nfmul f5, f10, f10\n" \
     "fadd f8, f2, f3 \nfsub f9, f4, f6\nfmul f10, f10, f1\n"
 
-MAX_SIMULATION_CYCLES = 500
-
-REGRESSION_DIRECTORY = "../regression"
-
 
 class MainWindow(QMainWindow):
     def __init__(self, pos_x, pos_y, width, height, title, controller):
         super().__init__()
 
         self._controller = controller
+        self._result_cache = ResultCache()
+        # Runs after an edit restart from the last checkpoint the edit cannot affect
+        self._incremental_simulator = IncrementalSimulator(controller, self._result_cache)
+        self._instructions = []
+        self._cycle_estimate = None
         self.instruction_table = {}
+        # While a recorded trace is open, the slider drives the view instead of the controller
+        self._trace_reader = None
+        self._trace_page_first_cycle = None
+        self._trace_last_cycle_shown = 0
+        self._trace_first_row = 1
 
         self.left_frame = QFrame()
         self.right_frame = QFrame()
@@ -43,6 +54,8 @@ class MainWindow(QMainWindow):
         self.load_store_reservation_station_labels: List[QLabel] = []
         self.code_editor_status_label = QLabel(self.left_frame)
         self.code_editor = QCodeEditor(self.left_frame)
+        self.trace_slider = QSlider(Qt.Horizontal, self.left_frame)
+        self.trace_cycle_label = QLabel(self.left_frame)
 
         self.timing_table = QTableWidget()
 
@@ -69,7 +82,6 @@ class MainWindow(QMainWindow):
 
         self._init_menu_bar()
         self._init_code_editor()
-        self._init_timing_table()
         self._init_instruction_queue_labels()
         self._init_reservation_station_title_labels()
         self._create_all_reservation_station_slot_labels()
@@ -77,6 +89,7 @@ class MainWindow(QMainWindow):
         self._init_combo_box()
         self._init_cycles_boxes()
         self._init_rs_num_boxes()
+        self._init_trace_slider()
 
         self.splitter = QSplitter(Qt.Horizontal)
         self.splitter.addWidget(self.left_frame)
@@ -92,6 +105,8 @@ class MainWindow(QMainWindow):
         self.setWindowTitle(title)
         self.statusBar().showMessage("")
         self.show()
+        # The timing table is the most expensive widget to set up, so it is built after the window is first shown
+        QTimer.singleShot(0, self._init_timing_table)
 
     def _init_menu_bar(self):
         menu_bar = self.menuBar()
@@ -112,6 +127,10 @@ class MainWindow(QMainWindow):
         file_menu.addAction(save_file_action)
         save_file_action.triggered.connect(self._save_file)
 
+        open_trace_action = QAction("Open trace", self)
+        file_menu.addAction(open_trace_action)
+        open_trace_action.triggered.connect(self._open_trace)
+
         run_regression_action = QAction("Run regression", self)
         file_menu.addAction(run_regression_action)
         run_regression_action.triggered.connect(self._run_regression)
@@ -120,6 +139,14 @@ class MainWindow(QMainWindow):
         file_menu.addAction(exit_action)
         exit_action.triggered.connect(self._exit_menu_action)
 
+        debug_menu = menu_bar.addMenu('&Debug')
+        run_until_action = QAction("Run until...", self)
+        debug_menu.addAction(run_until_action)
+        run_until_action.triggered.connect(self._run_until)
+        compare_action = QAction("Compare Tomasulo and Scoreboard", self)
+        debug_menu.addAction(compare_action)
+        compare_action.triggered.connect(self._compare_algorithms)
+
         help_menu = menu_bar.addMenu('Help')
         help_menu.addAction('About')
         help_menu.triggered.connect(self._help_menu_actions)
@@ -162,38 +189,50 @@ class MainWindow(QMainWindow):
             with open(file_name, "w") as f:
                 f.write(self.code_editor.toPlainText().lower())
 
-    def _run_regression(self):
+    def _open_trace(self):
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        file_name, _ = QFileDialog.getOpenFileName(
+            self, "QFileDialog.getOpenFileName()", "", "Trace Files (*.gz)", options=options
+        )
+        if not file_name:
+            return
+        try:
+            reader = TraceReader(file_name)
+        except (OSError, ValueError, KeyError) as error:
+            QMessageBox.warning(self, UiSettings.OPEN_TRACE_TITLE, str(error))
+            return
+        self._trace_reader = reader
+        self._trace_page_first_cycle = None
+        self._create_all_reservation_station_slot_labels(reader.config)
+        self.trace_slider.blockSignals(True)
+        self.trace_slider.setRange(0, reader.num_cycles)
+        self.trace_slider.setValue(0)
+        self.trace_slider.blockSignals(False)
+        self.trace_slider.show()
+        self.trace_cycle_label.show()
+        self._show_trace_cycle(0)
+
+    def _close_trace(self) -> None:
+        self._trace_reader = None
+        self.trace_slider.hide()
+        self.trace_cycle_label.hide()
+        self._update_timing_table_instructions_visual(self._instructions)
+        self.timing_table.setHorizontalHeaderLabels(
+            [str(col_number+1) for col_number in range(UiSettings.NUM_COLS_TIMING_TABLE)]
+        )
+
+    @staticmethod
+    def _run_regression():
+        from regression import run_regression, format_report
         print("Running regression testing\n...")
-        files_names = glob.glob(f'{REGRESSION_DIRECTORY}/*.asm')
-
-        simulation_results = ""
-        for file_name in files_names:
-            with open(file_name) as file:
-                raw_assembly_code = file.read()
-                success, _, instructions = assemble(raw_assembly_code)
-                if success:
-                    self._controller.reset()
-                    self._controller.upload_to_memory(instructions)
-                    self._controller.set_num_cycles(1, 3, 7)
-                    self._controller.set_reservation_station_sizes(4, 3, 2)
-                    self._update_timing_table_instructions_visual(instructions)
-                    for _ in range(MAX_SIMULATION_CYCLES):
-                        if self._controller.there_is_work_to_do():
-                            self._controller.tick()
-                            simulation_results += self._get_debug_trace() + '\n'
-
-        with open(f'{REGRESSION_DIRECTORY}/golden.txt') as file:
-            golden_results = file.read()
-
-        if simulation_results != golden_results:
-            print(f'Regression failed!')
-        else:
-            print("Regression successful!")
+        print(format_report(run_regression()))
 
     def _init_code_editor(self) -> None:
         self.code_editor.move(UiSettings.CODE_EDITOR_POS)
         self.code_editor.resize(UiSettings.CODE_EDITOR_SIZE)
         self.code_editor.setFont(UiSettings.CODE_EDITOR_FONT)
+        self.code_editor.validation_finished.connect(self._code_editor_validated)
         self.code_editor.setPlainText(DEFAULT_PROGRAM)
         self.code_editor_status_label.move(UiSettings.CODE_EDITOR_STATUS_POS)
         self.code_editor_status_label.resize(UiSettings.CODE_EDITOR_STATUS_SIZE)
@@ -212,15 +251,10 @@ class MainWindow(QMainWindow):
         row_headers = [''] + ["{:<2}".format(str(row_number+1)) for row_number in range(UiSettings.NUM_ROWS_TIMING_TABLE)]
         self.timing_table.setHorizontalHeaderLabels(col_headers)
         self.timing_table.setVerticalHeaderLabels(row_headers)
-        for col in range(UiSettings.NUM_COLS_TIMING_TABLE):
-            self.timing_table.setColumnWidth(col, UiSettings.TIMING_TABLE_COL_WIDTH)
+        self.timing_table.horizontalHeader().setDefaultSectionSize(UiSettings.TIMING_TABLE_COL_WIDTH)
 
     def _clear_timing_table(self) -> None:
-        self.timing_table.clear()
-        for row in range(UiSettings.NUM_ROWS_TIMING_TABLE):
-            for col in range(UiSettings.NUM_COLS_TIMING_TABLE):
-                item_id = QTableWidgetItem("")
-                self.timing_table.setItem(row, col + 1, item_id)
+        self.timing_table.clearContents()
 
     def _set_timing_table_row_labels(self, names: List[str]) -> None:
         self._clear_timing_table()
@@ -258,28 +292,31 @@ class MainWindow(QMainWindow):
         mul_div_name_label.adjustSize()
         mul_div_name_label.move(UiSettings.MUL_DIV_RS_TITLE_POS)
 
-    def _create_all_reservation_station_slot_labels(self) -> None:
+    def _create_all_reservation_station_slot_labels(self, config=None) -> None:
+        # A recorded trace brings its own number of stations
+        if config is None:
+            config = self._controller.get_machine_config()
         self._create_reservation_station_slot_labels(
             rs_labels=self.load_store_reservation_station_labels,
-            get_num_rs=self._controller.get_num_reservation_stations_load_store,
+            num_rs=config.num_reservation_stations_load_store,
             pos=UiSettings.LOAD_STORE_RS_SLOT_POS
         )
         self._create_reservation_station_slot_labels(
             rs_labels=self.add_sub_reservation_station_labels,
-            get_num_rs=self._controller.get_num_reservation_stations_add_sub,
+            num_rs=config.num_reservation_stations_add_sub,
             pos=UiSettings.ADD_SUB_RS_SLOT_POS
         )
         self._create_reservation_station_slot_labels(
             rs_labels=self.mul_div_reservation_station_labels,
-            get_num_rs=self._controller.get_num_reservation_stations_mul_div,
+            num_rs=config.num_reservation_stations_mul_div,
             pos=UiSettings.MUL_DIV_RS_SLOT_POS
         )
 
-    def _create_reservation_station_slot_labels(self, rs_labels, get_num_rs, pos) -> None:
+    def _create_reservation_station_slot_labels(self, rs_labels, num_rs, pos) -> None:
         for label in rs_labels:
             label.deleteLater()
         rs_labels.clear()
-        for i in range(get_num_rs()):
+        for i in range(num_rs):
             rs_labels.append(QLabel("", self.left_frame))
             rs_labels[i].show()
             rs_labels[i].setFont(UiSettings.SLOT_FONT)
@@ -310,6 +347,7 @@ class MainWindow(QMainWindow):
     def _init_combo_box(self):
         self.scheduler_selector_combo_box.addItem(UiSettings.SCHEDULER_COMBO_ITEM_TOMASULO)
         self.scheduler_selector_combo_box.addItem(UiSettings.SCHEDULER_COMBO_ITEM_SCOREBOARD)
+        self.scheduler_selector_combo_box.addItem(UiSettings.SCHEDULER_COMBO_ITEM_TOMASULO_WITH_ROB)
         self.scheduler_selector_combo_box.move(UiSettings.SCHEDULER_COMBO_POS)
         self.scheduler_selector_combo_box.currentIndexChanged.connect(self._scheduler_change)
         self.scheduler_selector_combo_box.setFont(UiSettings.BUTTONS_FONT)
@@ -363,16 +401,41 @@ class MainWindow(QMainWindow):
         rs_num_group.move(UiSettings.NUM_RS_TEXTBOX_POS)
         rs_num_group.resize(UiSettings.NUM_RS_TEXTBOX_SIZE)
 
-    def _update_code_editor_visual(self, assembly_succeeded, offending_line) -> None:
+    def _init_trace_slider(self) -> None:
+        self.trace_slider.move(UiSettings.TRACE_SLIDER_POS)
+        self.trace_slider.resize(UiSettings.TRACE_SLIDER_SIZE)
+        self.trace_slider.valueChanged.connect(self._show_trace_cycle)
+        self.trace_slider.hide()
+        self.trace_cycle_label.move(UiSettings.TRACE_CYCLE_LABEL_POS)
+        self.trace_cycle_label.resize(UiSettings.TRACE_CYCLE_LABEL_SIZE)
+        self.trace_cycle_label.setFont(UiSettings.TEXT_BOXES_FONT)
+        self.trace_cycle_label.hide()
+
+    def _update_code_editor_visual(self, assembly_succeeded, offending_lines) -> None:
         if assembly_succeeded:
             self.code_editor_status_label.setText(UiSettings.CODE_EDITOR_SUCCESS_STATUS)
             self.code_editor_status_label.setStyleSheet(UiSettings.GREEN_STYLE)
             self.code_editor.clear_highlight()
         else:
-            self.code_editor_status_label.setText(UiSettings.CODE_EDITOR_FAIL_STATUS + str(offending_line))
+            status = UiSettings.CODE_EDITOR_FAIL_STATUS + str(offending_lines[0])
+            if len(offending_lines) > 1:
+                status += UiSettings.CODE_EDITOR_MORE_ERRORS_STATUS.format(len(offending_lines) - 1)
+            self.code_editor_status_label.setText(status)
             self.code_editor_status_label.setStyleSheet(UiSettings.RED_STYLE)
             self.code_editor.clear_highlight()
-            self.code_editor.highlight_line(offending_line, UiSettings.RED_COLOR)
+            for offending_line in offending_lines:
+                self.code_editor.highlight_line(offending_line, UiSettings.RED_COLOR)
+
+    def _code_editor_validated(self, success, offending_lines, _) -> None:
+        self._update_code_editor_visual(success, offending_lines)
+
+    def _assemble_code_editor_text(self):
+        raw_assembly_code = self.code_editor.toPlainText().lower()
+        # Usually the editor has assembled the text in the background already, unless the program is very long
+        validation = self.code_editor.get_validated_program(raw_assembly_code)
+        if validation is None or (validation[0] and validation[2] is None):
+            validation = assemble_all_errors(raw_assembly_code)
+        return validation
 
     def _update_instruction_queue_visual(self) -> None:
         insts = self._controller.get_instruction_texts_in_queue()
@@ -424,6 +487,69 @@ class MainWindow(QMainWindow):
             item_id = QTableWidgetItem(inst_state_text)
             self.timing_table.setItem(self.instruction_table[inst_id], cycle_no-1, item_id)
 
+    def _update_timing_table_from_trace(self, first_cycle_no, trace) -> None:
+        for cycle_no, states in enumerate(trace, start=first_cycle_no):
+            for inst_number, inst_state_text in states:
+                item_id = QTableWidgetItem(inst_state_text)
+                self.timing_table.setItem(inst_number, cycle_no-1, item_id)
+
+    def _show_trace_cycle(self, cycle) -> None:
+        frame = self._trace_reader.frame_at(cycle)
+        rs_labels = (
+            self.load_store_reservation_station_labels + self.add_sub_reservation_station_labels +
+            self.mul_div_reservation_station_labels
+        )
+        for rs_label, station in zip(rs_labels, frame.stations):
+            rs_label.setStyleSheet(UiSettings.WHITE_STYLE)
+            if station is not None:
+                inst_number, inst_state_text = station
+                rs_label.setText(self._get_trace_instruction_text(inst_number))
+                if inst_state_text == JUST_ISSUED:
+                    rs_label.setStyleSheet(UiSettings.GREEN_STYLE)
+            else:
+                rs_label.setText("")
+        for i, slot_label in enumerate(self.instruction_queue_labels):
+            slot_label.setText(frame.instruction_queue[i] if i < len(frame.instruction_queue) else "")
+        self._update_timing_table_from_trace_file(frame)
+        self.trace_cycle_label.setText(f'Cycle {frame.cycle} of {self._trace_reader.num_cycles}')
+        self.statusBar().showMessage(f'Trace: {os.path.basename(self._trace_reader.path)}    Cycle: {frame.cycle}')
+
+    def _update_timing_table_from_trace_file(self, frame: TraceFrame) -> None:
+        # A trace is shown one page of columns at a time, so that a run of any length fits the table. The rows of
+        # a page start at the oldest instruction in flight in its first cycle.
+        num_cols = UiSettings.NUM_COLS_TIMING_TABLE
+        page_first_cycle = (max(frame.cycle, 1) - 1) // num_cols * num_cols + 1
+        if page_first_cycle != self._trace_page_first_cycle or frame.cycle < self._trace_last_cycle_shown:
+            self._start_trace_page(page_first_cycle)
+        for cycle_no, states in self._trace_reader.cycle_states(self._trace_last_cycle_shown + 1, frame.cycle):
+            for inst_number, inst_state_text in states:
+                row = inst_number - self._trace_first_row + 1
+                if 0 < row < UiSettings.NUM_ROWS_TIMING_TABLE:
+                    self.timing_table.setItem(row, cycle_no - page_first_cycle, QTableWidgetItem(inst_state_text))
+        self._trace_last_cycle_shown = max(frame.cycle, self._trace_last_cycle_shown)
+
+    def _start_trace_page(self, first_cycle) -> None:
+        self._trace_page_first_cycle = first_cycle
+        self._trace_last_cycle_shown = first_cycle - 1
+        first_frame = self._trace_reader.frame_at(first_cycle)
+        in_flight = [station[0] for station in first_frame.stations if station is not None] + first_frame.committed
+        self._trace_first_row = min(in_flight + [first_frame.num_issued + 1])
+        row_numbers = range(self._trace_first_row, self._trace_first_row + UiSettings.NUM_ROWS_TIMING_TABLE - 1)
+        row_headers = [''] + [
+            "{:>2}".format(str(row_number)) + ") " + self._get_trace_instruction_text(row_number)
+            for row_number in row_numbers
+        ]
+        self._clear_timing_table()
+        self.timing_table.setVerticalHeaderLabels(row_headers)
+        self.timing_table.setHorizontalHeaderLabels(
+            [str(first_cycle + col_number) for col_number in range(UiSettings.NUM_COLS_TIMING_TABLE)]
+        )
+
+    def _get_trace_instruction_text(self, inst_number) -> str:
+        # Traces of streamed programs do not include the instructions
+        instructions = self._trace_reader.instructions or []
+        return instructions[inst_number - 1] if inst_number <= len(instructions) else ''
+
     def _get_debug_trace(self) -> str:
         cycle_no = self._controller.get_cycle_count()
         trace = f'Cycle: {cycle_no}\n\t'
@@ -433,22 +559,86 @@ class MainWindow(QMainWindow):
         return trace
 
     def _step_button_pressed(self) -> None:
-        if self._controller.there_is_work_to_do():
-            self._controller.tick()
+        if self._trace_reader is not None:
+            self.trace_slider.setValue(self.trace_slider.value() + 1)
+        elif self._controller.there_is_work_to_do():
+            try:
+                self._controller.tick()
+            except SimulationStalledError as error:
+                self._show_stalled_error(error)
             self._update_reservation_stations_visual()
             self._update_instruction_queue_visual()
             self._update_timing_table_content_visual()
-            self.statusBar().showMessage('Cycle: ' + str(self._controller.get_cycle_count()))
+            self._update_status_bar_visual()
             # print(self._get_debug_trace())
 
     def _run_button_pressed(self) -> None:
-        for _ in range(MAX_SIMULATION_CYCLES):
-            self._step_button_pressed()
+        if self._trace_reader is not None:
+            self.trace_slider.setValue(self.trace_slider.maximum())
+            return
+        try:
+            if self._controller.get_cycle_count() == 0:
+                result = self._incremental_simulator.run(self._instructions, self._controller.get_machine_config())
+            else:
+                result = run_to_completion(self._controller)
+            self._update_timing_table_from_trace(result.cycles - len(result.trace) + 1, result.trace)
+        except SimulationStalledError as error:
+            self._show_stalled_error(error)
+        self._update_reservation_stations_visual()
+        self._update_instruction_queue_visual()
+        self._update_status_bar_visual()
+
+    def _run_until(self) -> None:
+        text, accepted = QInputDialog.getText(self, UiSettings.RUN_UNTIL_TITLE, UiSettings.RUN_UNTIL_PROMPT)
+        if not accepted or not text.strip():
+            return
+        try:
+            watchpoints = parse_watchpoints(text)
+        except ValueError as error:
+            QMessageBox.warning(self, UiSettings.RUN_UNTIL_TITLE, str(error))
+            return
+        # Only the state in which the run stopped is drawn
+        triggered = None
+        try:
+            triggered = self._controller.run_until(watchpoints)
+        except SimulationStalledError as error:
+            self._show_stalled_error(error)
+        self._update_reservation_stations_visual()
+        self._update_instruction_queue_visual()
+        self._update_timing_table_content_visual()
+        self._update_status_bar_visual()
+        if triggered is not None:
+            self.statusBar().showMessage(self.statusBar().currentMessage() + f'    Stopped at: {triggered}')
+
+    def _compare_algorithms(self) -> None:
+        from comparison import compare_algorithms
+        from comparison_window import ComparisonDialog
+        success, offending_lines, instructions = self._assemble_code_editor_text()
+        self._update_code_editor_visual(success, offending_lines)
+        if not success:
+            return
+        try:
+            comparison = compare_algorithms(instructions, self._controller.get_machine_config())
+        except SimulationStalledError as error:
+            self._show_stalled_error(error)
+            return
+        ComparisonDialog(self, instructions, comparison).show()
+
+    def _show_stalled_error(self, error) -> None:
+        QMessageBox.warning(self, UiSettings.STALLED_TITLE, str(error))
+
+    def _update_status_bar_visual(self) -> None:
+        message = 'Cycle: ' + str(self._controller.get_cycle_count())
+        if self._cycle_estimate is not None:
+            message += f'    (estimated total: {self._cycle_estimate.lower_bound} - {self._cycle_estimate.upper_bound})'
+        self.statusBar().showMessage(message)
 
     def _load_reset_button_pressed(self) -> None:
-        raw_assembly_code = self.code_editor.toPlainText().lower()
-        success, offending_line, instructions = assemble(raw_assembly_code)
+        if self._trace_reader is not None:
+            self._close_trace()
+        success, offending_lines, instructions = self._assemble_code_editor_text()
         if success:
+            self._instructions = instructions
             self._controller.reset()
             self._controller.upload_to_memory(instructions)
             self._set_latency_cycles()
@@ -456,7 +646,9 @@ class MainWindow(QMainWindow):
             self._create_all_reservation_station_slot_labels()
             self._update_instruction_queue_visual()
             self._update_timing_table_instructions_visual(instructions)
-        self._update_code_editor_visual(success, offending_line)
+            self._cycle_estimate = self._controller.estimate_cycles()
+            self._update_status_bar_visual()
+        self._update_code_editor_visual(success, offending_lines)
         self._update_reservation_stations_visual()
 
     def _scheduler_change(self):
@@ -531,4 +723,5 @@ class MainWindow(QMainWindow):
         self._draw_wires()
 
     def load_reset(self) -> None:
-        self._load_reset_button_pressed()
+        # Queued behind the deferred timing table setup
+        QTimer.singleShot(0, self._load_reset_button_pressed)
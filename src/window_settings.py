@@ -12,8 +12,15 @@ class UiSettings:
     LOAD_BUTTON_TOOLTIP = 'Load the program into the instruction queue / reset the processor'
     STEP_BUTTON_TOOLTIP = 'Step one cycle'
     RUN_BUTTON_TOOLTIP = 'Run all the code to the end'
+    RUN_UNTIL_TITLE = 'Run until'
+    STALLED_TITLE = 'Simulation stalled'
+    OPEN_TRACE_TITLE = 'Open trace'
+    COMPARISON_WINDOW_TITLE = 'Tomasulo vs Scoreboard'
+    RUN_UNTIL_PROMPT = 'Stop at (separate several conditions with ;)\n' \
+                       'e.g. cycle == 400; instruction 12 W; f3 busy; f3 free; cdb conflict; mul/div full'
     SCHEDULER_COMBO_ITEM_TOMASULO = 'Tomasulo'
     SCHEDULER_COMBO_ITEM_SCOREBOARD = 'Scoreboard'
+    SCHEDULER_COMBO_ITEM_TOMASULO_WITH_ROB = 'Tomasulo+ROB'
     SCHEDULER_TITLE = 'Algorithm:'
     LOAD_STORE_CYCLES_NUM_TITLE = 'No. Cycles for Load/Store'
     ADD_SUB_CYCLES_NUM_TITLE = 'No. Cycles for Add/Sub'
@@ -27,6 +34,7 @@ class UiSettings:
     MUL_DIV_RS_TITLE = 'Mul/Div RS'
     CODE_EDITOR_SUCCESS_STATUS = 'Pass'
     CODE_EDITOR_FAIL_STATUS = 'Error at line '
+    CODE_EDITOR_MORE_ERRORS_STATUS = ' (+{} more)'
 
     SLOT_FONT = QFont('Consolas', 14)
     SLOT_TITLE_FONT = QFont('Arial', 11)
@@ -68,6 +76,12 @@ class UiSettings:
     NUM_CYCLES_TEXTBOX_SIZE = QSize(220, 80)
     NUM_RS_TEXTBOX_POS = QPoint(400, 100)
     NUM_RS_TEXTBOX_SIZE = NUM_CYCLES_TEXTBOX_SIZE
+    TRACE_SLIDER_POS = QPoint(10, 255)
+    TRACE_SLIDER_SIZE = QSize(250, 25)
+    TRACE_CYCLE_LABEL_POS = QPoint(10, 285)
+    TRACE_CYCLE_LABEL_SIZE = QSize(250, 25)
+
+    COMPARISON_WINDOW_SIZE = QSize(1400, 500)
 
     NUM_ROWS_TIMING_TABLE = 50 + 1
     NUM_COLS_TIMING_TABLE = 200
@@ -0,0 +1,145 @@
+import argparse
+import random
+import sys
+from collections import OrderedDict
+from itertools import islice
+from typing import Dict, Iterator, Optional
+
+from instruction import Instruction
+
+DEFAULT_INSTRUCTION_MIX = {
+    Instruction.ADD: 3, Instruction.SUB: 2, Instruction.MUL: 2, Instruction.DIV: 1,
+    Instruction.LOAD: 2, Instruction.STORE: 1,
+}
+# A distance of 0 means the operand does not depend on any recent instruction
+DEFAULT_DEPENDENCY_DISTANCES = {0: 2, 1: 3, 2: 2, 3: 1, 4: 1}
+DEFAULT_NUM_REGISTERS = 32
+DEFAULT_HAZARD_DENSITY = 0.1
+
+NUM_F_REGISTERS = 32
+NUM_X_REGISTERS = 4
+MAX_MEMORY_OFFSET = 256
+RECENT_REGISTERS_WINDOW = 4
+
+
+class WorkloadGenerator:
+    def __init__(
+            self, seed=0, instruction_mix: Optional[Dict[str, float]] = None,
+            dependency_distances: Optional[Dict[int, float]] = None,
+            num_registers=DEFAULT_NUM_REGISTERS, hazard_density=DEFAULT_HAZARD_DENSITY):
+        instruction_mix = DEFAULT_INSTRUCTION_MIX if instruction_mix is None else instruction_mix
+        dependency_distances = DEFAULT_DEPENDENCY_DISTANCES if dependency_distances is None else dependency_distances
+        _check_weights(instruction_mix, 'instruction mix', lambda op: op in DEFAULT_INSTRUCTION_MIX)
+        _check_weights(dependency_distances, 'dependency distances', lambda d: isinstance(d, int) and d >= 0)
+        if not 1 <= num_registers <= NUM_F_REGISTERS:
+            raise ValueError(f'Number of registers must be between 1 and {NUM_F_REGISTERS}')
+        if not 0.0 <= hazard_density <= 1.0:
+            raise ValueError('Hazard density must be between 0 and 1')
+        self._seed = seed
+        self._operations = list(instruction_mix.keys())
+        self._operation_weights = list(instruction_mix.values())
+        self._distances = list(dependency_distances.keys())
+        self._distance_weights = list(dependency_distances.values())
+        self._num_registers = num_registers
+        self._hazard_density = hazard_density
+
+    def lines(self, num_instructions) -> Iterator[str]:
+        for instruction in self.instructions(num_instructions):
+            yield instruction.raw_text
+
+    def instructions(self, num_instructions) -> Iterator[Instruction]:
+        rng = random.Random(self._seed)
+        # Least recently used registers first, most recently used last
+        register_usage = OrderedDict((f'f{i}', None) for i in range(self._num_registers))
+        recent_destinations = [""] * (max(self._distances) + 1)
+        for i in range(num_instructions):
+            operation = rng.choices(self._operations, self._operation_weights)[0]
+            inst = Instruction("")
+            inst.operation = operation
+            if inst.is_load():
+                inst.destination = self._pick_destination(rng, register_usage)
+                inst.offset, inst.source1 = self._pick_address(rng)
+            elif inst.is_store():
+                inst.source1 = self._pick_source(rng, i, recent_destinations, register_usage)
+                inst.offset, inst.source2 = self._pick_address(rng)
+            else:
+                inst.source1 = self._pick_source(rng, i, recent_destinations, register_usage)
+                inst.source2 = self._pick_source(rng, i, recent_destinations, register_usage)
+                inst.destination = self._pick_destination(rng, register_usage)
+            inst.raw_text = inst.format_text()
+            recent_destinations[i % len(recent_destinations)] = inst.destination
+            yield inst
+
+    def write(self, stream, num_instructions) -> None:
+        for line in self.lines(num_instructions):
+            stream.write(line + '\n')
+
+    def _pick_source(self, rng, index, recent_destinations, register_usage) -> str:
+        distance = rng.choices(self._distances, self._distance_weights)[0]
+        register = ""
+        if 0 < distance <= index:
+            register = recent_destinations[(index - distance) % len(recent_destinations)]
+        if not register:
+            register = rng.choice(list(register_usage.keys()))
+        register_usage.move_to_end(register)
+        return register
+
+    def _pick_destination(self, rng, register_usage) -> str:
+        if rng.random() < self._hazard_density:
+            recently_used = list(islice(reversed(register_usage), RECENT_REGISTERS_WINDOW))
+            register = rng.choice(recently_used)
+        else:
+            register = next(iter(register_usage))
+        register_usage.move_to_end(register)
+        return register
+
+    @staticmethod
+    def _pick_address(rng):
+        offset = str(4 * rng.randrange(MAX_MEMORY_OFFSET // 4))
+        base_register = f'x{rng.randrange(1, NUM_X_REGISTERS + 1)}'
+        return offset, base_register
+
+
+def _check_weights(weights, name, key_is_valid) -> None:
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError(f'The {name} must have at least one positive weight')
+    for key, weight in weights.items():
+        if not key_is_valid(key) or weight < 0:
+            raise ValueError(f'Invalid entry in the {name}: {key}={weight}')
+
+
+def _parse_weights(text, key_type):
+    weights = {}
+    for entry in text.split(','):
+        key, weight = entry.split('=')
+        weights[key_type(key.strip())] = float(weight)
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic ToMasulator assembly program')
+    parser.add_argument('num_instructions', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mix', help='Instruction mix, e.g. fadd=3,fmul=1,flw=2')
+    parser.add_argument('--distances', help='Dependency distance weights, e.g. 0=1,1=4,2=2')
+    parser.add_argument('--registers', type=int, default=DEFAULT_NUM_REGISTERS)
+    parser.add_argument('--hazards', type=float, default=DEFAULT_HAZARD_DENSITY, help='WAR/WAW hazard density')
+    parser.add_argument('--output', '-o', help='Output file (default: standard output)')
+    args = parser.parse_args()
+
+    generator = WorkloadGenerator(
+        seed=args.seed,
+        instruction_mix=_parse_weights(args.mix, str) if args.mix else None,
+        dependency_distances=_parse_weights(args.distances, int) if args.distances else None,
+        num_registers=args.registers,
+        hazard_density=args.hazards,
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            generator.write(f, args.num_instructions)
+    else:
+        generator.write(sys.stdout, args.num_instructions)
+
+
+if __name__ == '__main__':
+    main()